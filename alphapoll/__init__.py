@@ -0,0 +1,4 @@
+async def setup(bot):
+    # Imported here so the parser, vote store and benchmarks load without Red.
+    from .alphapoll import AlphaPoll
+    await bot.add_cog(AlphaPoll(bot))
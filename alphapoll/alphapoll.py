@@ -1,142 +1,380 @@
 # -*- coding: utf-8 -*-
-import discord
-import collections
 import asyncio
+import json
+import logging
+import os
 import re
-from discord.ext import commands
+import time
+from redbot.core import Config, checks, commands
+from perfstats import registry as perf
+from perfstats.red import after_invoke, attach_cog, before_invoke, detach_cog
+from .client import DiscordClient
+from .ingest import ReactionInbox
+from .live import EditDebouncer, bar
+from .reactions import ReactionQueues
+from .scheduler import DeadlineScheduler
+from .spec import MAX_REACTIONS, PollSpec, PollSyntaxError, TooManyChoices, parse_poll
+from .storage import PollStore
+from .votes import MAX_ORDERED, VoteStore, instant_runoff
+
+log = logging.getLogger("red.alphapoll")
+DB_PATH = os.path.join(os.path.expanduser("~/.alphapoll"), "polls.db")
 
 # This cog is a fork of ReactPoll by FlapJack.
 # The original ReactPoll did not support more than 9 options.
 # This reaction based poll will support the maximum allowed reacts by discord.
 # Fork by BraveLittleRoaster to include the full amount of reacts so polls of all available sizes are supported.
 
-class AlphaPoll:
+class AlphaPoll(commands.Cog):
 
 	"""Create polls using emoji reactions"""
 
-	def __init__(self, bot):
+	def __init__(self, bot, client=None, db_path=DB_PATH):
 		self.bot = bot
-		self.poll_sessions = []
+		# All Discord I/O goes through the client, so a fake one runs the cog offline.
+		self.client = client if client is not None else DiscordClient(bot)
+		loop = self.client.loop
+		self.polls_by_channel = {}  # channel id -> running poll
+		self.polls_by_message = {}  # poll message id -> running poll, once the poll message has been sent
+		self.config = Config.get_conf(self, identifier=6174203783, force_registration=True)
+		self.config.register_global(reconcile_on_end=False, archive_ballots=False)
+		self.reconcile_on_end = False  # Refetch the poll message at the end to check the tally against Discord.
+		self.archive_ballots = False  # Keep every voter's choices in the archive, not just the totals.
+		self.history_page_size = 10
+		self.store = PollStore(db_path)
+		self.scheduler = DeadlineScheduler(loop)  # Every poll's start, reminder and end, on one task.
+		self.scheduler.start()
+		# Reaction adds and removals, paced per channel, for every poll.
+		self.reactions = ReactionQueues(self.client.add_reaction, self.client.remove_reaction, loop=loop)
+		# Reaction events, queued per poll by the listeners and applied to the tally by one worker per poll.
+		self.inbox = ReactionInbox(self.apply_reaction, lambda p: p.schedule_resync(), loop=loop)
+		self.resync_delay = 5  # Seconds after a poll first drops reaction events before its tally is rebuilt.
+		self.live_interval = 5  # Default seconds between edits of a live poll's message
+		self.min_live_interval = 2
+		self.flush_interval = 5  # Seconds between batched writes of changed polls.
+		self.flush_task = loop.create_task(self.flush_loop())
+		self.restore_task = loop.create_task(self.restore_polls())
+
+	async def cog_load(self):
+		self.reconcile_on_end = await self.config.reconcile_on_end()
+		self.archive_ballots = await self.config.archive_ballots()
+		await attach_cog(self.bot, "AlphaPoll")
+
+	def cog_unload(self):
+		# Running polls aren't ended here; they're saved and pick up where they left off when the cog loads again.
+		self.flush_task.cancel()
+		self.restore_task.cancel()
+		self.scheduler.close()
+		self.inbox.close()
+		self.reactions.close()
+		self.store.close()
+		detach_cog(self.bot, "AlphaPoll")
+
+	async def cog_before_invoke(self, ctx):
+		before_invoke(ctx)
+
+	async def cog_after_invoke(self, ctx):
+		after_invoke(ctx)
+
+	async def cog_check(self, ctx):
+		# Polls and their history belong to a server channel.
+		return ctx.guild is not None
+
+	async def flush_loop(self):
+		while True:
+			await asyncio.sleep(self.flush_interval)
+			try:
+				await self.store.flush()
+			except Exception:
+				log.exception("Error saving AlphaPoll polls")
+				perf.incr("alphapoll.store_errors")
 
-	@commands.command(pass_context=True, no_pm=True)
-	async def multipoll(self, ctx, *text):
+	async def restore_polls(self):
+		"""Picks up the polls that were running when the bot stopped or the cog was unloaded."""
+		await self.client.wait_until_ready()
+		for message_id, channel_id, state in await self.store.load():
+			# IDs come back as the strings they were saved as (and always were, for polls saved by the Red v2 cog).
+			channel = self.client.get_channel(int(channel_id))
+			if channel is None:
+				self.store.forget(message_id)
+				continue
+			try:
+				messages = [await self.client.fetch_message(channel, int(poll_message_id))
+							for poll_message_id in state.get("messages", [message_id])]
+			except Exception as e:
+				log.warning("Could not restore poll %s: %s", message_id, e)
+				continue  # Left in the store to try again on the next load.
+			if None in messages:
+				self.store.forget(message_id)  # A poll message was deleted while we were away.
+				continue
+
+			p = NewReactPoll.restore(self, channel, messages, state)
+			for message in messages:
+				self.index_message(p, message)
+			if channel.id in self.polls_by_channel:
+				# Someone started a new poll here before this one came back; close this one out.
+				await p.endPoll(expired=True)
+				continue
+			self.add_session(p)
+			seeded = await p.reconcile_votes(messages)
+			if not p.valid:
+				continue  # Stopped while its reactions were being fetched.
+			# Finish seeding options whose reactions hadn't been added when the bot went away.
+			p.seed(seeded)
+			p.start_live()
+			p.changed()
+			p.schedule()
+			perf.incr("alphapoll.polls_restored")
+
+	def add_session(self, poll):
+		self.polls_by_channel[poll.channel.id] = poll
+
+	def index_message(self, poll, message):
+		self.polls_by_message[message.id] = poll
+
+	def remove_session(self, poll):
+		# Only drop entries that still point at this poll, so a stale end can't remove a newer poll.
+		if self.polls_by_channel.get(poll.channel.id) is poll:
+			del self.polls_by_channel[poll.channel.id]
+		for message in poll.messages:
+			if self.polls_by_message.get(message.id) is poll:
+				del self.polls_by_message[message.id]
+		if poll.message is not None:
+			self.store.mark_ended(poll)
+
+	@commands.command()
+	async def multipoll(self, ctx, *, text: str = ""):
 		"""Starts/stops a reaction poll
 		Usage example (time  and  multiple choice arguments are optional)
 		multipoll Is this a poll?;Yes;No;Maybe;n=1;t=60
+		Start it later with s=<seconds>, and get a reminder r=<seconds> before it closes.
+		Add live=on (or live=<seconds>) to keep running results on the poll message.
+		Pick the reaction emojis with e=numbers, e=letters, e=colors, e=fruit or e=<your own emojis>.
+		m=approval lets voters pick any number of options; m=ranked counts ranked choices by instant runoff.
+		multipoll extend <seconds> (negative to shorten)
 		multipoll stop"""
-		message = ctx.message
-		channel = message.channel
-		server = message.server
-		if len(text) == 1:
-			if text[0].lower() == "stop":
-				await self.endpoll(message)
-				return
-		if not self.getPollByChannel(message):
-			check = " ".join(text).lower()
-			if "@everyone" in check or "@here" in check:
-				await self.bot.say("Nice try.")
-				return
-			if not channel.permissions_for(server.me).manage_messages:
-				await self.bot.say("I require the 'Manage Messages' "
-								   "permission in this channel to conduct "
-								   "a reaction poll.")
-				return
-			p = NewReactPoll(message, " ".join(text), self)
-			if p.valid:
-				if p.mc_valid:
-					self.poll_sessions.append(p)
-					await p.start()
-				else:
-					await self.bot.say("`Number of votes per person is greater than number of options`")
-			else:
-				await self.bot.say("`[p]multipoll question;option1;option2...;n=1;t=60`")
-		else:
-			await self.bot.say("A reaction poll is already ongoing in this channel.")
+		await self.poll_command(ctx, text, "`[p]multipoll question;option1;option2...;n=1;t=60`")
 
-	async def endpoll(self, message):
-		if self.getPollByChannel(message):
-			p = self.getPollByChannel(message)
-			if p.author == message.author.id:  # or isMemberAdmin(message)
-				await self.getPollByChannel(message).endPoll()
-			else:
-				await self.bot.say("Only admins and the author can stop the poll.")
-		else:
-			await self.bot.say("There's no reaction poll ongoing in this channel.")
-
-	def getPollByChannel(self, message):
-		for poll in self.poll_sessions:
-			if poll.channel == message.channel:
-				return poll
-		return False
-
-	async def check_poll_votes(self, message):
-		if message.author.id != self.bot.user.id:
-			if self.getPollByChannel(message):
-					self.getPollByChannel(message).checkAnswer(message)
-
-	async def reaction_listener(self, reaction, user):
-		# Listener is required to remove bad reactions
-		if user == self.bot.user:
-			return  # Don't remove bot's own reactions
-		message = reaction.message
-		emoji = reaction.emoji
-		if self.getPollByChannel(message):
-			p = self.getPollByChannel(message)
-			if message.id == p.message.id and not reaction.custom_emoji and emoji in p.emojis:
-				# Valid reaction
-				if user.id not in p.already_voted:
-					# First vote
-					p.already_voted[user.id] = set()
-					p.already_voted[user.id].add(str(emoji))
-					
-					return
-				else:
-					if len(p.already_voted[user.id])<p.mc:
-						p.already_voted[user.id].add(str(emoji))
-						
-						return
-					# Allow subsequent vote but remove the previous
-					else:
-						await self.bot.remove_reaction(message, p.already_voted[user.id].pop(), user)
-						p.already_voted[user.id].add(str(emoji))
-					   
-						return
-
-	def __unload(self):
-		for poll in self.poll_sessions:
-			if poll.wait_task is not None:
-				poll.wait_task.cancel()
-	@commands.command(pass_context=True, no_pm=True)
-	async def apoll(self, ctx, *text):
+	@commands.command()
+	async def apoll(self, ctx, *, text: str = ""):
 		"""Starts/stops a reaction poll
 		Usage example (time argument is optional)
 		apoll Is this a poll?;Yes;No;Maybe;t=60
+		Start it later with s=<seconds>, and get a reminder r=<seconds> before it closes.
+		Add live=on (or live=<seconds>) to keep running results on the poll message.
+		Pick the reaction emojis with e=numbers, e=letters, e=colors, e=fruit or e=<your own emojis>.
+		m=approval lets voters pick any number of options; m=ranked counts ranked choices by instant runoff.
+		apoll extend <seconds> (negative to shorten)
 		apoll stop"""
-		message = ctx.message
-		channel = message.channel
-		server = message.server
-		if len(text) == 1:
-			if text[0].lower() == "stop":
-				await self.endpoll(message)
-				return
-		if not self.getPollByChannel(message):
-			check = " ".join(text).lower()
-			if "@everyone" in check or "@here" in check:
-				await self.bot.say("Nice try.")
-				return
-			if not channel.permissions_for(server.me).manage_messages:
-				await self.bot.say("I require the 'Manage Messages' "
-								   "permission in this channel to conduct "
-								   "a reaction poll.")
-				return
-			p = NewReactPoll(message, " ".join(text), self)
-			if p.valid:
-				self.poll_sessions.append(p)
-				await p.start()
+		await self.poll_command(ctx, text, "`[p]apoll question;option1;option2...;t=60`")
+
+	async def poll_command(self, ctx, text, usage):
+		words = text.split()
+		if len(words) == 1 and words[0].lower() == "stop":
+			await self.endpoll(ctx)
+			return
+		if len(words) == 2 and words[0].lower() == "extend":
+			await self.extendpoll(ctx, words[1])
+			return
+		if ctx.channel.id in self.polls_by_channel:
+			await ctx.send("A reaction poll is already ongoing in this channel.")
+			return
+		check = text.lower()
+		if "@everyone" in check or "@here" in check:
+			await ctx.send("Nice try.")
+			return
+		if not ctx.channel.permissions_for(ctx.guild.me).manage_messages:
+			await ctx.send("I require the 'Manage Messages' "
+						   "permission in this channel to conduct "
+						   "a reaction poll.")
+			return
+		p = NewReactPoll(ctx.message, text, self)
+		if p.valid:
+			if p.mc_valid:
+				await self.start_poll(p)
 			else:
-				await self.bot.say("`[p]apoll question;option1;option2...;t=60`")
+				await ctx.send("`Number of votes per person is greater than number of options`")
 		else:
-			await self.bot.say("A reaction poll is already ongoing in this channel.")
+			await ctx.send(usage)
+
+	async def start_poll(self, p):
+		self.add_session(p)
+		if p.start_at is not None:
+			# The channel stays reserved for this poll until it starts.
+			self.scheduler.schedule((p, "start"), p.start_at, lambda: self.start_poll_now(p))
+			await self.client.send(p.channel, "Poll scheduled to start in {} seconds.".format(
+				round(p.start_at - time.time())))
+			return
+		await self.start_poll_now(p)
+
+	async def start_poll_now(self, p):
+		try:
+			await p.start()
+		except Exception:
+			self.remove_session(p)
+			raise
+		self.store.mark_dirty(p)
+
+	async def endpoll(self, ctx):
+		p = self.polls_by_channel.get(ctx.channel.id)
+		if p:
+			if p.author == ctx.author.id:  # or isMemberAdmin(message)
+				await p.endPoll()
+			else:
+				await ctx.send("Only admins and the author can stop the poll.")
+		else:
+			await ctx.send("There's no reaction poll ongoing in this channel.")
+
+	async def extendpoll(self, ctx, seconds):
+		p = self.polls_by_channel.get(ctx.channel.id)
+		if not p:
+			await ctx.send("There's no reaction poll ongoing in this channel.")
+		elif p.author != ctx.author.id:
+			await ctx.send("Only admins and the author can extend the poll.")
+		elif not re.match(r'-?[0-9]{1,18}$', seconds):
+			await ctx.send("`[p]apoll extend <seconds>`")
+		else:
+			await ctx.send("Poll now closes in {} seconds.".format(round(p.extend(int(seconds)))))
+
+	# Raw reaction events arrive for every message, cached or not, carrying only IDs. Everything here is a few
+	# attribute reads and a dict lookup; the vote is applied by the poll's inbox worker, see apply_reaction().
+
+	@commands.Cog.listener()
+	async def on_raw_reaction_add(self, payload):
+		p = self.polls_by_message.get(payload.message_id)
+		if p is None or not p.valid:
+			return  # Not a running poll; this is the common case for every reaction on the bot.
+		if payload.user_id == self.client.user_id:
+			return  # Don't remove bot's own reactions
+		emoji = payload.emoji
+		option = p.option(emoji.name) if emoji.id is None else None  # Custom emojis have an ID and never match.
+		if option is not None:
+			self.inbox.put(p, (True, option, payload.user_id))
+
+	@commands.Cog.listener()
+	async def on_raw_reaction_remove(self, payload):
+		p = self.polls_by_message.get(payload.message_id)
+		if p is None or not p.valid or payload.user_id == self.client.user_id:
+			return  # Ended polls are frozen, so clearing the reactions doesn't touch the results.
+		emoji = payload.emoji
+		option = p.option(emoji.name) if emoji.id is None else None
+		if option is not None:
+			self.inbox.put(p, (False, option, payload.user_id))
+
+	def apply_reaction(self, p, event):
+		"""Applies one (added, option, user id) reaction event to the poll's tally, in the order the events came in."""
+		added, option, user_id = event
+		if not p.valid:
+			return
+		if not added:
+			if p.votes.remove(user_id, option):
+				# The voter took their vote back.
+				p.changed()
+			return
+		# Valid reaction. The tally is kept here, so ending the poll needs no refetch.
+		added, evicted = p.vote(user_id, option)
+		if not added:
+			return
+		emoji = p.emojis[option]
+		self.reactions.discard(p.message_for(emoji), emoji, user_id)  # They may be re-voting for a removed choice.
+		p.changed()
+		if evicted is not None:
+			# Allow subsequent vote but remove their oldest one. It's already out of the tally, so the
+			# reaction remove event our own removal triggers is ignored.
+			previous = p.emojis[evicted]
+			self.reactions.remove(p.message_for(previous), previous, user_id)
+
+	@commands.group()
+	@checks.is_owner()
+	async def pollset(self, ctx):
+		"""Bot-wide AlphaPoll settings"""
+
+	@pollset.command(name="reconcile")
+	async def pollset_reconcile(self, ctx, on: bool):
+		"""Checks each tally against the poll message's reactions when the poll ends
+		pollset reconcile <on|off>
+		Mismatches are counted in $perfstats as alphapoll.tally_mismatch. Costs one message fetch per poll."""
+		await self.config.reconcile_on_end.set(on)
+		self.reconcile_on_end = on
+		await ctx.send("OK! Ended polls {} checked against their reactions.".format("are" if on else "aren't"))
+
+	@pollset.command(name="ballots")
+	async def pollset_ballots(self, ctx, on: bool):
+		"""Keeps every voter's choices in the archive, not just the totals
+		pollset ballots <on|off>
+		Applies to polls that end from now on."""
+		await self.config.archive_ballots.set(on)
+		self.archive_ballots = on
+		await ctx.send("OK! Ended polls {} their voters' choices.".format("keep" if on else "don't keep"))
+
+	@commands.group()
+	async def pollhistory(self, ctx):
+		"""Looks back at this server's ended polls"""
+
+	@pollhistory.command(name="list")
+	async def pollhistory_list(self, ctx):
+		"""Lists ended polls, newest first
+		pollhistory list [#channel] [@author] [before:<id>]"""
+		message = ctx.message
+		column = value = None
+		mention = ""
+		if message.channel_mentions:
+			column, value = "channel_id", str(message.channel_mentions[0].id)
+			mention = " <#{}>".format(value)
+		elif message.mentions:
+			column, value = "author_id", str(message.mentions[0].id)
+			mention = " <@{}>".format(value)
+		match = re.search(r"before:(\d+)", message.content)
+		before = int(match.group(1)) if match else None
+		rows = await self.store.history(str(ctx.guild.id), column, value, self.history_page_size, before)
+		if not rows:
+			await ctx.send("No ended polls to show.")
+			return
+
+		lines = []
+		for poll_id, channel_id, author_id, question, ended_at, voters in rows:
+			author = ctx.guild.get_member(int(author_id))
+			lines.append("`{}` {} -- <#{}> -- {} -- {} voters -- {}".format(
+				poll_id, time.strftime("%Y-%m-%d", time.gmtime(ended_at)), channel_id,
+				author.display_name if author is not None else "left the server", voters, question[:80]))
+		if len(rows) == self.history_page_size:
+			lines.append("Older polls: `{}pollhistory list{} before:{}`".format(ctx.prefix, mention, rows[-1][0]))
+		await ctx.send("\n".join(lines))
+
+	@pollhistory.command(name="show")
+	async def pollhistory_show(self, ctx, poll_id: int):
+		"""Shows the results of an ended poll again
+		pollhistory show <id>"""
+		poll = await self.store.archived_poll(str(ctx.guild.id), poll_id)
+		if poll is None:
+			await ctx.send("There's no ended poll with that ID in this server.")
+			return
+		msg = "**POLL ENDED {}**\n\n{}\n\n".format(
+			time.strftime("%Y-%m-%d %H:%M UTC", time.gmtime(poll["ended_at"])), poll["question"])
+		msg += format_results([label for label, count in poll["options"]], [count for label, count in poll["options"]],
+							  poll["mode"], poll["winner"], poll["rounds"])
+		msg += "\n{} voters, {} votes".format(poll["voters"], poll["votes"])
+		await ctx.send(msg)
+
+	@pollhistory.command(name="trends")
+	async def pollhistory_trends(self, ctx, days: int = 30):
+		"""Turnout and time to vote, per day (per week past a month)
+		pollhistory trends [days]"""
+		days = min(max(days, 1), 3650)
+		bucket = 86400 if days <= 31 else 7 * 86400
+		rows = await self.store.trends(str(ctx.guild.id), time.time() - days * 86400, bucket)
+		if not rows:
+			await ctx.send("No polls ended in the last {} days.".format(days))
+			return
+
+		lines = ["{:<12}{:>7}{:>9}{:>10}".format("day" if bucket == 86400 else "week of", "polls", "voters",
+												"to vote")]
+		for period, polls, voters, delay in rows:
+			lines.append("{:<12}{:>7}{:>9.1f}{:>10}".format(
+				time.strftime("%Y-%m-%d", time.gmtime(period)), polls, voters,
+				"{}s".format(round(delay)) if delay is not None else "-"))
+		await ctx.send("Average voters per poll and seconds to a voter's first vote:\n```\n{}\n```".format(
+			"\n".join(lines)))
 
 class NewReactPoll():
 	# This can be made a subclass of NewPoll()
@@ -144,182 +382,372 @@ class NewReactPoll():
 	def __init__(self, message, text, main):
 		self.channel = message.channel
 		self.author = message.author.id
-		self.client = main.bot
-		self.poll_sessions = main.poll_sessions
-		self.duration = 60  # Default duration
-		self.mc = 1
-		self.wait_task = None
-
-		# Build a dict of alphanumeric mappings to unicode. Discord is really picky about these.
-		# Sending the raw unicode for keycap 1-9 did not work.
-		self.num_emojis = collections.OrderedDict([
-			('1', '1⃣'),
-			('2', '2⃣'),
-			('3', '3⃣'),
-			('4', '4⃣'),
-			('5', '5⃣'),
-			('6', '6⃣'),
-			('7', '7⃣'),
-			('8', '8⃣'),
-			('9', '9⃣'),
-			('10', u'\U0001F51F'),
-			('a', '\N{REGIONAL INDICATOR SYMBOL LETTER A}'), ('b', '\N{REGIONAL INDICATOR SYMBOL LETTER B}'),
-			('c', '\N{REGIONAL INDICATOR SYMBOL LETTER C}'),
-			('d', '\N{REGIONAL INDICATOR SYMBOL LETTER D}'), ('e', '\N{REGIONAL INDICATOR SYMBOL LETTER E}'),
-			('f', '\N{REGIONAL INDICATOR SYMBOL LETTER F}'),
-			('g', '\N{REGIONAL INDICATOR SYMBOL LETTER G}'), ('h', '\N{REGIONAL INDICATOR SYMBOL LETTER H}'),
-			('i', '\N{REGIONAL INDICATOR SYMBOL LETTER I}'),
-			('j', '\N{REGIONAL INDICATOR SYMBOL LETTER J}'), ('k', '\N{REGIONAL INDICATOR SYMBOL LETTER K}'),
-			('l', '\N{REGIONAL INDICATOR SYMBOL LETTER L}'),
-			('m', '\N{REGIONAL INDICATOR SYMBOL LETTER M}'), ('n', '\N{REGIONAL INDICATOR SYMBOL LETTER N}'),
-			('o', '\N{REGIONAL INDICATOR SYMBOL LETTER O}'),
-			('p', '\N{REGIONAL INDICATOR SYMBOL LETTER P}'), ('q', '\N{REGIONAL INDICATOR SYMBOL LETTER Q}'),
-			('r', '\N{REGIONAL INDICATOR SYMBOL LETTER R}'),
-			('s', '\N{REGIONAL INDICATOR SYMBOL LETTER S}'), ('t', '\N{REGIONAL INDICATOR SYMBOL LETTER T}'),
-			('u', '\N{REGIONAL INDICATOR SYMBOL LETTER U}'),
-			('v', '\N{REGIONAL INDICATOR SYMBOL LETTER V}'), ('w', '\N{REGIONAL INDICATOR SYMBOL LETTER W}'),
-			('x', '\N{REGIONAL INDICATOR SYMBOL LETTER X}'),
-			('y', '\N{REGIONAL INDICATOR SYMBOL LETTER Y}'), ('z', '\N{REGIONAL INDICATOR SYMBOL LETTER Z}'),
-			('0', '0⃣')])
-		# Build a dict of alphanumeric mappings to unicode
-
-		# Build the alphanum dict into an array to iterate over this easier.
-		self.alphanum_array_key = list(self.num_emojis.keys())
-		
-		self.alphanum_array_val = list(self.num_emojis.values())
-		
-
-		#print(self.alphanum_array_key)
-		msg = [ans.strip() for ans in text.split(";")]
-		#print(msg)
-		for x in range(0,len(msg)-1):
-					if not msg[x]:
-						msg.remove(msg[x])
-
-		# Detect optional duration parameter
-		tn= -1
-		for x in range(0,len(msg)):
-			if "t=" in msg[x]:
-				tn = x
-
-		nn = -1
-		for x in range(0,len(msg)):
-			if "n=" in msg[x]:
-				nn = x
-
-
-		if tn>=0:
-			dur = msg[tn].strip().split("t=")[1]
-			if re.match(r'[0-9]{1,18}$', dur):
-				self.duration = int(dur)
-			else:
-				self.duration = 60
-			msg.remove(msg[tn])
+		self.client = main.client
+		self.main = main
+		self.deadline = None
+		self.start_at = None  # Set for polls scheduled to start later
+		self.started_at = None
+		self.first_votes = 0  # Voters whose first vote was timed, and the seconds from the start to those votes
+		self.first_vote_delay = 0.0
+		self.seeding = []  # One future per option, done once the bot's reaction for it is on the message
+		self.live_results = None
+		self.messages = []  # The poll's messages, one per MAX_REACTIONS options
+		self.valid = self.mc_valid = False
 
-		if tn>=nn:
-			nn = nn
-		else:
-			if tn>0: 
-				nn=nn-1
+		try:
+			spec = parse_poll(text, main.live_interval)
+		except TooManyChoices:
+			self.valid = True
+			return None
+		except PollSyntaxError:
+			return None
+		self.valid = self.mc_valid = True
+		self.setup(spec)
+		if spec.start_in is not None:
+			self.start_at = time.time() + spec.start_in
 
-		if nn>=0:
-			dur = msg[nn].strip().split("n=")[1]
-			if re.match(r'[0-9]{1,18}$', dur):
-				self.mc = int(dur)
-			else:
-				self.mc = 1
-			msg.remove(msg[nn])
-		# Reaction polling supports maximum of 20 answers (discord hard limit) and minimum of 2. ctx counts as 1 arg.
-		if len(msg) < 2 or len(msg) > 21:
-			print("Options Exceed available reaction limits: %s arguments, %s emojis" % (len(msg),
-																						 len(self.alphanum_array_key)))
-			self.valid = False
+	def setup(self, spec):
+		self.question = spec.question
+		self.duration = spec.duration
+		self.mc = spec.mc
+		self.mode = spec.mode
+		self.remind = spec.remind  # Seconds before the deadline to post a reminder
+		# Seconds between live results edits, if live results are on
+		self.live = max(spec.live, self.main.min_live_interval) if spec.live is not None else None
+		self.emojis = spec.emojis
+		self.option_index = spec.index  # emoji -> option number; see PollSpec.option()
+		self.pages = [spec.emojis[i:i + MAX_REACTIONS] for i in range(0, len(spec.emojis), MAX_REACTIONS)]
+		self.labels = [emoji + ' ' + answer for emoji, answer in zip(spec.emojis, spec.options)]
+		# Every voter's choices in a few bytes each. Approval polls don't evict, so they don't need the order.
+		self.votes = VoteStore(len(spec.options), spec.mc, ordered=spec.mode != 'approval' and spec.mc <= MAX_ORDERED)
+
+	@property
+	def message(self):
+		"""The first poll message, which the poll is saved under. None until the poll has started."""
+		return self.messages[0] if self.messages else None
+
+	def option(self, emoji):
+		"""Returns the option number for `emoji`, or None if it isn't one of this poll's options."""
+		i = self.option_index.get(emoji)
+		return i if i is not None and i < len(self.emojis) else None
+
+	def message_for(self, emoji):
+		return self.messages[self.option_index[emoji] // MAX_REACTIONS]
+
+	@classmethod
+	def restore(cls, main, channel, messages, state):
+		"""Rebuilds a running poll from to_state(), for poll messages that have already been sent."""
+		self = cls.__new__(cls)
+		self.channel = channel
+		self.author = int(state["author"])
+		self.client = main.client
+		self.main = main
+		self.deadline = state["deadline"]
+		self.start_at = None
+		self.started_at = state.get("started_at", self.deadline - state["duration"])
+		self.first_votes, self.first_vote_delay = state.get("first_votes", (0, 0.0))
+		self.live_results = None
+		self.seeding = []
+		self.valid = True
+		self.mc_valid = True
+		emojis = tuple(emoji for emoji, label in state["answers"])
+		self.setup(PollSpec(state["question"], [label for emoji, label in state["answers"]], emojis,
+							{emoji: i for i, emoji in enumerate(emojis)}, state["duration"], state["mc"],
+							state.get("mode", "choice"), remind=state.get("remind"), live=state.get("live")))
+		self.labels = [label for emoji, label in state["answers"]]  # Saved with their emoji prefix
+		for user_id, choices in state["votes"].items():
+			for emoji in choices:
+				self.votes.add(user_id, self.option_index[emoji])
+		self.messages = messages
+		return self
+
+	def to_state(self):
+		"""The poll as PollStore saves it. `votes` is a snapshot of the VoteStore; see storage.encode_state()."""
+		return {
+			"question": self.question,
+			"author": self.author,
+			"duration": self.duration,
+			"mc": self.mc,
+			"mode": self.mode,
+			"deadline": self.deadline,
+			"started_at": self.started_at,
+			"first_votes": [self.first_votes, self.first_vote_delay],
+			"remind": self.remind,
+			"live": self.live,
+			"messages": [message.id for message in self.messages],
+			"answers": [[emoji, label] for emoji, label in zip(self.emojis, self.labels)],
+			"votes": self.votes.copy(),
+		}
+
+	def vote(self, user_id, option):
+		"""Records a vote through VoteStore.add(), timing each voter's first one."""
+		seen = self.votes.seen
+		added, evicted = self.votes.add(user_id, option)
+		if self.votes.seen != seen:
+			self.first_votes += 1
+			self.first_vote_delay += time.time() - self.started_at
+		return added, evicted
+
+	async def reconcile_votes(self, messages):
+		"""Brings the tally in line with the reactions on freshly fetched poll messages.
+
+		Picks up votes cast and withdrawn while the poll wasn't being watched. Voters who went over the limit keep
+		their saved choices first, and their extra reactions are removed. Returns the options the bot has reacted
+		with, or None if the poll ended while the reactions were being fetched; its tally is left alone then."""
+		seeded = set()
+		reactors = {}  # user id -> emojis they reacted with
+		for message in messages:
+			for emoji, user_ids in (await self.client.reaction_users(message)).items():
+				if self.option(emoji) is None:
+					continue
+				for user_id in user_ids:
+					if user_id == self.client.user_id:
+						seeded.add(emoji)
+					else:
+						reactors.setdefault(user_id, []).append(emoji)
+		if not self.valid:
 			return None
+
+		saved = self.votes
+		self.votes = VoteStore(len(self.emojis), self.mc, saved.ordered)
+		for user_id, emojis in reactors.items():
+			# Saved choices keep their order; new ones follow in option order.
+			order = saved.choices(user_id)
+			options = sorted((self.option_index[emoji] for emoji in emojis),
+							 key=lambda option: (order.index(option) if option in order else len(order), option))
+			for option in options[:self.mc]:
+				self.votes.add(user_id, option)
+			for option in options[self.mc:]:
+				self.main.reactions.remove(self.message_for(self.emojis[option]), self.emojis[option], user_id)
+		return seeded
+
+	def schedule(self):
+		scheduler = self.main.scheduler
+		scheduler.schedule((self, "end"), self.deadline, self.expire)
+		if self.remind is not None and self.deadline - self.remind > time.time():
+			scheduler.schedule((self, "remind"), self.deadline - self.remind, self.send_reminder)
 		else:
-			self.valid = True
-		if self.mc > len(msg):
-			self.mc_valid = False
-			return None
+			scheduler.cancel((self, "remind"))
+
+	def unschedule(self):
+		for kind in ("start", "remind", "live", "resync", "end"):
+			self.main.scheduler.cancel((self, kind))
+
+	def extend(self, seconds):
+		"""Moves the poll's end by `seconds`, which may be negative, and returns how many seconds are left."""
+		if self.deadline is None:
+			# Not started yet; the poll runs from its start time.
+			self.duration = max(self.duration + seconds, 0)
+			return self.duration
+		self.deadline = max(self.deadline + seconds, time.time())
+		self.schedule()
+		self.main.store.mark_dirty(self)
+		return self.deadline - time.time()
+
+	def schedule_resync(self):
+		"""Rebuilds the tally from the poll messages' reactions in a little while, once reaction events have been
+		dropped. Further drops before then don't push it back."""
+		key = (self, "resync")
+		if self.valid and self.main.scheduler.when(key) is None:
+			self.main.scheduler.schedule(key, time.time() + self.main.resync_delay, self.resync)
+
+	async def resync(self):
+		if not self.valid:
+			return
+		inbox = self.main.inbox
+		# Events that arrive meanwhile wait and are applied on top; replaying one the refetch already saw is a no-op.
+		inbox.pause(self)
+		try:
+			messages = [await self.client.fetch_message(self.channel, message.id) for message in self.messages]
+			if not self.valid or None in messages:
+				# Ended meanwhile, or a poll message was deleted and there's nothing left to count its reactions from.
+				return
+			if await self.reconcile_votes(messages) is None:
+				return
+			self.changed()
+			perf.incr("alphapoll.resyncs")
+		finally:
+			inbox.resume(self)
+
+	def start_live(self):
+		if self.live is not None:
+			self.live_results = EditDebouncer((self, "live"), self.main.scheduler, self.edit_messages,
+											  self.render_pages, self.live)
+			self.live_results.rendered = [None] * len(self.pages)
+
+	def changed(self):
+		"""Called after every tally change: queues the poll for the next batched save and live results edit."""
+		if not self.valid:
+			return  # Ended polls are frozen; saving one again would bring it back on the next load.
+		self.main.store.mark_dirty(self)
+		if self.live_results is not None:
+			self.live_results.touch()
+
+	async def edit_messages(self, contents):
+		# Only pages whose text changed are edited; a vote on one page leaves the others alone.
+		rendered = self.live_results.rendered
+		for i, (message, content) in enumerate(zip(self.messages, contents)):
+			if content != rendered[i]:
+				rendered[i] = content
+				await self.client.edit(message, content)
+
+	def render_pages(self):
+		return [self.render(page) for page in range(len(self.pages))]
+
+	def render(self, page=0):
+		"""One poll message: question, options and instructions, plus a running tally when live results are on.
+
+		The question heads the first message and the instructions close the last one."""
+		if page == 0:
+			msg = "**POLL STARTED!**\n\n{}\n\n".format(self.question)
 		else:
-			self.mc_valid = True
-			
-		self.already_voted = {}
-		self.question = msg[0]
-		msg.remove(self.question)
-		self.answers = {}  # Made this a dict to make my life easier for now
-		self.emojis = []
-		self.em_sort = []
-		i = 0
-		for answer in msg:  # {emoji: {answer, votes}}
-			"""old format by FlapJack was {id: {answer, votes}, broke async due to the id key value being maped to
-			the unicode for keycap 1-9.  
-			New format is like {emoji: {answer: votes}}"""
-			self.emojis.append(self.alphanum_array_val[i])
-			self.em_sort.append(self.alphanum_array_val[i])
-			answer = self.emojis[i] + ' ' + answer
-			self.answers[self.alphanum_array_val[i]] = {"ANSWER": answer, "VOTES": 0}
-			i += 1
-		
-		self.answers = collections.OrderedDict(sorted(self.answers.items(), key=lambda pair: self.em_sort.index(pair[0])))
-		self.message = None
-
-	async def poll_wait(self):
-		# print("Sleeping for %s" % self.duration)
-		await asyncio.sleep(self.duration)
+			msg = "*...continued*\n\n"
+		counts = self.votes.counts
+		total = sum(counts)
+		first = page * MAX_REACTIONS
+		for option in range(first, first + len(self.pages[page])):
+			msg += "{}\n".format(self.labels[option])
+			if self.live is not None:
+				msg += "`{}` {} votes\n".format(bar(counts[option], total), counts[option])
+		if page < len(self.pages) - 1:
+			return msg
+		if self.mode == "approval":
+			msg += ("\nSelect every react you approve of!")
+		elif self.mode == "ranked":
+			msg += ("\nReact in order of preference, up to "+str(self.mc)+" choices!")
+		elif self.mc  == 1:
+			msg += ("\nSelect a react to vote!")
+		else:
+			msg += ("\nSelect "+str(self.mc)+" reacts to vote!")
+		msg += ("\nPoll closes in {} seconds.".format(self.duration))
+		return msg
+
+	async def expire(self):
 		if self.valid:
 			# print("Expiring poll")
 			await self.endPoll(expired=True)
 
+	async def send_reminder(self):
+		if self.valid:
+			await self.client.send(self.channel, "**Poll closes in {} seconds!**\n\n{}".format(
+				round(self.deadline - time.time()), self.question))
+
 	# Override NewPoll methods for starting and stopping polls
 	async def start(self):
-		msg = "**POLL STARTED!**\n\n{}\n\n".format(self.question)
-		for id, data in self.answers.items():
-			# msg += "{}\n".format(data["ANSWER"])
-			msg += "{}\n".format(data["ANSWER"])
-		if self.mc  == 1:
-			msg += ("\nSelect a react to vote!")
-		else:
-			msg += ("\nSelect "+str(self.mc)+" reacts to vote!")
-		msg += ("\nPoll closes in {} seconds.".format(self.duration))
-		self.message = await self.client.send_message(self.channel, msg)
-		for emoji in self.emojis:
-			await self.client.add_reaction(self.message, emoji)
-			await asyncio.sleep(0.2)
+		for page in range(len(self.pages)):
+			message = await self.client.send(self.channel, self.render(page))
+			self.messages.append(message)
+			self.main.index_message(self, message)
+		self.start_live()
+		self.started_at = time.time()
+		self.deadline = self.started_at + self.duration
+		self.schedule()
+		# Reactions go out through the channel's paced queue in the background, so the poll is live as soon as
+		# the message is, and each option is clickable the moment its reaction lands.
+		self.seed()
+		self.client.loop.create_task(self.track_ready(time.perf_counter()))
+
+	def seed(self, seeded=()):
+		self.seeding = [self.main.reactions.add(self.message_for(emoji), emoji)
+						for emoji in self.emojis if emoji not in seeded]
 
-		self.wait_task = self.client.loop.create_task(self.poll_wait())
+	async def track_ready(self, started):
+		results = await asyncio.gather(*self.seeding, return_exceptions=True)
+		errors = [r for r in results if isinstance(r, Exception) and not isinstance(r, asyncio.CancelledError)]
+		for error in errors:
+			log.error("Error adding poll reaction", exc_info=error)
+		if self.valid and not errors and not any(f.cancelled() for f in self.seeding):
+			perf.observe("alphapoll.time_to_ready", time.perf_counter() - started)
 
 	async def endPoll(self, expired=False):
 		# print("Attempting to end poll")
+		if not self.valid:
+			return  # Already ending, e.g. `apoll stop` while the expiry is still reporting.
+		self.main.inbox.flush(self)  # Votes cast before the end still count.
 		self.valid = False
-		if not expired:
-			# print("Not expired yet")
-			self.wait_task.cancel()
-		# Need a fresh message object
-		# print("Getting fresh message obj")
-		self.message = await self.client.get_message(self.channel, self.message.id)
+		self.unschedule()
+		for message in self.messages:
+			self.main.reactions.cancel_message(message)  # Unsent seeds and removals; the reactions are cleared anyway.
+		if self.message is None:
+			# Stopped before its scheduled start; there's nothing to report.
+			self.main.remove_session(self)
+			await self.client.send(self.channel, "Scheduled poll cancelled.")
+			return
+		try:
+			await self.report_results()
+		finally:
+			# However reporting went, the poll must not stay indexed.
+			self.main.remove_session(self)
+
+	async def reconcile(self):
+		"""Refetches the poll messages and counts tallies that disagree with Discord's reaction counts.
+
+		Optional: reaction counts also include votes the listener rejected, so the in-memory tally stays
+		authoritative and this only reports drift."""
+		for message in self.messages:
+			message = await self.client.fetch_message(self.channel, message.id)
+			if message is None:
+				continue
+			for emoji, count in (await self.client.reaction_counts(message)).items():
+				option = self.option(emoji)
+				if option is not None and count - 1 != self.votes.counts[option]:
+					perf.incr("alphapoll.tally_mismatch")
+
+	def results(self):
+		"""Returns (counts, winner, rounds) as reported. For ranked polls the counts are first choices, and the
+		winner and number of rounds come from the instant runoff."""
+		if self.mode == "ranked":
+			winner, rounds = instant_runoff(self.votes.ballots(), len(self.emojis))
+			return rounds[0], winner, len(rounds)
+		return list(self.votes.counts), None, None
+
+	def archive(self, counts, winner, rounds):
+		"""Queues the results for the archive. They're written with the next batched save, off the event loop."""
+		ballots = None
+		if self.main.archive_ballots:
+			ballots = [(str(user_id), json.dumps(choices)) for user_id, choices in self.votes.items()]
+		self.main.store.archive((
+			# IDs are stored as text, as they always have been.
+			str(self.message.id), str(self.channel.guild.id), str(self.channel.id), str(self.author), self.question,
+			self.mode, self.mc, self.started_at, time.time(), len(self.votes), sum(self.votes.counts),
+			self.first_votes, self.first_vote_delay, winner, rounds,
+			json.dumps([list(option) for option in zip(self.labels, counts)])
+		), ballots)
+
+	async def report_results(self):
+		if self.main.reconcile_on_end:
+			await self.reconcile()
+		counts, winner, rounds = self.results()
+		self.archive(counts, winner, rounds)
 		msg = "**POLL ENDED!**\n\n{}\n\n".format(self.question)
-		for reaction in self.message.reactions:
-			if reaction.emoji in self.emojis:
-				# print("Found valid emoji %s. Count: %s" % (reaction.emoji, reaction.count))
-				self.answers[reaction.emoji]["VOTES"] = reaction.count - 1
 		# print("Clearing reactions")
-		await self.client.clear_reactions(self.message)
-		cur_max = 0 # Track the winning number of votes
-		# Double iteration probably not the fastest way, but works for now
-		for data in self.answers.values():
-			if data["VOTES"] > cur_max:
-				cur_max = data["VOTES"]
-		for data in self.answers.values():
-			if cur_max > 0 and data["VOTES"] == cur_max:
-				msg += "**{} - {} votes**\n".format(data["ANSWER"], str(data["VOTES"]))
-			else:
-				msg += "*{}* - {} votes\n".format(data["ANSWER"], str(data["VOTES"]))
+		for message in self.messages:
+			await self.client.clear_reactions(message)
+		if self.live_results is not None:
+			await self.live_results.flush()  # Leave the final tally on the poll message too.
+		msg += format_results(self.labels, counts, self.mode, winner, rounds)
 
-		await self.client.send_message(self.channel, msg)
-		self.poll_sessions.remove(self)
+		await self.client.send(self.channel, msg)
 
 
-def setup(bot):
-	n = AlphaPoll(bot)
-	bot.add_cog(n)
-	bot.add_listener(n.reaction_listener, "on_reaction_add")
\ No newline at end of file
+def format_results(labels, counts, mode, winner=None, rounds=None):
+	"""The results part of a poll's end message, also used to show archived polls again. See NewReactPoll.results()."""
+	msg = ""
+	if mode == "ranked":
+		for option, (label, votes) in enumerate(zip(labels, counts)):
+			if option == winner:
+				msg += "**{} - {} first choices**\n".format(label, votes)
+			else:
+				msg += "*{}* - {} first choices\n".format(label, votes)
+		if winner is not None:
+			msg += "\nWinner after {} round{} of instant runoff: **{}**\n".format(
+				rounds, "" if rounds == 1 else "s", labels[winner])
+		return msg
+
+	cur_max = max(counts)  # Track the winning number of votes
+	for label, votes in zip(labels, counts):
+		if cur_max > 0 and votes == cur_max:
+			msg += "**{} - {} votes**\n".format(label, str(votes))
+		else:
+			msg += "*{}* - {} votes\n".format(label, str(votes))
+	return msg
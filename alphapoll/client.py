@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import discord
+from perfstats import registry as perf
+
+
+class DiscordClient(object):
+	"""Every Discord call AlphaPoll makes, as one small surface over a discord.py bot.
+
+	The cog and its polls only talk to Discord through this, so tests and benchmarks can hand the cog any object
+	with the same methods and run with no connection. IDs are ints, as discord.py has them, and emojis are the
+	unicode strings polls are built from. Messages are whatever send() and fetch_message() return; the cog only
+	reads their id and channel."""
+
+	def __init__(self, bot):
+		self.bot = bot
+
+	@property
+	def loop(self):
+		return asyncio.get_event_loop()
+
+	@property
+	def user_id(self):
+		return self.bot.user.id
+
+	async def wait_until_ready(self):
+		await self.bot.wait_until_ready()
+
+	def get_channel(self, channel_id):
+		return self.bot.get_channel(channel_id)
+
+	async def send(self, channel, content):
+		with perf.timer("discord.send_message"):
+			return await channel.send(content)
+
+	async def edit(self, message, content):
+		with perf.timer("discord.edit_message"):
+			await message.edit(content=content)
+
+	async def fetch_message(self, channel, message_id):
+		"""Returns the message, or None if it has been deleted."""
+		try:
+			with perf.timer("discord.get_message"):
+				return await channel.fetch_message(message_id)
+		except discord.NotFound:
+			return None
+
+	async def reaction_counts(self, message):
+		"""Returns {emoji: count} for the unicode-emoji reactions on a fetched message, the bot's own included."""
+		return {reaction.emoji: reaction.count for reaction in message.reactions if not reaction.is_custom_emoji()}
+
+	async def reaction_users(self, message):
+		"""Returns {emoji: [user id, ...]} for the unicode-emoji reactions on a fetched message, the bot's own
+		included, in the order they were added."""
+		users = {}
+		for reaction in message.reactions:
+			if reaction.is_custom_emoji():
+				continue
+			with perf.timer("discord.get_reaction_users"):
+				users[reaction.emoji] = [user.id async for user in reaction.users()]
+		return users
+
+	async def add_reaction(self, message, emoji):
+		await message.add_reaction(emoji)
+
+	async def remove_reaction(self, message, emoji, user_id):
+		await message.remove_reaction(emoji, discord.Object(id=user_id))
+
+	async def clear_reactions(self, message):
+		with perf.timer("discord.clear_reactions"):
+			await message.clear_reactions()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import logging
+from perfstats import registry as perf
+
+log = logging.getLogger("red.alphapoll")
+MAX_PENDING = 2000  # Events held per poll before new ones are dropped.
+BATCH = 200  # Events a worker handles before yielding to the loop.
+
+
+class ReactionInbox(object):
+	"""Bounded per-poll queues of reaction events, each drained in arrival order by its own worker task.
+
+	The reaction listeners only look the poll up and put() the event, so a reaction storm on one poll can't stall
+	the gateway or the other polls: its worker hands the loop back every `batch` events, and once `maxsize` events
+	are waiting, new ones are dropped and counted. The first drop of a burst calls `overflow(poll)`, so the poll can
+	rebuild its tally from Discord. A single worker per poll keeps every user's adds and removals in order.
+
+	`handle(poll, event)` is a plain callable that applies one event; workers exist only while there's something
+	to drain, so idle polls cost nothing."""
+
+	def __init__(self, handle, overflow=None, maxsize=MAX_PENDING, batch=BATCH, loop=None):
+		self.handle = handle
+		self.overflow = overflow
+		self.maxsize = maxsize
+		self.batch = batch
+		self.loop = loop or asyncio.get_event_loop()
+		self._pending = {}  # poll -> deque of (time queued, event)
+		self._workers = {}  # poll -> task draining that poll's queue
+		self._paused = set()  # polls whose events are held, e.g. while they resync
+		self._overflowed = set()  # polls that dropped events since they were last paused
+
+	def put(self, poll, event):
+		"""Queues an event for `poll`. Returns False if its queue was full and the event was dropped."""
+		pending = self._pending.get(poll)
+		if pending is None:
+			pending = self._pending[poll] = collections.deque()
+		elif len(pending) >= self.maxsize:
+			perf.incr("alphapoll.ingest_dropped")
+			if poll not in self._overflowed:
+				self._overflowed.add(poll)
+				perf.incr("alphapoll.ingest_overflows")
+				if self.overflow is not None:
+					self.overflow(poll)
+			return False
+		pending.append((self.loop.time(), event))
+		if poll not in self._workers and poll not in self._paused:
+			self._workers[poll] = self.loop.create_task(self._drain(poll))
+		return True
+
+	def depth(self, poll=None):
+		"""Events waiting for `poll`, or for every poll."""
+		if poll is not None:
+			return len(self._pending.get(poll, ()))
+		return sum(len(pending) for pending in self._pending.values())
+
+	async def _drain(self, poll):
+		pending = self._pending[poll]
+		try:
+			while pending and poll not in self._paused:
+				# The batch's first event waited longest, so it stands for the whole batch.
+				perf.observe("alphapoll.ingest_wait", self.loop.time() - pending[0][0])
+				for _ in range(min(self.batch, len(pending))):
+					queued, event = pending.popleft()
+					try:
+						self.handle(poll, event)
+					except Exception:
+						log.exception("Error handling poll reaction")
+				await asyncio.sleep(0)
+		finally:
+			if self._pending.get(poll) is pending:  # Otherwise flush() has already let go of this queue.
+				self._workers.pop(poll, None)
+				if not pending:
+					del self._pending[poll]
+
+	def pause(self, poll):
+		"""Holds `poll`'s events until resume(); they keep queueing, up to maxsize. Drops from here on call
+		overflow() again."""
+		self._paused.add(poll)
+		self._overflowed.discard(poll)
+
+	def resume(self, poll):
+		self._paused.discard(poll)
+		if self._pending.get(poll) and poll not in self._workers:
+			self._workers[poll] = self.loop.create_task(self._drain(poll))
+
+	def flush(self, poll):
+		"""Applies everything still queued for `poll` right away and stops its worker, e.g. as the poll ends."""
+		worker = self._workers.pop(poll, None)
+		if worker is not None:
+			worker.cancel()
+		for queued, event in self._pending.pop(poll, ()):
+			try:
+				self.handle(poll, event)
+			except Exception:
+				log.exception("Error handling poll reaction")
+		self._paused.discard(poll)
+		self._overflowed.discard(poll)
+
+	def close(self):
+		"""Applies whatever is still queued and stops every worker, so the votes are in the tallies that get saved."""
+		for poll in list(self._pending):
+			self.flush(poll)
+		for worker in self._workers.values():
+			worker.cancel()
+		self._workers.clear()
+		self._paused.clear()
+		self._overflowed.clear()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from perfstats import registry as perf
+
+BAR_WIDTH = 12
+
+
+def bar(votes, total, width=BAR_WIDTH):
+	filled = int(round(width * votes / total)) if total else 0
+	return '\N{FULL BLOCK}' * filled + '\N{LIGHT SHADE}' * (width - filled)
+
+
+class EditDebouncer(object):
+	"""Coalesces any number of touch() calls into at most one edit every `interval` seconds.
+
+	The edit itself is deferred through the shared DeadlineScheduler, so a poll with live results costs no task of its
+	own. `edit(content)` and `render()` are plain callables, so this can be driven by a fake client and scheduler."""
+
+	def __init__(self, key, scheduler, edit, render, interval):
+		self.key = key
+		self.scheduler = scheduler
+		self.edit = edit
+		self.render = render
+		self.interval = interval
+		self.last_edit = None
+		self.pending = False  # An edit is scheduled and hasn't started yet.
+		self.edits = 0
+
+	def touch(self):
+		"""Notes that the rendered content changed. Cheap enough to call on every vote."""
+		if self.pending:
+			return  # The scheduled edit will render whatever the tally is by then.
+		self.pending = True
+		now = self.scheduler.clock()
+		when = now if self.last_edit is None else max(self.last_edit + self.interval, now)
+		self.scheduler.schedule(self.key, when, self.flush)
+
+	async def flush(self):
+		self.pending = False
+		self.last_edit = self.scheduler.clock()
+		content = self.render()
+		self.edits += 1
+		perf.incr("alphapoll.live_edits")
+		await self.edit(content)
+
+	def cancel(self):
+		self.scheduler.cancel(self.key)
+		self.pending = False
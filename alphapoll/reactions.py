@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import collections.abc
+import discord
+import logging
+from perfstats import registry as perf
+
+log = logging.getLogger("red.alphapoll")
+REACTION_INTERVAL = 0.25  # Discord allows one reaction add per channel every quarter second.
+MAX_RETRIES = 5
+SLACK = 0.01  # Timers can fire a hair early; without this the first call after a wait is sometimes a 429.
+
+
+class RateLimit(object):
+	"""Local view of one channel's reaction rate-limit bucket.
+
+	Updated from the X-RateLimit-* headers when the client exposes them. Without headers it assumes one call per
+	`interval`, and a 429 stretches `interval` to what Discord actually asked for."""
+
+	__slots__ = ('remaining', 'reset_at', 'interval')
+
+	def __init__(self, interval=REACTION_INTERVAL):
+		self.remaining = 1
+		self.reset_at = 0.0
+		self.interval = interval
+
+	def delay(self, now):
+		"""Seconds to wait before the next call may go out."""
+		if self.remaining > 0 or now >= self.reset_at:
+			return 0.0
+		return self.reset_at - now + SLACK
+
+	def consumed(self, now, headers=None):
+		if headers and 'X-RateLimit-Remaining' in headers:
+			self.remaining = int(headers['X-RateLimit-Remaining'])
+			self.reset_at = now + float(headers.get('X-RateLimit-Reset-After', self.interval))
+		else:
+			self.remaining = 0
+			self.reset_at = now + self.interval
+
+	def limited(self, now, retry_after):
+		self.remaining = 0
+		self.reset_at = now + retry_after
+		self.interval = max(self.interval, min(retry_after, 1.0))
+
+
+def _retry_after(error):
+	"""Returns how long a 429 asked us to wait, or None if `error` isn't a rate limit."""
+	response = getattr(error, 'response', None)
+	if getattr(response, 'status', None) != 429:
+		return None
+	headers = getattr(response, 'headers', None) or {}
+	return float(headers.get('Retry-After', REACTION_INTERVAL))
+
+
+class ReactionQueues(object):
+	"""One outbound reaction queue per channel, each paced by that channel's rate-limit bucket.
+
+	`send(message, emoji)` is the client's add_reaction and `send_remove(message, emoji, user_id)` its remove_reaction;
+	if either returns a mapping of response headers, the bucket is paced from those instead of the fixed interval.
+	add() returns a future that resolves once the reaction lands, so callers can act on each option as soon as it's
+	ready instead of waiting for the whole batch. Removals are fire-and-forget and coalesced: removing the same
+	reaction twice queues one call, and discard() drops a removal that hasn't gone out yet."""
+
+	def __init__(self, send, send_remove=None, interval=REACTION_INTERVAL, loop=None):
+		self.send = send
+		self.send_remove = send_remove
+		self.interval = interval
+		self.loop = loop or asyncio.get_event_loop()
+		self._pending = {}  # channel id -> deque of (message, emoji, user id, future); the user is None for adds
+		self._removals = {}  # (message id, emoji, user id) -> future of the queued removal
+		self._limits = {}  # channel id -> RateLimit
+		self._workers = {}  # channel id -> task draining that channel's queue
+
+	def add(self, message, emoji):
+		return self._queue(message, emoji, None)
+
+	def remove(self, message, emoji, user_id):
+		key = (message.id, emoji, user_id)
+		future = self._removals.get(key)
+		if future is not None and not future.done():
+			perf.incr("alphapoll.reaction_removals_coalesced")
+			return
+		future = self._removals[key] = self._queue(message, emoji, user_id)
+		future.add_done_callback(lambda f: self._removed(key, f))
+
+	def _removed(self, key, future):
+		if self._removals.get(key) is future:
+			del self._removals[key]
+		if not future.cancelled() and future.exception() is not None:
+			log.error("Error removing poll reaction", exc_info=future.exception())
+
+	def discard(self, message, emoji, user_id):
+		"""Cancels a queued removal of this reaction, e.g. because the user has just voted with it again."""
+		future = self._removals.get((message.id, emoji, user_id))
+		if future is not None:
+			future.cancel()
+
+	def cancel_message(self, message):
+		"""Cancels everything still queued for `message`, e.g. once its poll has ended."""
+		for queued, emoji, user_id, future in self._pending.get(message.channel.id, ()):
+			if queued.id == message.id:
+				future.cancel()
+
+	def _queue(self, message, emoji, user_id):
+		channel_id = message.channel.id
+		future = self.loop.create_future()
+		self._pending.setdefault(channel_id, collections.deque()).append((message, emoji, user_id, future))
+		worker = self._workers.get(channel_id)
+		if worker is None or worker.done():
+			self._workers[channel_id] = self.loop.create_task(self._drain(channel_id))
+		return future
+
+	async def _drain(self, channel_id):
+		pending = self._pending[channel_id]
+		limit = self._limits.setdefault(channel_id, RateLimit(self.interval))
+		try:
+			while pending:
+				message, emoji, user_id, future = pending.popleft()
+				if future.done():
+					continue  # Cancelled, e.g. the poll ended before this option was seeded.
+				try:
+					await self._send(limit, message, emoji, user_id)
+				except asyncio.CancelledError:
+					future.cancel()
+					raise
+				except Exception as e:
+					if not future.done():
+						future.set_exception(e)
+				else:
+					if not future.done():
+						future.set_result(None)
+		finally:
+			if not pending and self._pending.get(channel_id) is pending:  # Otherwise close() has let go of it.
+				del self._pending[channel_id]
+				self._workers.pop(channel_id, None)
+
+	async def _send(self, limit, message, emoji, user_id):
+		for attempt in range(MAX_RETRIES):
+			wait = limit.delay(self.loop.time())
+			if wait > 0:
+				await asyncio.sleep(wait)
+			sent = self.loop.time()
+			try:
+				if user_id is None:
+					with perf.timer("discord.add_reaction"):
+						headers = await self.send(message, emoji)
+				else:
+					with perf.timer("discord.remove_reaction"):
+						headers = await self.send_remove(message, emoji, user_id)
+			except discord.HTTPException as e:
+				retry_after = _retry_after(e)
+				if retry_after is None or attempt == MAX_RETRIES - 1:
+					raise
+				perf.incr("alphapoll.reaction_rate_limited")
+				limit.limited(self.loop.time(), retry_after)
+				continue
+			# Discord starts the bucket's window when it handles the call, which is after we sent it. Counting from
+			# the send keeps the pace at one call per interval instead of one per interval plus a round trip.
+			limit.consumed(sent, headers if isinstance(headers, collections.abc.Mapping) else None)
+			return
+
+	def close(self):
+		"""Stops every queue and cancels whatever hadn't been sent yet."""
+		for worker in self._workers.values():
+			worker.cancel()
+		for pending in self._pending.values():
+			for message, emoji, user_id, future in pending:
+				future.cancel()
+		self._workers.clear()
+		self._pending.clear()
+		self._removals.clear()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from perfstats import registry as perf
+
+log = logging.getLogger("red.alphapoll")
+MAX_SLEEP = 300  # Re-check the clock at least this often, so a wall-clock jump can't strand a deadline.
+
+
+class DeadlineScheduler(object):
+	"""Runs callbacks at wall-clock times from a single task, for every poll at once.
+
+	Entries live in a heap keyed by time. Rescheduling or cancelling a key just forgets its old entry, which is
+	skipped when it reaches the top of the heap. Everything due at once fires as one batch, concurrently."""
+
+	def __init__(self, loop=None, clock=time.time):
+		self.loop = loop or asyncio.get_event_loop()
+		self.clock = clock
+		self._heap = []  # (when, seq, key)
+		self._entries = {}  # key -> (when, seq, callback) for the live entry
+		self._seq = itertools.count()
+		self._wakeup = asyncio.Event()
+		self._batches = set()
+		self._task = None
+
+	def __len__(self):
+		return len(self._entries)
+
+	def start(self):
+		if self._task is None or self._task.done():
+			self._task = self.loop.create_task(self._run())
+
+	def schedule(self, key, when, callback):
+		"""Calls `await callback()` at time `when`, replacing anything already scheduled under `key`."""
+		seq = next(self._seq)
+		self._entries[key] = (when, seq, callback)
+		heapq.heappush(self._heap, (when, seq, key))
+		if self._heap[0][1] == seq:
+			self._wakeup.set()  # New earliest deadline; the runner is sleeping too long.
+
+	def cancel(self, key):
+		return self._entries.pop(key, None) is not None
+
+	def when(self, key):
+		entry = self._entries.get(key)
+		return entry[0] if entry is not None else None
+
+	def _pop_due(self, now):
+		due = []
+		heap = self._heap
+		while heap and heap[0][0] <= now:
+			when, seq, key = heapq.heappop(heap)
+			entry = self._entries.get(key)
+			if entry is not None and entry[1] == seq:
+				del self._entries[key]
+				due.append((when, entry[2]))
+		# Drop stale entries at the top so the next sleep is computed from a live deadline.
+		while heap and self._entries.get(heap[0][2], (None, None))[1] != heap[0][1]:
+			heapq.heappop(heap)
+		return due
+
+	async def _fire(self, due, now):
+		for when, callback in due:
+			perf.observe("alphapoll.deadline_lateness", max(now - when, 0.0))
+		results = await asyncio.gather(*(callback() for when, callback in due), return_exceptions=True)
+		for result in results:
+			if isinstance(result, Exception):
+				log.error("Error in scheduled poll event", exc_info=result)
+				perf.incr("alphapoll.scheduler_errors")
+
+	async def _run(self):
+		while True:
+			now = self.clock()
+			due = self._pop_due(now)
+			if due:
+				perf.incr("alphapoll.deadline_batches")
+				batch = self.loop.create_task(self._fire(due, now))
+				self._batches.add(batch)
+				batch.add_done_callback(self._batches.discard)
+
+			self._wakeup.clear()
+			timeout = min(self._heap[0][0] - self.clock(), MAX_SLEEP) if self._heap else MAX_SLEEP
+			if timeout > 0:
+				try:
+					await asyncio.wait_for(self._wakeup.wait(), timeout)
+				except asyncio.TimeoutError:
+					pass
+
+	def close(self):
+		"""Stops the runner and any batch still firing, and forgets every entry. Nothing fires after this returns."""
+		if self._task is not None:
+			self._task.cancel()
+			self._task = None
+		for batch in list(self._batches):
+			batch.cancel()
+		self._batches.clear()
+		self._heap = []
+		self._entries.clear()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import re
+import types
+from .votes import MAX_ORDERED
+
+MAX_REACTIONS = 20  # Discord's limit on distinct reactions per message.
+MAX_MESSAGES = 3  # A poll with more options than one message can hold continues on up to this many messages.
+DEFAULT_DURATION = 60
+MODES = ('choice', 'approval', 'ranked')  # m=: up to n= votes each, any number of votes, or n= ranked choices
+
+# Alphanumeric mappings to unicode, in the order options are numbered. Discord is really picky about these:
+# sending the raw unicode for keycap 1-9 did not work.
+NUM_EMOJIS = (
+	('1', '1⃣'), ('2', '2⃣'), ('3', '3⃣'), ('4', '4⃣'), ('5', '5⃣'), ('6', '6⃣'), ('7', '7⃣'), ('8', '8⃣'), ('9', '9⃣'),
+	('10', '\U0001F51F'),
+	('a', '\N{REGIONAL INDICATOR SYMBOL LETTER A}'), ('b', '\N{REGIONAL INDICATOR SYMBOL LETTER B}'),
+	('c', '\N{REGIONAL INDICATOR SYMBOL LETTER C}'), ('d', '\N{REGIONAL INDICATOR SYMBOL LETTER D}'),
+	('e', '\N{REGIONAL INDICATOR SYMBOL LETTER E}'), ('f', '\N{REGIONAL INDICATOR SYMBOL LETTER F}'),
+	('g', '\N{REGIONAL INDICATOR SYMBOL LETTER G}'), ('h', '\N{REGIONAL INDICATOR SYMBOL LETTER H}'),
+	('i', '\N{REGIONAL INDICATOR SYMBOL LETTER I}'), ('j', '\N{REGIONAL INDICATOR SYMBOL LETTER J}'),
+	('k', '\N{REGIONAL INDICATOR SYMBOL LETTER K}'), ('l', '\N{REGIONAL INDICATOR SYMBOL LETTER L}'),
+	('m', '\N{REGIONAL INDICATOR SYMBOL LETTER M}'), ('n', '\N{REGIONAL INDICATOR SYMBOL LETTER N}'),
+	('o', '\N{REGIONAL INDICATOR SYMBOL LETTER O}'), ('p', '\N{REGIONAL INDICATOR SYMBOL LETTER P}'),
+	('q', '\N{REGIONAL INDICATOR SYMBOL LETTER Q}'), ('r', '\N{REGIONAL INDICATOR SYMBOL LETTER R}'),
+	('s', '\N{REGIONAL INDICATOR SYMBOL LETTER S}'), ('t', '\N{REGIONAL INDICATOR SYMBOL LETTER T}'),
+	('u', '\N{REGIONAL INDICATOR SYMBOL LETTER U}'), ('v', '\N{REGIONAL INDICATOR SYMBOL LETTER V}'),
+	('w', '\N{REGIONAL INDICATOR SYMBOL LETTER W}'), ('x', '\N{REGIONAL INDICATOR SYMBOL LETTER X}'),
+	('y', '\N{REGIONAL INDICATOR SYMBOL LETTER Y}'), ('z', '\N{REGIONAL INDICATOR SYMBOL LETTER Z}'),
+	('0', '0⃣'),
+)
+
+# Named emoji sets for e=<name>. Each is an immutable tuple in option order.
+EMOJI_SETS = types.MappingProxyType({
+	'default': tuple(emoji for key, emoji in NUM_EMOJIS),
+	'numbers': tuple(emoji for key, emoji in NUM_EMOJIS[:10]),
+	'letters': tuple(emoji for key, emoji in NUM_EMOJIS[10:36]),
+	'colors': ('\U0001F534', '\U0001F7E0', '\U0001F7E1', '\U0001F7E2', '\U0001F535', '\U0001F7E3', '\U0001F7E4',
+			   '⚫', '⚪'),
+	'fruit': ('\U0001F34E', '\U0001F34A', '\U0001F34B', '\U0001F34C', '\U0001F349', '\U0001F347', '\U0001F353',
+			  '\U0001F352', '\U0001F351', '\U0001F34D', '\U0001F350', '\U0001F34F'),
+})
+
+# Reverse maps, emoji -> option index, built once per set and shared by every poll that uses it.
+EMOJI_INDEXES = types.MappingProxyType({name: types.MappingProxyType({emoji: i for i, emoji in enumerate(emojis)})
+										for name, emojis in EMOJI_SETS.items()})
+
+TOKEN_RE = re.compile(r'(t|n|s|r|e|m|live)\s*=\s*(.*)$', re.IGNORECASE | re.DOTALL)
+NUMBER_RE = re.compile(r'[0-9]{1,18}$')
+LIVE_DEFAULT = ('', 'on')  # live= and live=on use the default edit interval
+
+# One unicode emoji as Discord accepts it for a reaction: a keycap, a flag, or a pictograph with optional variation
+# selector, skin tone and tag characters, possibly joined to more of them with zero-width joiners.
+_PICTOGRAPH = (r'[\u00a9\u00ae\u203c\u2049\u2122\u2139\u2194-\u21aa\u231a-\u23ff\u24c2\u25aa-\u27bf\u2934\u2935'
+			   r'\u2b05-\u2b55\u3030\u303d\u3297\u3299\U0001F000-\U0001FAFF][\ufe0e\ufe0f]?[\U0001F3FB-\U0001F3FF]?')
+EMOJI_RE = re.compile(r'(?:[0-9#*]\ufe0f?\u20e3|[\U0001F1E6-\U0001F1FF]{{2}}|{0}(?:\u200d{0})*'
+					  r'[\U000E0020-\U000E007F]*)$'.format(_PICTOGRAPH))
+
+
+class PollSyntaxError(ValueError):
+	pass
+
+
+class TooManyChoices(PollSyntaxError):
+	pass
+
+
+class PollSpec(object):
+	"""Everything parsed from a poll command. `index` maps each option emoji to its option number.
+
+	`index` may be shared with other polls and cover more emojis than this poll uses; an emoji is one of this poll's
+	options only if its index is below len(options)."""
+
+	__slots__ = ('question', 'options', 'emojis', 'index', 'duration', 'mc', 'mode', 'start_in', 'remind', 'live')
+
+	def __init__(self, question, options, emojis, index, duration=DEFAULT_DURATION, mc=1, mode='choice',
+				 start_in=None, remind=None, live=None):
+		self.question = question
+		self.options = options
+		self.emojis = emojis
+		self.index = index
+		self.duration = duration
+		self.mc = mc
+		self.mode = mode
+		self.start_in = start_in
+		self.remind = remind
+		self.live = live
+
+	def option(self, emoji):
+		"""Returns the option number for `emoji`, or None if it isn't one of this poll's options."""
+		i = self.index.get(emoji)
+		return i if i is not None and i < len(self.options) else None
+
+
+def _emoji_set(value):
+	"""Returns (emojis, index) for e=: a set name, or the emojis themselves separated by spaces or commas. Returns
+	None if it's neither, e.g. the answer `e=mc2`."""
+	name = value.lower()
+	if name in EMOJI_SETS:
+		return EMOJI_SETS[name], EMOJI_INDEXES[name]
+	emojis = tuple(value.replace(',', ' ').split())
+	if any(emoji.startswith('<') for emoji in emojis):
+		raise PollSyntaxError("e= takes a set name ({}) or unicode emojis".format(', '.join(sorted(EMOJI_SETS))))
+	if not emojis or not all(EMOJI_RE.match(emoji) for emoji in emojis):
+		return None
+	index = {}
+	for i, emoji in enumerate(emojis):
+		if index.setdefault(emoji, i) != i:
+			raise PollSyntaxError("Each option needs its own emoji")
+	return emojis, index
+
+
+def parse_poll(text, live_interval=None):
+	"""Parses `question;option1;option2...;n=1;t=60` in a single pass over its ;-separated tokens.
+
+	Settings can go anywhere; the first other token is the question and the rest are options, in order. Unparseable
+	t= and n= values fall back to their defaults, as they always have. Any other setting with a value it can't take
+	is read as an option instead, so answers like `e=mc2` or `m=one` still work. Raises PollSyntaxError
+	(TooManyChoices if n= is larger than the number of options)."""
+	question = None
+	options = []
+	duration = DEFAULT_DURATION
+	mc = None
+	mode = 'choice'
+	start_in = remind = live = None
+	emojis, index = EMOJI_SETS['default'], EMOJI_INDEXES['default']
+
+	for token in text.split(';'):
+		token = token.strip()
+		if not token:
+			continue
+		match = TOKEN_RE.match(token)
+		key = match.group(1).lower() if match else None
+		value = match.group(2).strip() if match else ''
+		number = int(value) if NUMBER_RE.match(value) else None
+		emoji_set = _emoji_set(value) if key == 'e' else None
+		if key == 't':
+			duration = number if number is not None else DEFAULT_DURATION
+		elif key == 'n':
+			mc = number if number is not None else 1
+		elif key == 's' and number is not None:
+			start_in = number
+		elif key == 'r' and number is not None:
+			remind = number
+		elif emoji_set is not None:
+			emojis, index = emoji_set
+		elif key == 'm' and value.lower() in MODES:
+			mode = value.lower()
+		elif key == 'live' and (number is not None or value.lower() in LIVE_DEFAULT):
+			live = number if number is not None else live_interval
+		elif question is None:
+			question = token
+		else:
+			options.append(token)
+
+	if question is None or not options:
+		raise PollSyntaxError("A poll needs a question and at least one option")
+	if len(options) > min(len(emojis), MAX_REACTIONS * MAX_MESSAGES):
+		raise PollSyntaxError("Too many options: {} given, at most {} with these emojis".format(
+			len(options), min(len(emojis), MAX_REACTIONS * MAX_MESSAGES)))
+	if mode == 'approval':
+		mc = len(options)  # Vote for as many as you like.
+	elif mode == 'ranked':
+		mc = min(len(options), MAX_ORDERED) if mc is None else mc
+		if mc > MAX_ORDERED:
+			raise PollSyntaxError("Ranked polls can rank at most {} options".format(MAX_ORDERED))
+	elif mc is None:
+		mc = 1
+	if mc > len(options):
+		raise TooManyChoices("Number of votes per person is greater than number of options")
+	return PollSpec(question, options, emojis[:len(options)], index, duration, max(mc, 1), mode, start_in, remind,
+					live)
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from perfstats import registry as perf
+
+# DB_PATH is under the home directory, so Red instances on one host share polls.db. A flush waits up to this long
+# for another instance's to commit.
+BUSY_TIMEOUT_MS = 5000
+
+SCHEMA = """CREATE TABLE
+IF NOT EXISTS polls (
+  message_id TEXT PRIMARY KEY,
+  channel_id TEXT NOT NULL,
+  deadline REAL NOT NULL,
+  state TEXT NOT NULL
+);
+CREATE TABLE
+IF NOT EXISTS poll_archive (
+  poll_id INTEGER PRIMARY KEY,
+  message_id TEXT NOT NULL UNIQUE,
+  guild_id TEXT NOT NULL,
+  channel_id TEXT NOT NULL,
+  author_id TEXT NOT NULL,
+  question TEXT NOT NULL,
+  mode TEXT NOT NULL,
+  mc INTEGER NOT NULL,
+  started_at REAL NOT NULL,
+  ended_at REAL NOT NULL,
+  voters INTEGER NOT NULL,
+  votes INTEGER NOT NULL,
+  first_votes INTEGER NOT NULL,
+  first_vote_delay REAL NOT NULL,
+  winner INTEGER,
+  rounds INTEGER,
+  options TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS archive_guild ON poll_archive (guild_id, ended_at);
+CREATE INDEX IF NOT EXISTS archive_channel ON poll_archive (channel_id, ended_at);
+CREATE INDEX IF NOT EXISTS archive_author ON poll_archive (author_id, ended_at);
+CREATE TABLE
+IF NOT EXISTS poll_ballots (
+  poll_id INTEGER NOT NULL,
+  user_id TEXT NOT NULL,
+  choices TEXT NOT NULL,
+  PRIMARY KEY (poll_id, user_id)
+) WITHOUT ROWID;"""
+
+# archive_* columns, in the order archive records are built in.
+ARCHIVE_COLUMNS = ('message_id', 'guild_id', 'channel_id', 'author_id', 'question', 'mode', 'mc', 'started_at',
+				   'ended_at', 'voters', 'votes', 'first_votes', 'first_vote_delay', 'winner', 'rounds', 'options')
+LISTING_FILTERS = ('channel_id', 'author_id')  # Each one leads an index with ended_at, as guild_id does.
+
+
+def encode_state(state):
+	"""JSON for a poll's to_state(), with its VoteStore snapshot written out as {user id: [emoji, ...]}."""
+	emojis = [emoji for emoji, label in state["answers"]]
+	votes = {str(user_id): [emojis[option] for option in choices] for user_id, choices in state["votes"].items()}
+	return json.dumps(dict(state, votes=votes))
+
+
+class PollStore(object):
+	"""Keeps running polls in SQLite so they survive a restart or a cog reload.
+
+	Writes are behind and batched: a vote only marks its poll dirty, and flush() saves every poll changed since the
+	last flush in one transaction on a worker thread. A crash loses at most one flush interval of votes, and those
+	are picked up again from the message's reactions when the poll is restored.
+
+	Ended polls are archived the same way: archive() only queues the results, and the next flush writes them in
+	that same transaction, so ending a burst of polls costs the event loop nothing but a list append."""
+
+	def __init__(self, db_file):
+		self.db_file = db_file
+		self._conn = None
+		self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="alphapoll-db")
+		self._dirty = {}  # message id -> poll with unsaved changes
+		self._ended = set()  # message ids of polls that ended since the last flush
+		self._archived = []  # (archive record, ballots) for polls that ended since the last flush
+
+	def _connect(self):
+		db_dir = os.path.dirname(self.db_file)
+		if db_dir:
+			os.makedirs(db_dir, exist_ok=True)
+
+		conn = sqlite3.connect(self.db_file, timeout=BUSY_TIMEOUT_MS / 1000)
+		conn.execute("PRAGMA journal_mode=WAL;")
+		conn.execute("PRAGMA busy_timeout={};".format(BUSY_TIMEOUT_MS))
+		conn.execute("PRAGMA synchronous=NORMAL;")
+		conn.executescript(SCHEMA)
+		return conn
+
+	def _call(self, func, args):
+		# The connection is opened lazily by the store's one thread and only ever used there, so flushes, restores and
+		# archive lookups queue up behind each other instead of sharing it.
+		if self._conn is None:
+			self._conn = self._connect()
+		with perf.timer("sql.alphapoll." + func.__name__.lstrip("_")):
+			return func(self._conn, *args)
+
+	async def run(self, func, *args):
+		"""Awaits func(conn, *args) on the store's thread."""
+		loop = asyncio.get_event_loop()
+		return await loop.run_in_executor(self._executor, self._call, func, args)
+
+	def close(self):
+		"""Writes anything still pending, then closes the connection. Blocks until the worker thread is done."""
+		saved, ended, archived = self._take_pending()
+		if saved or ended or archived:
+			self._executor.submit(self._call, self._write, (saved, ended, archived))
+
+		def _close():
+			if self._conn is not None:
+				self._conn.close()
+				self._conn = None
+
+		self._executor.submit(_close)
+		self._executor.shutdown(wait=True)
+
+	# Write-behind queue. These run on the event loop and never touch the database.
+
+	def mark_dirty(self, poll):
+		if poll.valid:  # An ended poll has already been queued for removal by mark_ended().
+			self._dirty[poll.message.id] = poll
+
+	def mark_ended(self, poll):
+		self._dirty.pop(poll.message.id, None)
+		self._ended.add(poll.message.id)
+
+	def forget(self, message_id):
+		self._ended.add(message_id)
+
+	def archive(self, record, ballots=None):
+		"""Queues an ended poll's results, a tuple in ARCHIVE_COLUMNS order, plus optional (user id, choices) rows."""
+		self._archived.append((record, ballots))
+
+	def _take_pending(self):
+		# Polls are snapshotted here, on the loop, so the worker thread never reads a poll while a vote changes it.
+		# The snapshot copies the vote arrays whole; turning them into JSON is left to the worker thread.
+		saved = [(message_id, poll.channel.id, poll.deadline, poll.to_state())
+				 for message_id, poll in self._dirty.items()]
+		ended = [(message_id,) for message_id in self._ended]
+		archived = self._archived
+		self._dirty = {}
+		self._ended = set()
+		self._archived = []
+		return saved, ended, archived
+
+	async def flush(self):
+		"""Saves every poll marked dirty, drops every poll marked ended and archives ended polls' results, in a single
+		transaction."""
+		saved, ended, archived = self._take_pending()
+		if saved or ended or archived:
+			await self.run(self._write, saved, ended, archived)
+			perf.incr("alphapoll.polls_saved", len(saved))
+			perf.incr("alphapoll.polls_archived", len(archived))
+
+	# SQL. The static methods take the connection as their first argument and are only called through run():
+	# _write is the flush transaction, the rest are the reads behind restore_polls() and the $pollhistory commands.
+
+	@staticmethod
+	def _write(conn, saved, ended, archived=()):
+		saved = [(message_id, channel_id, deadline, encode_state(state))
+				 for message_id, channel_id, deadline, state in saved]
+		with conn:
+			conn.executemany("INSERT OR REPLACE INTO polls (message_id, channel_id, deadline, state) VALUES (?,?,?,?);",
+							 saved)
+			conn.executemany("DELETE FROM polls WHERE message_id=?;", ended)
+			for record, ballots in archived:
+				# OR IGNORE: a poll is archived once, even if a retried flush sees it again.
+				cursor = conn.execute("INSERT OR IGNORE INTO poll_archive ({}) VALUES ({});".format(
+					", ".join(ARCHIVE_COLUMNS), ", ".join("?" for _ in ARCHIVE_COLUMNS)), record)
+				if ballots and cursor.rowcount:
+					conn.executemany("INSERT INTO poll_ballots (poll_id, user_id, choices) VALUES (?,?,?);",
+									 ((cursor.lastrowid, user_id, choices) for user_id, choices in ballots))
+
+	@staticmethod
+	def _load(conn):
+		return [(message_id, channel_id, json.loads(state))
+				for message_id, channel_id, state in conn.execute("SELECT message_id, channel_id, state FROM polls "
+																  "ORDER BY deadline;")]
+
+	async def load(self):
+		"""Returns (message_id, channel_id, state) for every saved poll, soonest deadline first."""
+		return await self.run(self._load)
+
+
+	# Archive queries
+
+	@staticmethod
+	def _history(conn, guild_id, column, value, before, limit):
+		if before is None:
+			cursor = (float("inf"), 0)  # Start from the newest poll.
+		else:
+			cursor = conn.execute("SELECT ended_at, poll_id FROM poll_archive WHERE poll_id=?;", (before,)).fetchone()
+			if cursor is None:
+				return []
+		where, args = "guild_id = ?", (guild_id,)
+		if column is not None:
+			where, args = where + " AND {} = ?".format(column), args + (value,)
+		# The (ended_at, poll_id) cursor walks an index backwards from the last page; no count or offset needed.
+		return conn.execute("SELECT poll_id, channel_id, author_id, question, ended_at, voters FROM poll_archive "
+							"WHERE {} AND (ended_at, poll_id) < (?, ?) "
+							"ORDER BY ended_at DESC, poll_id DESC LIMIT ?;".format(where),
+							args + tuple(cursor) + (limit,)).fetchall()
+
+	async def history(self, guild_id, column=None, value=None, limit=10, before=None):
+		"""Returns up to `limit` of a guild's archived polls, newest first, as (poll_id, channel_id, author_id,
+		question, ended_at, voters). Narrow them with a `column` from LISTING_FILTERS and its `value`, and page
+		back with `before`, the ID of the last poll shown."""
+		if column is not None and column not in LISTING_FILTERS:
+			raise ValueError("can't list archived polls by {}".format(column))
+		return await self.run(self._history, guild_id, column, value, before, limit)
+
+	@staticmethod
+	def _archived_poll(conn, guild_id, poll_id):
+		row = conn.execute("SELECT {} FROM poll_archive WHERE poll_id=? AND guild_id=?;".format(
+			", ".join(ARCHIVE_COLUMNS)), (poll_id, guild_id)).fetchone()
+		if row is None:
+			return None
+		poll = dict(zip(ARCHIVE_COLUMNS, row))
+		poll["options"] = json.loads(poll["options"])
+		return poll
+
+	async def archived_poll(self, guild_id, poll_id):
+		"""Returns one archived poll from this guild as a dict keyed by ARCHIVE_COLUMNS, or None."""
+		return await self.run(self._archived_poll, guild_id, poll_id)
+
+	@staticmethod
+	def _trends(conn, guild_id, since, bucket):
+		return conn.execute("SELECT CAST(ended_at / ? AS INTEGER) * ? AS period, COUNT(*), AVG(voters), "
+							"SUM(first_vote_delay), SUM(first_votes) FROM poll_archive "
+							"WHERE guild_id = ? AND ended_at >= ? GROUP BY period ORDER BY period;",
+							(bucket, bucket, guild_id, since)).fetchall()
+
+	async def trends(self, guild_id, since, bucket=86400):
+		"""Returns (period start, polls, average voters, average seconds to first vote) per `bucket` seconds since
+		`since`, oldest first. The average time to vote is None for periods with no timed votes."""
+		rows = await self.run(self._trends, guild_id, since, bucket)
+		return [(period, polls, voters, delay / timed if timed else None)
+				for period, polls, voters, delay, timed in rows]
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+from array import array
+
+MAX_ORDERED = 10  # Choices a voter's record can keep in order: 10 option numbers of 6 bits each.
+_WORD = (1 << 64) - 1
+_FIB = 11400714819323198485  # 2**64 / golden ratio, for Fibonacci hashing of user IDs
+
+
+class VoteStore(object):
+	"""Every voter's current choices, at 12 or 16 bytes per table slot.
+
+	Voters live in an open-addressing hash table over two arrays: user IDs (Discord snowflakes, never 0) and one
+	packed record each. With `ordered` set, a record holds up to MAX_ORDERED option numbers, oldest first, plus
+	how many there are, so the oldest choice is the one evicted and rankings keep their order. Otherwise a record
+	is a bitmask of option numbers, for approval polls where order doesn't matter. Per-option totals are kept
+	alongside, so reading the tally never walks the voters.
+
+	Records are 32 bits when they fit (up to 4 ordered choices, or 32 options unordered) and 64 bits otherwise.
+	User IDs stay 64 bits: snowflakes use all of them, so 8 bytes a slot is the floor."""
+
+	__slots__ = ('mc', 'ordered', 'counts', '_keys', '_records', '_typecode', '_count_shift', '_shift', '_used')
+
+	def __init__(self, options, mc, ordered=True):
+		if ordered and mc > MAX_ORDERED:
+			raise ValueError("at most {} ordered choices per voter".format(MAX_ORDERED))
+		self.mc = mc
+		self.ordered = ordered
+		self.counts = [0] * options
+		# 4 bits of count above 6 per option number, or one bit per option.
+		bits = 6 * mc + 4 if ordered else options
+		self._typecode = 'I' if bits <= 32 else 'Q'
+		self._count_shift = 28 if bits <= 32 else 60
+		self._alloc(64)
+
+	def _alloc(self, capacity):
+		self._keys = array('Q', bytes(8 * capacity))
+		self._records = array(self._typecode, bytes(array(self._typecode).itemsize * capacity))
+		self._shift = 64 - capacity.bit_length() + 1
+		self._used = 0
+
+	def _slot(self, user_id):
+		"""Returns the slot holding user_id, or the empty slot where it would go."""
+		keys = self._keys
+		mask = len(keys) - 1
+		i = ((user_id * _FIB) & _WORD) >> self._shift
+		while True:
+			key = keys[i]
+			if key == user_id or key == 0:
+				return i
+			i = (i + 1) & mask
+
+	def _grow(self):
+		keys, records = self._keys, self._records
+		self._alloc(len(keys) * 2)
+		for key, record in zip(keys, records):
+			if key:
+				i = self._slot(key)
+				self._keys[i] = key
+				self._records[i] = record
+				self._used += 1
+
+	def copy(self):
+		"""A snapshot that later votes don't change. Copying the arrays is a memcpy, however many voters there are."""
+		other = VoteStore.__new__(VoteStore)
+		other.mc = self.mc
+		other.ordered = self.ordered
+		other.counts = list(self.counts)
+		other._keys = self._keys[:]
+		other._records = self._records[:]
+		other._typecode = self._typecode
+		other._count_shift = self._count_shift
+		other._shift = self._shift
+		other._used = self._used
+		return other
+
+	def __len__(self):
+		"""Voters with at least one choice."""
+		return sum(1 for record in self._records if record)
+
+	@property
+	def seen(self):
+		"""Voters who have voted at all, including ones who have since withdrawn every choice."""
+		return self._used
+
+	@property
+	def nbytes(self):
+		return len(self._keys) * self._keys.itemsize + len(self._records) * self._records.itemsize
+
+	# Records
+
+	def _unpack(self, record):
+		if self.ordered:
+			return [(record >> (6 * k)) & 63 for k in range(record >> self._count_shift)]
+		return [option for option in range(len(self.counts)) if record >> option & 1]
+
+	def _pack(self, choices):
+		if self.ordered:
+			record = len(choices) << self._count_shift
+			for k, option in enumerate(choices):
+				record |= option << (6 * k)
+			return record
+		record = 0
+		for option in choices:
+			record |= 1 << option
+		return record
+
+	def choices(self, user_id):
+		"""The voter's choices, oldest first (lowest option first for unordered stores)."""
+		user_id = int(user_id)
+		i = self._slot(user_id)
+		return self._unpack(self._records[i]) if self._keys[i] == user_id else []
+
+	def add(self, user_id, option):
+		"""Records a vote. Returns (added, evicted): whether it was new, and the option dropped to stay within mc.
+
+		Ordered stores evict the voter's oldest choice; unordered ones their lowest-numbered other choice."""
+		user_id = int(user_id)
+		i = self._slot(user_id)
+		if self._keys[i] != user_id:
+			if (self._used + 1) * 3 > len(self._keys) * 2:
+				self._grow()
+				i = self._slot(user_id)
+			self._keys[i] = user_id
+			self._used += 1
+
+		record = self._records[i]
+		evicted = None
+		if self.ordered:
+			# Shifting the record in place: unpacking it to a list and back costs more than the rest of add().
+			count_shift = self._count_shift
+			count = record >> count_shift
+			seq = record & ((1 << count_shift) - 1)
+			for k in range(count):
+				if (seq >> (6 * k)) & 63 == option:
+					return False, None
+			if count >= self.mc:
+				evicted = seq & 63
+				seq >>= 6
+				count -= 1
+			self._records[i] = (count + 1) << count_shift | seq | option << (6 * count)
+		else:
+			if record >> option & 1:
+				return False, None
+			if bin(record).count('1') >= self.mc:
+				evicted = (record & -record).bit_length() - 1
+				record &= ~(1 << evicted)
+			self._records[i] = record | 1 << option
+
+		self.counts[option] += 1
+		if evicted is not None:
+			self.counts[evicted] -= 1
+		return True, evicted
+
+	def remove(self, user_id, option):
+		"""Withdraws a vote. Returns False if the voter hadn't chosen `option`."""
+		user_id = int(user_id)
+		i = self._slot(user_id)
+		if self._keys[i] != user_id:
+			return False
+		choices = self._unpack(self._records[i])
+		if option not in choices:
+			return False
+		choices.remove(option)
+		self._records[i] = self._pack(choices)
+		self.counts[option] -= 1
+		return True
+
+	def clear(self):
+		self.counts = [0] * len(self.counts)
+		self._alloc(64)
+
+	def items(self):
+		"""Yields (user_id, choices) for every voter with at least one choice."""
+		for key, record in zip(self._keys, self._records):
+			if record:
+				yield key, self._unpack(record)
+
+	def ballots(self):
+		for user_id, choices in self.items():
+			yield choices
+
+
+def instant_runoff(ballots, options):
+	"""Ranked-choice count. Returns (winner, rounds), where rounds holds each round's first-preference totals.
+
+	Each round, every ballot counts for its highest-ranked option still standing; if no option has a majority of
+	the ballots still counting, the option with the fewest votes (the later one, on a tie) is eliminated."""
+	ballots = [ballot for ballot in ballots if ballot]
+	standing = set(range(options))
+	rounds = []
+	while standing:
+		totals = [0] * options
+		counting = 0
+		for ballot in ballots:
+			for option in ballot:
+				if option in standing:
+					totals[option] += 1
+					counting += 1
+					break
+		rounds.append(totals)
+		if not counting:
+			return None, rounds
+		leader = max(standing, key=lambda option: (totals[option], -option))
+		if totals[leader] * 2 > counting or len(standing) == 1:
+			return leader, rounds
+		standing.remove(min(standing, key=lambda option: (totals[option], -option)))
+	return None, rounds
@@ -0,0 +1,623 @@
+# -*- coding: utf-8 -*-
+"""Offline benchmarks for AlphaPoll.
+
+    python bench_alphapoll.py seed --polls 10 --channels 10 --options 21
+    python bench_alphapoll.py parse --fuzz 100000
+    python bench_alphapoll.py votes --voters 100000
+    python bench_alphapoll.py ingest --rate 10000 --seconds 5
+    python bench_alphapoll.py live --votes 3000 --seconds 4 --interval 2
+
+seed starts --polls polls spread over --channels channels against a simulated Discord that enforces the per-channel
+reaction rate limit (one add every --interval seconds, answering early calls with a 429 and Retry-After) and takes
+--latency seconds per call. It compares the old fixed sleep(0.2) between reactions with the paced per-channel queues,
+reporting time-to-ready (poll message sent to last option seeded) and how many calls were rate limited.
+
+parse times poll command parsing and option lookups, then throws --fuzz random commands at the parser and checks
+that each one either parses into a consistent spec or raises PollSyntaxError.
+
+votes casts --votes-each votes for each of --voters simulated voters and compares the memory and time of the old
+dict of per-user emoji sets with the packed VoteStore.
+
+ingest runs the AlphaPoll cog against a fake client adapter and replays --rate raw reaction events per second for
+--seconds, most of them on one hot poll and the rest spread over --polls - 1 quiet ones, dispatched one task per
+event the way discord.py does. It reports how long events waited before reaching the tally on the hot and the
+quiet polls, the deepest the inboxes got, how many events were dropped, and whether every tally matches the reactions
+once the run has settled.
+
+live runs a live-results poll through the cog against a client that records every edit, casts --votes votes spread
+over --seconds, then ends the poll. It checks that the edits were coalesced: no message is edited again within
+--interval seconds (except for the final tally when the poll ends), the number of edits stays within one per
+interval, and the last edit of each message shows the final tally.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+import types
+
+from bench_fakes import FakeBot, install_fake_red
+
+
+class FakeResponse(object):
+    def __init__(self, status, headers):
+        self.status = status
+        self.headers = headers
+
+
+class FakeChannel(object):
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+
+class FakeMessage(object):
+    def __init__(self, message_id, channel):
+        self.id = message_id
+        self.channel = channel
+
+
+class FakeDiscord(object):
+    """Simulated reaction endpoint with one rate-limit bucket per channel."""
+
+    def __init__(self, discord, interval, latency, headers):
+        self.discord = discord
+        self.interval = interval
+        self.latency = latency
+        self.headers = headers
+        self.reset_at = {}  # channel id -> when the bucket next allows a call
+        self.calls = 0
+        self.rate_limited = 0
+
+    async def add_reaction(self, message, emoji):
+        self.calls += 1
+        await asyncio.sleep(self.latency / 2)
+        now = time.monotonic()
+        reset_at = self.reset_at.get(message.channel.id, 0.0)
+        if now < reset_at:
+            self.rate_limited += 1
+            await asyncio.sleep(self.latency / 2)
+            raise self.discord.HTTPException(FakeResponse(429, {'Retry-After': str(reset_at - now)}), "rate limited")
+        self.reset_at[message.channel.id] = now + self.interval
+        await asyncio.sleep(self.latency / 2)
+        if self.headers:
+            return {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset-After': str(self.interval)}
+        return None
+
+
+async def seed_fixed(server, message, emojis):
+    """The original NewReactPoll.start loop. Like discord.py, a 429 is slept off and retried."""
+    for emoji in emojis:
+        while True:
+            try:
+                await server.add_reaction(message, emoji)
+                break
+            except server.discord.HTTPException as e:
+                await asyncio.sleep(float(e.response.headers['Retry-After']))
+        await asyncio.sleep(0.2)
+
+
+async def seed_queued(queues, message, emojis):
+    await asyncio.gather(*(queues.add(message, emoji) for emoji in emojis))
+
+
+async def run_mode(mode, args, discord):
+    from alphapoll.reactions import ReactionQueues
+
+    server = FakeDiscord(discord, args.interval, args.latency, args.headers)
+    queues = ReactionQueues(server.add_reaction, interval=args.interval)
+    emojis = [str(i) for i in range(args.options)]
+    channels = [FakeChannel(i) for i in range(args.channels)]
+    ready = []
+
+    async def one_poll(n):
+        message = FakeMessage(n, channels[n % len(channels)])
+        started = time.monotonic()
+        if mode == 'fixed':
+            await seed_fixed(server, message, emojis)
+        else:
+            await seed_queued(queues, message, emojis)
+        ready.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    await asyncio.gather(*(one_poll(n) for n in range(args.polls)))
+    elapsed = time.monotonic() - started
+    queues.close()
+    ready.sort()
+    return {
+        'seconds': round(elapsed, 3),
+        'ready_p50_s': round(ready[len(ready) // 2], 3),
+        'ready_max_s': round(ready[-1], 3),
+        'calls': server.calls,
+        'rate_limited': server.rate_limited,
+    }
+
+
+async def run_seed(args):
+    discord = install_fake_red()
+    report = {'polls': args.polls, 'channels': args.channels, 'options': args.options, 'modes': {}}
+    for mode in ('fixed', 'queued'):
+        print(f"running {mode}...", file=sys.stderr)
+        report['modes'][mode] = await run_mode(mode, args, discord)
+    return report
+
+
+def print_seed_report(report):
+    print(f"{report['polls']} polls of {report['options']} options over {report['channels']} channels")
+    print(f"{'mode':<8}{'total s':>9}{'ready p50':>11}{'ready max':>11}{'calls':>7}{'429s':>6}")
+    for mode, stats in report['modes'].items():
+        print(f"{mode:<8}{stats['seconds']:>9}{stats['ready_p50_s']:>11}{stats['ready_max_s']:>11}"
+              f"{stats['calls']:>7}{stats['rate_limited']:>6}")
+
+
+FUZZ_TOKENS = ('', ' ', 'Question?', 'yes', 'no', 't=', 't=30', 't=abc', 'T = 5', 'n=', 'n=2', 'n=0', 'n=99', 's=10',
+               'r=5', 'r=x', 'live', 'Live', 'LIVE=3', 'live=', 'live=on', 'live=x', 'e=fruit', 'e=letters', 'e=colors',
+               'e=nope', 'e=mc2', 'm=ranked', 'm=approval', 'M = choice', 'm=other', 'n=11',
+               'e=\U0001F34E \U0001F34E', 'e=<:custom:1>', 'e=\U0001F34E,\U0001F34C,\U0001F347', 'net=1', 'at=3',
+               'e=\U0001F44D\U0001F3FD #\ufe0f\u20e3 \U0001F1EB\U0001F1F7',
+               '=', ';', 'x' * 300, '\u20e3', '\n')
+
+
+def fuzz_parser(cases, seed=0):
+    """Feeds random token soup to parse_poll and checks every spec it returns. Returns (parsed, rejected)."""
+    from alphapoll.spec import EMOJI_RE, MAX_MESSAGES, MAX_REACTIONS, PollSyntaxError, parse_poll
+
+    rng = random.Random(seed)
+    parsed = rejected = 0
+    for _ in range(cases):
+        text = ';'.join(rng.choice(FUZZ_TOKENS) if rng.random() < 0.6 else f"option {rng.randint(0, 99)}"
+                        for _ in range(rng.randint(0, 45)))
+        try:
+            spec = parse_poll(text, live_interval=5)
+        except PollSyntaxError:
+            rejected += 1
+            continue
+        parsed += 1
+        assert spec.question and spec.options, text
+        assert len(spec.emojis) == len(spec.options) <= MAX_REACTIONS * MAX_MESSAGES, text
+        assert len(set(spec.emojis)) == len(spec.emojis), text
+        assert all(EMOJI_RE.match(emoji) for emoji in spec.emojis), text
+        assert 1 <= spec.mc <= len(spec.options), text
+        assert [spec.option(emoji) for emoji in spec.emojis] == list(range(len(spec.options))), text
+        # Bare words and settings with values they can't take are answers, never silently swallowed.
+        for answer in ('live', 'Live', 'live=x', 'e=nope', 'e=mc2', 'm=other', 'r=x'):
+            assert (answer in spec.options or answer == spec.question) == (answer in text.split(';')), text
+    return parsed, rejected
+
+
+def run_parse(args):
+    from alphapoll.spec import parse_poll
+
+    report = {'parse_us': {}, 'lookup_ns': {}}
+    for options in (3, 20, 37):
+        text = "Question?;" + ";".join(f"option {i}" for i in range(options)) + ";n=2;t=600"
+        report['parse_us'][f"{options} options"] = round(
+            timeit.timeit(lambda: parse_poll(text), number=args.number) / args.number * 1e6, 2)
+    text = "Question?;" + ";".join(f"option {i}" for i in range(10)) + ";e=fruit;live=on"
+    report['parse_us']["10 options, e=fruit"] = round(
+        timeit.timeit(lambda: parse_poll(text), number=args.number) / args.number * 1e6, 2)
+
+    spec = parse_poll("Question?;" + ";".join(f"option {i}" for i in range(37)))
+    emojis = list(spec.emojis)
+    last = emojis[-1]
+    report['lookup_ns']['list scan'] = round(
+        timeit.timeit(lambda: last in emojis, number=args.number * 10) / (args.number * 10) * 1e9, 1)
+    report['lookup_ns']['spec.option'] = round(
+        timeit.timeit(lambda: spec.option(last), number=args.number * 10) / (args.number * 10) * 1e9, 1)
+
+    if args.fuzz:
+        print(f"fuzzing {args.fuzz} commands...", file=sys.stderr)
+        report['fuzz_parsed'], report['fuzz_rejected'] = fuzz_parser(args.fuzz)
+    return report
+
+
+def print_parse_report(report):
+    for name, us in report['parse_us'].items():
+        print(f"parse {name:<24}{us:>9} us")
+    for name, ns in report['lookup_ns'].items():
+        print(f"lookup {name:<23}{ns:>9} ns")
+    if 'fuzz_parsed' in report:
+        print(f"fuzz: {report['fuzz_parsed']} parsed, {report['fuzz_rejected']} rejected, no invariant failures")
+
+
+def cast_votes(args):
+    """The same random votes for every store: (user ID, option), with Discord-sized snowflake IDs. Each of the
+    --voters reacts to --votes-each different options, and everyone's reactions are interleaved, as they arrive."""
+    rng = random.Random(2)
+    votes = []
+    for user_id in rng.sample(range(10 ** 17, 10 ** 17 + 10 ** 16), args.voters):
+        options = rng.sample(range(args.options), min(args.votes_each, args.options))
+        votes.extend((str(user_id), option) for option in options)
+    rng.shuffle(votes)
+    return votes
+
+
+def legacy_store(votes, emojis, mc):
+    """The original reaction_listener bookkeeping: a set of emoji strings per user ID, set.pop() past the limit."""
+    already_voted = {}
+    for user_id, option in votes:
+        choices = already_voted.setdefault(user_id, set())
+        choices.add(emojis[option])
+        if len(choices) > mc:
+            choices.pop()
+    return already_voted
+
+
+def packed_store(votes, emojis, mc):
+    from alphapoll.votes import MAX_ORDERED, VoteStore
+
+    store = VoteStore(len(emojis), mc, ordered=mc <= MAX_ORDERED)
+    for user_id, option in votes:
+        store.add(user_id, option)
+    return store
+
+
+def votes_kept(store):
+    return sum(store.counts) if hasattr(store, 'counts') else sum(len(choices) for choices in store.values())
+
+
+def run_votes(args):
+    from alphapoll.spec import EMOJI_SETS
+
+    emojis = EMOJI_SETS['default'][:args.options]
+    votes = cast_votes(args)
+    report = {'voters': args.voters, 'votes': len(votes), 'stores': {}}
+    for name, build in (('dict of sets', legacy_store), ('VoteStore', packed_store)):
+        # Timed and measured in separate passes: tracemalloc slows every allocation down.
+        started = time.perf_counter()
+        build(votes, emojis, args.mc)
+        elapsed = time.perf_counter() - started
+        tracemalloc.start()
+        store = build(votes, emojis, args.mc)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        report['stores'][name] = {
+            'bytes_per_voter': round(size / args.voters, 1),
+            'us_per_vote': round(elapsed / len(votes) * 1e6, 2),
+            'kept': votes_kept(store),
+        }
+        del store
+    return report
+
+
+def print_votes_report(report):
+    print(f"{report['voters']} voters, {report['votes']} votes")
+    print(f"{'store':<14}{'bytes/voter':>13}{'us/vote':>9}{'votes kept':>12}")
+    for name, stats in report['stores'].items():
+        print(f"{name:<14}{stats['bytes_per_voter']:>13}{stats['us_per_vote']:>9}{stats['kept']:>12}")
+
+
+class StampedId(int):
+    """A user ID that remembers when the bench dispatched its event, so the wait can be measured where it's handled."""
+
+    def __new__(cls, user_id, sent_at):
+        self = super().__new__(cls, user_id)
+        self.sent_at = sent_at
+        return self
+
+
+class FakeClient(object):
+    """Offline stand-in for alphapoll.client.DiscordClient, keeping every message's reactions in memory."""
+
+    def __init__(self, latency):
+        self.loop = asyncio.get_event_loop()
+        self.latency = latency
+        self.user_id = 1
+        self.ids = itertools.count(10 ** 17)
+        self.reactions = {}  # message id -> {emoji: {user id: None}}, in reaction order
+
+    async def wait_until_ready(self):
+        pass
+
+    def get_channel(self, channel_id):
+        return None
+
+    async def send(self, channel, content):
+        await asyncio.sleep(self.latency)
+        message = FakeMessage(next(self.ids), channel)
+        self.reactions[message.id] = {}
+        return message
+
+    async def edit(self, message, content):
+        await asyncio.sleep(self.latency)
+
+    async def fetch_message(self, channel, message_id):
+        await asyncio.sleep(self.latency)
+        return FakeMessage(message_id, channel) if message_id in self.reactions else None
+
+    async def reaction_counts(self, message):
+        return {emoji: len(users) for emoji, users in self.reactions[message.id].items() if users}
+
+    async def reaction_users(self, message):
+        # One round trip per hundred users, like paging through a reaction's users.
+        users = {emoji: list(users) for emoji, users in self.reactions[message.id].items() if users}
+        await asyncio.sleep(self.latency * sum(len(ids) // 100 + 1 for ids in users.values()))
+        return users
+
+    async def add_reaction(self, message, emoji):
+        await asyncio.sleep(self.latency)
+        self.react(message, emoji, self.user_id, True)
+
+    async def remove_reaction(self, message, emoji, user_id):
+        await asyncio.sleep(self.latency)
+        self.react(message, emoji, user_id, False)
+
+    async def clear_reactions(self, message):
+        await asyncio.sleep(self.latency)
+
+    def react(self, message, emoji, user_id, added):
+        """Records a reaction change. Returns False if it changed nothing, as Discord sends no event then."""
+        users = self.reactions[message.id].setdefault(emoji, {})
+        if added == (user_id in users):
+            return False
+        if added:
+            users[user_id] = None
+        else:
+            del users[user_id]
+        return True
+
+
+class RecordingClient(FakeClient):
+    """FakeClient that keeps every edit it's asked to make, and when."""
+
+    def __init__(self, latency):
+        super().__init__(latency)
+        self.edits = []  # (time.perf_counter() at the call, message id, content)
+
+    async def edit(self, message, content):
+        self.edits.append((time.perf_counter(), message.id, content))
+        await super().edit(message, content)
+
+
+async def run_live(args):
+    install_fake_red()
+    import alphapoll.alphapoll as alphapoll
+
+    client = RecordingClient(args.latency)
+    cog = alphapoll.AlphaPoll(FakeBot(), client=client, db_path=os.path.join(args.db_dir, 'polls.db'))
+    await cog.cog_load()
+    cog.min_live_interval = min(cog.min_live_interval, args.interval)
+    channel = FakeChannel(1)
+    channel.guild = FakeChannel(0)
+    text = "Live?;{};live={};t=3600".format(";".join(f"option {i}" for i in range(args.options)), args.interval)
+    poll = alphapoll.NewReactPoll(types.SimpleNamespace(channel=channel, author=types.SimpleNamespace(id=2)), text,
+                                  cog)
+    await cog.start_poll(poll)
+    await asyncio.gather(*poll.seeding)
+
+    rng = random.Random(5)
+    started = time.perf_counter()
+    for n in range(args.votes):
+        # One vote per voter, spread evenly over --seconds and delivered the way the listener gets them.
+        await asyncio.sleep(max(started + args.seconds * n / args.votes - time.perf_counter(), 0))
+        emoji = rng.choice(poll.emojis)
+        message = poll.message_for(emoji)
+        client.react(message, emoji, 10 ** 17 + n, True)
+        await cog.on_raw_reaction_add(types.SimpleNamespace(
+            message_id=message.id, channel_id=channel.id, user_id=10 ** 17 + n,
+            emoji=types.SimpleNamespace(name=emoji, id=None)))
+    while cog.inbox.depth():
+        await asyncio.sleep(0.01)
+    voting = time.perf_counter() - started
+    during = len(client.edits)
+    await poll.endPoll()
+    elapsed = time.perf_counter() - started
+    final = poll.render_pages()
+    cog.cog_unload()
+
+    by_message = {}
+    for at, message_id, content in client.edits:
+        by_message.setdefault(message_id, []).append((at, content))
+    # The end of the poll flushes the final tally right away, so only the gaps before each message's last edit count.
+    gaps = [b[0] - a[0] for edits in by_message.values() for a, b in zip(edits, edits[1:-1])]
+    bound = (int(elapsed / args.interval) + 2) * len(poll.pages)
+    report = {
+        'votes': args.votes, 'seconds': round(voting, 2), 'interval': args.interval, 'pages': len(poll.pages),
+        'edits_while_voting': during, 'edits': len(client.edits), 'bound': bound,
+        'min_gap_s': round(min(gaps), 3) if gaps else None,
+        'final_matches': [by_message[message.id][-1][1] for message in poll.messages] == final,
+    }
+    assert report['edits'] <= bound, report
+    assert not gaps or min(gaps) >= args.interval - 0.05, report
+    assert report['final_matches'], report
+    return report
+
+
+def print_live_report(report):
+    print(f"{report['votes']} votes over {report['seconds']}s on {report['pages']} live message(s), "
+          f"edits at most every {report['interval']}s")
+    print(f"edits: {report['edits_while_voting']} while voting, {report['edits']} in all (bound {report['bound']}), "
+          f"closest two {report['min_gap_s'] if report['min_gap_s'] is not None else '-'}s apart; "
+          f"final tally shown: {report['final_matches']}")
+
+
+async def run_ingest(args):
+    install_fake_red()
+    import alphapoll.alphapoll as alphapoll
+    from perfstats import registry as perf
+
+    client = FakeClient(args.latency)
+    cog = alphapoll.AlphaPoll(FakeBot(), client=client, db_path=os.path.join(args.db_dir, 'polls.db'))
+    await cog.cog_load()
+    cog.inbox.maxsize = args.maxsize
+    perf.reset()
+
+    polls = []
+    for n in range(args.polls):
+        channel = FakeChannel(n)
+        channel.guild = FakeChannel(0)
+        text = "Question {};{};m=approval;t=3600".format(n, ";".join(f"option {i}" for i in range(args.options)))
+        author = types.SimpleNamespace(id=2)
+        poll = alphapoll.NewReactPoll(types.SimpleNamespace(channel=channel, author=author), text, cog)
+        await cog.start_poll(poll)
+        polls.append(poll)
+    await asyncio.gather(*(asyncio.gather(*poll.seeding) for poll in polls))
+
+    hot = polls[0]
+    waits = {'hot': [], 'quiet': []}
+    handle = cog.inbox.handle
+
+    def timed_handle(poll, event):
+        waits['hot' if poll is hot else 'quiet'].append(time.perf_counter() - event[2].sent_at)
+        handle(poll, event)
+    cog.inbox.handle = timed_handle
+
+    loop = asyncio.get_event_loop()
+    rng = random.Random(3)
+    voters = [10 ** 17 + 10 ** 9 + i for i in range(args.voters)]
+    peak = {'depth': 0, 'lag': 0.0}
+
+    async def sample():
+        while True:
+            expected = loop.time() + 0.01
+            await asyncio.sleep(0.01)
+            peak['lag'] = max(peak['lag'], loop.time() - expected)
+            peak['depth'] = max(peak['depth'], cog.inbox.depth())
+    sampler = loop.create_task(sample())
+
+    if args.trace_memory:
+        tracemalloc.start()
+    sent = dispatched_events = 0
+    started = time.perf_counter()
+    while True:
+        elapsed = time.perf_counter() - started
+        if elapsed >= args.seconds:
+            break
+        due = int(elapsed * args.rate)
+        for _ in range(due - sent):
+            poll = hot if rng.random() < args.hot else rng.choice(polls[1:] or polls)
+            message = poll.message
+            emoji = rng.choice(poll.emojis)
+            user_id = StampedId(rng.choice(voters), time.perf_counter())
+            added = rng.random() < 0.7
+            if client.react(message, emoji, user_id, added):
+                dispatched_events += 1
+                listener = cog.on_raw_reaction_add if added else cog.on_raw_reaction_remove
+                payload = types.SimpleNamespace(message_id=message.id, channel_id=message.channel.id, user_id=user_id,
+                                                emoji=types.SimpleNamespace(name=emoji, id=None))
+                loop.create_task(listener(payload))
+        sent = due
+        await asyncio.sleep(0.001)
+    dispatched = time.perf_counter() - started
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+    tracemalloc.stop()
+
+    # Let the inboxes drain and the resync each overflow triggers finish.
+    while (cog.inbox.depth() or
+           perf.counters.get('alphapoll.resyncs', 0) < perf.counters.get('alphapoll.ingest_overflows', 0)):
+        await asyncio.sleep(0.1)
+    sampler.cancel()
+
+    mismatched = 0
+    for poll in polls:
+        truth = [0] * len(poll.emojis)
+        for emoji, users in client.reactions[poll.message.id].items():
+            truth[poll.option(emoji)] = len(users) - (client.user_id in users)
+        mismatched += truth != poll.votes.counts
+    for poll in polls:
+        await poll.endPoll()
+    cog.cog_unload()
+
+    report = {
+        'rate': args.rate, 'seconds': round(dispatched, 2), 'events': dispatched_events, 'polls': args.polls,
+        'maxsize': args.maxsize, 'max_depth': peak['depth'], 'loop_max_lag_ms': round(peak['lag'] * 1000, 1),
+        'dropped': perf.counters.get('alphapoll.ingest_dropped', 0),
+        'resyncs': perf.counters.get('alphapoll.resyncs', 0),
+        'tallies_mismatched': mismatched, 'waits': {},
+    }
+    if traced_peak is not None:
+        report['traced_peak_mb'] = round(traced_peak / 2 ** 20, 1)
+    for name, samples in waits.items():
+        if samples:
+            samples.sort()
+            report['waits'][name] = {
+                'events': len(samples),
+                'p50_ms': round(samples[len(samples) // 2] * 1000, 2),
+                'p99_ms': round(samples[min(len(samples) - 1, len(samples) * 99 // 100)] * 1000, 2),
+                'max_ms': round(samples[-1] * 1000, 2),
+            }
+    return report
+
+
+def print_ingest_report(report):
+    print(f"{report['events']} events in {report['seconds']}s ({report['rate']}/s drawn, minus no-op removals) "
+          f"over {report['polls']} polls")
+    print(f"inbox: max depth {report['max_depth']} (limit {report['maxsize']} per poll), "
+          f"{report['dropped']} dropped, {report['resyncs']} resyncs, "
+          f"{report['tallies_mismatched']} tallies off after settling")
+    print(f"event loop: max lag {report['loop_max_lag_ms']}ms" +
+          (f", traced memory peak {report['traced_peak_mb']}MB" if 'traced_peak_mb' in report else ""))
+    print(f"{'polls':<7}{'events':>8}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for name, stats in report['waits'].items():
+        print(f"{name:<7}{stats['events']:>8}{stats['p50_ms']:>9}{stats['p99_ms']:>9}{stats['max_ms']:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for AlphaPoll.")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('seed', help="seed option reactions against a simulated rate limit")
+    p.add_argument('--polls', type=int, default=10, help="polls started at once")
+    p.add_argument('--channels', type=int, default=10, help="channels the polls are spread over")
+    p.add_argument('--options', type=int, default=21, help="options (reactions) per poll")
+    p.add_argument('--interval', type=float, default=0.25, help="simulated per-channel rate limit, in seconds")
+    p.add_argument('--latency', type=float, default=0.08, help="simulated round trip per call, in seconds")
+    p.add_argument('--headers', action='store_true', help="return X-RateLimit-* headers on success")
+
+    p = sub.add_parser('parse', help="time poll command parsing and fuzz the parser")
+    p.add_argument('--number', type=int, default=20000, help="iterations per timing")
+    p.add_argument('--fuzz', type=int, default=0, help="random commands to check against the parser")
+
+    p = sub.add_parser('votes', help="compare vote store memory and speed")
+    p.add_argument('--voters', type=int, default=100000, help="simulated voters")
+    p.add_argument('--votes-each', type=int, default=3, help="reactions added per voter")
+    p.add_argument('--options', type=int, default=20, help="options in the poll")
+    p.add_argument('--mc', type=int, default=2, help="votes allowed per voter")
+
+    p = sub.add_parser('ingest', help="replay a reaction storm through the cog's reaction inboxes")
+    p.add_argument('--rate', type=int, default=10000, help="reaction events per second")
+    p.add_argument('--seconds', type=float, default=5, help="how long to keep the events coming")
+    p.add_argument('--polls', type=int, default=20, help="running polls")
+    p.add_argument('--hot', type=float, default=0.9, help="share of the events that go to the first poll")
+    p.add_argument('--options', type=int, default=5, help="options per poll")
+    p.add_argument('--voters', type=int, default=20000, help="distinct simulated voters")
+    p.add_argument('--maxsize', type=int, default=2000, help="events held per poll before dropping")
+    p.add_argument('--latency', type=float, default=0.001, help="simulated round trip per client call, in seconds")
+    p.add_argument('--trace-memory', action='store_true', help="also report peak traced memory (slows the run)")
+
+    p = sub.add_parser('live', help="check that live results edits are coalesced")
+    p.add_argument('--votes', type=int, default=3000, help="votes cast while the poll runs")
+    p.add_argument('--seconds', type=float, default=4, help="how long the votes keep coming")
+    p.add_argument('--interval', type=int, default=2, help="live=<seconds> for the poll")
+    p.add_argument('--options', type=int, default=5, help="options in the poll (over 20 adds messages)")
+    p.add_argument('--latency', type=float, default=0.01, help="simulated round trip per client call, in seconds")
+
+    args = parser.parse_args(argv)
+    if args.command == 'seed':
+        report, printer = asyncio.run(run_seed(args)), print_seed_report
+    elif args.command == 'parse':
+        report, printer = run_parse(args), print_parse_report
+    elif args.command == 'votes':
+        report, printer = run_votes(args), print_votes_report
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            args.db_dir = tmp
+            if args.command == 'live':
+                report, printer = asyncio.run(run_live(args)), print_live_report
+            else:
+                report, printer = asyncio.run(run_ingest(args)), print_ingest_report
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        printer(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Stand-ins for the parts of discord.py and Red that bench_postbank.py and bench_alphapoll.py drive the cogs through.
+
+install_fake_red() has to run before a cog is imported. Each bench adds its own fakes for what it measures: the
+bank and command context for PostBank, the client adapter for AlphaPoll.
+"""
+import sys
+import types
+
+
+def install_fake_red(bank=None):
+    """Registers just enough of discord and redbot.core in sys.modules for the cogs to import and run without
+    either. Returns the fake discord module, for benches that raise its exceptions."""
+
+    class HTTPException(Exception):
+        def __init__(self, response, message):
+            super().__init__(message)
+            self.response = response
+
+    class NotFound(HTTPException):
+        pass
+
+    class Cog(object):
+        @staticmethod
+        def listener(*args, **kwargs):
+            return lambda func: func
+
+    def passthrough(*args, **kwargs):
+        return lambda func: func
+
+    def group(*args, **kwargs):
+        def decorator(func):
+            func.command = passthrough
+            return func
+        return decorator
+
+    class Value(object):
+        def __init__(self, data, key):
+            self.data, self.key = data, key
+
+        async def __call__(self):
+            return self.data[self.key]
+
+        async def set(self, value):
+            self.data[self.key] = value
+
+    class Group(object):
+        def __init__(self, data):
+            self.__dict__['data'] = data
+
+        async def all(self):
+            return dict(self.data)
+
+        def __getattr__(self, key):
+            return Value(self.data, key)
+
+    class Config(object):
+        @classmethod
+        def get_conf(cls, cog, identifier, force_registration=False, cog_name=None):
+            return cls()
+
+        def __init__(self):
+            self.defaults, self.guilds, self.globals = {}, {}, {}
+
+        def register_guild(self, **defaults):
+            self.defaults.update(defaults)
+
+        def register_global(self, **defaults):
+            self.globals.update(defaults)
+
+        def __getattr__(self, key):
+            return Value(self.globals, key)
+
+        def guild(self, guild):
+            return Group(self.guilds.setdefault(guild.id, dict(self.defaults)))
+
+    discord = types.ModuleType('discord')
+    discord.HTTPException = HTTPException
+    discord.NotFound = NotFound
+    discord.Object = types.SimpleNamespace
+    core = types.ModuleType('redbot.core')
+    core.commands = types.SimpleNamespace(Cog=Cog, command=passthrough, group=group, guild_only=passthrough)
+    core.checks = types.SimpleNamespace(is_owner=passthrough)
+    core.bank = bank
+    core.Config = Config
+    chat_formatting = types.ModuleType('redbot.core.utils.chat_formatting')
+    chat_formatting.escape = lambda text, **kwargs: text
+    chat_formatting.box = lambda text, lang="": f"```{lang}\n{text}\n```"
+    chat_formatting.pagify = lambda text, **kwargs: [text]
+    utils = types.ModuleType('redbot.core.utils')
+    utils.chat_formatting = chat_formatting
+
+    sys.modules['discord'] = discord
+    sys.modules['redbot'] = types.ModuleType('redbot')
+    sys.modules['redbot.core'] = core
+    sys.modules['redbot.core.utils'] = utils
+    sys.modules['redbot.core.utils.chat_formatting'] = chat_formatting
+    return discord
+
+
+class FakeBot(object):
+    """What the cogs ask of the bot outside a command: guild lookups, and registering the shared $perfstats."""
+
+    def __init__(self, guilds=()):
+        self.guilds = {guild.id: guild for guild in guilds}
+        self.commands = {}
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    def get_command(self, name):
+        return self.commands.get(name)
+
+    def add_command(self, command):
+        self.commands[command.__name__] = command
+
+    def remove_command(self, name):
+        return self.commands.pop(name, None)
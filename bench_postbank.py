@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""Offline load test for the PostBank cog.
+
+    python bench_postbank.py --rows 100000 --ops 20000 --concurrency 64
+    python bench_postbank.py --mix feedback=1 --rows 1000,10000,100000,1000000
+    python bench_postbank.py --check --balance 1 --steal 0.3 --bank-errors 0.05 --users 20 --mix post=3,feedback=2
+
+Drives post, feedback, update, recent and need against an in-process fake Discord context and a fake
+redbot.core bank, on a seeded database of --rows posts. Reports p50/p99 latency and throughput per command, plus how
+long the event loop was blocked. Nothing touches the network or a real Red instance, so runs are comparable
+across storage-layer changes.
+
+Several comma-separated --rows sizes run one after another on fresh databases, followed by a table of each command's
+latency by size. Lookups by ID should stay flat as the table grows.
+
+--check stress-tests consistency instead of speed: with low --balance, posts regularly fail can_spend; --steal has
+"another cog" spend the credit right after a passing can_spend, so the withdrawal fails and the post is rolled back;
+--bank-errors makes deposits raise, so feedback is rolled back. Afterwards every member's balance must equal their
+starting balance plus reviews given, minus posts made and credits stolen, every post's numreviews must match its
+reviews, and user_stats must match a rebuild. Any mismatch is printed and the exit status is 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from bench_fakes import FakeBot, install_fake_red
+
+FEEDBACK_TEXT = "solid mix, the low end is tight and the vocal sits nicely; maybe bring the hats down a touch " * 3
+
+
+class FakeBank(object):
+    """In-memory stand-in for redbot.core.bank. Every call yields to the loop like Red's Config-backed bank does."""
+
+    def __init__(self, start_balance, steal=0.0, errors=0.0, seed=2):
+        self.start_balance = start_balance
+        self.balances = {}
+        self.steal = steal  # Chance another cog spends a credit right after a passing can_spend.
+        self.errors = errors  # Chance a deposit raises.
+        self.stolen = {}  # member id -> credits spent behind the cog's back
+        self.rng = random.Random(seed)
+
+    async def get_balance(self, member):
+        await asyncio.sleep(0)
+        return self.balances.setdefault(member.id, self.start_balance)
+
+    async def can_spend(self, member, amount):
+        allowed = await self.get_balance(member) >= amount
+        if allowed and self.rng.random() < self.steal:
+            asyncio.get_event_loop().call_soon(self.spend_elsewhere, member.id, amount)
+        return allowed
+
+    def spend_elsewhere(self, member_id, amount):
+        if self.balances[member_id] >= amount:
+            self.balances[member_id] -= amount
+            self.stolen[member_id] = self.stolen.get(member_id, 0) + amount
+
+    async def withdraw_credits(self, member, amount):
+        if await self.get_balance(member) < amount:
+            raise ValueError("insufficient funds")
+        self.balances[member.id] -= amount
+
+    async def deposit_credits(self, member, amount):
+        await self.get_balance(member)
+        if self.rng.random() < self.errors:
+            raise RuntimeError("bank unavailable")
+        self.balances[member.id] += amount
+
+    async def set_balance(self, member, amount):
+        self.balances[member.id] = amount
+
+
+class FakeMember(object):
+    def __init__(self, member_id):
+        self.id = member_id
+        self.name = self.display_name = f"user{member_id}"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGuild(object):
+    def __init__(self, guild_id, members):
+        self.id = guild_id
+        self.members = {m.id: m for m in members}
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+
+class FakeMessage(object):
+    def __init__(self, author, content, guild):
+        self.author = author
+        self.content = content
+        self.guild = guild
+        self.channel = None
+        self.mentions = []
+
+    async def delete(self):
+        await asyncio.sleep(0)
+
+
+class FakeContext(object):
+    prefix = '$'
+
+    def __init__(self, author, content, guild):
+        self.message = FakeMessage(author, content, guild)
+        self.guild = guild
+        self.sent = []
+
+    async def send(self, content):
+        await asyncio.sleep(0)
+        self.sent.append(content)
+
+
+class LoopLagMonitor(object):
+    """Measures event-loop blocking by how late a short periodic sleep wakes up."""
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.max_lag = 0.0
+        self.blocked = 0.0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - expected
+            if lag > self.interval:
+                self.blocked += lag
+            self.max_lag = max(self.max_lag, lag)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+
+def seed(db_file, rows, members):
+    """Fills a guild database with `rows` posts, bypassing the cog. Odd posts have one review by someone other than
+    their poster and even ones have none, so numreviews matches the reviews table."""
+    from postbank.storage import InitDb
+
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    InitDb(conn)
+    rng = random.Random(0)
+    ids = [str(m.id) for m in members]
+    posters = [rng.randrange(len(ids)) for _ in range(rows)]
+    with conn:
+        conn.executemany("INSERT INTO postbank (feedbackid, userid, link, link_canonical, numreviews) "
+                         "VALUES (?,?,?,?,?);",
+                         ((i, ids[posters[i - 1]], f"https://soundcloud.com/seed/{i}", f"soundcloud.com/seed/{i}",
+                           i % 2) for i in range(1, rows + 1)))
+        conn.executemany("INSERT INTO reviews (feedbackid, reviewer_id, text) VALUES (?,?,?);",
+                         ((i, ids[(posters[i - 1] + rng.randrange(1, len(ids))) % len(ids)], FEEDBACK_TEXT)
+                          for i in range(1, rows + 1, 2)))
+    conn.close()
+
+
+def check_consistency(db_file, bank, members, rows, seeded_reviews):
+    """Returns a list of problems with the balances, posts, reviews and stats after a run, plus how many posts
+    were rolled back."""
+    conn = sqlite3.connect(db_file)
+    problems = []
+    posts = dict(conn.execute("SELECT userid, COUNT(*) FROM postbank WHERE feedbackid > ? GROUP BY userid;", (rows,)))
+    given = dict(conn.execute("SELECT reviewer_id, COUNT(*) FROM reviews WHERE review_id > ? GROUP BY reviewer_id;",
+                              (seeded_reviews,)))
+    for member in members:
+        uid = str(member.id)
+        balance = bank.balances.get(member.id, bank.start_balance)
+        expected = bank.start_balance - posts.get(uid, 0) + given.get(uid, 0) - bank.stolen.get(member.id, 0)
+        if balance != expected or balance < 0:
+            problems.append(f"{uid}: balance {balance}, expected {expected}")
+
+    mismatched = conn.execute("SELECT COUNT(*) FROM postbank WHERE numreviews != "
+                              "(SELECT COUNT(*) FROM reviews WHERE reviews.feedbackid = postbank.feedbackid);")
+    orphans = conn.execute("SELECT COUNT(*) FROM reviews WHERE feedbackid NOT IN (SELECT feedbackid FROM postbank);")
+    for label, (count,) in (("posts whose numreviews doesn't match their reviews", mismatched.fetchone()),
+                            ("reviews of posts that don't exist", orphans.fetchone())):
+        if count:
+            problems.append(f"{count} {label}")
+
+    stats = {row[0]: row[1:] for row in conn.execute(
+        "SELECT userid, posts, reviews_given, reviews_received, credits_earned FROM user_stats;")}
+    expected_stats = {}
+    for userid, count, received in conn.execute("SELECT userid, COUNT(*), SUM(numreviews) FROM postbank "
+                                                "GROUP BY userid;"):
+        expected_stats[userid] = [count, 0, received, 0]
+    for reviewer_id, count in conn.execute("SELECT reviewer_id, COUNT(*) FROM reviews GROUP BY reviewer_id;"):
+        expected_stats.setdefault(reviewer_id, [0, 0, 0, 0])[1::2] = [count, count]
+    for userid in set(stats) | set(expected_stats):
+        actual, expected = list(stats.get(userid, (0, 0, 0, 0))), expected_stats.get(userid, [0, 0, 0, 0])
+        if actual != expected:
+            problems.append(f"{userid}: user_stats {actual}, expected {expected}")
+
+    sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'postbank';").fetchone()
+    rolled_back = (sequence[0] if sequence else rows) - rows - sum(posts.values())
+    conn.close()
+    return problems, rolled_back
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(args):
+    bank = FakeBank(args.balance, args.steal, args.bank_errors)
+    install_fake_red(bank)
+    from postbank.postbank import PostBank
+
+    members = [FakeMember(10 ** 17 + i) for i in range(args.users)]
+    guild = FakeGuild(1, members)
+    cog = PostBank(FakeBot([guild]))
+    await cog.cog_load()
+    cog.db_dir = args.db_dir
+    print(f"seeding {args.rows} posts...", file=sys.stderr)
+    db_file = os.path.join(args.db_dir, f"postbank-{guild.id}.db")
+    seed(db_file, args.rows, members)
+    seeded_reviews = (args.rows + 1) // 2
+    await cog.get_db(guild).rebuild_stats()
+
+    mix = {}
+    for part in args.mix.split(','):
+        name, weight = part.split('=')
+        mix[name] = float(weight)
+    names, weights = list(mix), list(mix.values())
+    rng = random.Random(1)
+    next_link = [0]
+
+    def make_call():
+        command = rng.choices(names, weights)[0]
+        member = rng.choice(members)
+        feedback_id = rng.randint(1, args.rows)
+        if command == 'post':
+            next_link[0] += 1
+            content = f"$post https://soundcloud.com/bench/{next_link[0]}"
+        elif command == 'feedback':
+            content = f"$feedback {feedback_id} {FEEDBACK_TEXT}"
+        elif command == 'update':
+            content = f"$update {feedback_id} https://soundcloud.com/edit/{feedback_id}"
+        elif command == 'need' and rng.random() < 0.5:
+            content = f"$need before:{feedback_id}"
+        elif command == 'recent' and rng.random() < 0.5:
+            content = f"$recent before:{feedback_id}"
+        else:
+            content = f"${command}"
+        return command, getattr(cog, command), FakeContext(member, content, guild)
+
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    calls = [make_call() for _ in range(args.ops)]
+    queue = iter(calls)
+
+    async def worker():
+        for command, func, ctx in queue:
+            started = time.perf_counter()
+            try:
+                await func(ctx)
+            except Exception:
+                if not args.check:
+                    raise
+                errors[command] += 1  # Red would report it; the cog has already rolled back.
+            latencies[command].append(time.perf_counter() - started)
+
+    monitor = LoopLagMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    monitor.stop()
+    cog.cog_unload()
+
+    report = {
+        'rows': args.rows, 'ops': args.ops, 'concurrency': args.concurrency,
+        'seconds': round(elapsed, 3), 'ops_per_second': round(args.ops / elapsed, 1),
+        'loop_max_lag_ms': round(monitor.max_lag * 1000, 3), 'loop_blocked_ms': round(monitor.blocked * 1000, 3),
+        'commands': {},
+    }
+    if args.check:
+        problems, rolled_back = check_consistency(db_file, bank, members, args.rows, seeded_reviews)
+        report['check'] = {
+            'problems': problems, 'posts_rolled_back': rolled_back,
+            'credits_stolen': sum(bank.stolen.values()), 'command_errors': sum(errors.values()),
+        }
+    for name, samples in latencies.items():
+        if samples:
+            report['commands'][name] = {
+                'count': len(samples),
+                'p50_ms': round(percentile(samples, 50) * 1000, 3),
+                'p99_ms': round(percentile(samples, 99) * 1000, 3),
+            }
+    return report
+
+
+def print_report(report):
+    print(f"{report['ops']} ops over {report['rows']} rows at concurrency {report['concurrency']}: "
+          f"{report['seconds']}s, {report['ops_per_second']} ops/s")
+    print(f"event loop: max lag {report['loop_max_lag_ms']}ms, blocked {report['loop_blocked_ms']}ms total")
+    print(f"{'command':<10}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, stats in report['commands'].items():
+        print(f"{name:<10}{stats['count']:>8}{stats['p50_ms']:>10}{stats['p99_ms']:>10}")
+    check = report.get('check')
+    if check:
+        print(f"consistency: {check['credits_stolen']} credits stolen, {check['posts_rolled_back']} posts rolled "
+              f"back, {check['command_errors']} commands raised; {len(check['problems'])} problems")
+        for problem in check['problems']:
+            print(f"  {problem}")
+
+
+def print_scaling(reports):
+    print(f"{'command':<10}{'rows':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name in reports[0]['commands']:
+        for report in reports:
+            stats = report['commands'].get(name)
+            if stats:
+                print(f"{name:<10}{report['rows']:>10}{stats['p50_ms']:>10}{stats['p99_ms']:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the PostBank cog.")
+    parser.add_argument('--rows', default="1000", help="posts seeded before the run; a comma-separated list runs "
+                                                       "once per size")
+    parser.add_argument('--ops', type=int, default=5000, help="total commands to run")
+    parser.add_argument('--concurrency', type=int, default=32, help="commands in flight at once")
+    parser.add_argument('--users', type=int, default=200, help="distinct fake members")
+    parser.add_argument('--mix', default="post=1,feedback=4,update=1,recent=2,need=2",
+                        help="relative weight of each command")
+    parser.add_argument('--balance', type=int, default=10 ** 9, help="every member's starting balance")
+    parser.add_argument('--steal', type=float, default=0.0,
+                        help="chance another cog spends the credit between can_spend and the withdrawal")
+    parser.add_argument('--bank-errors', type=float, default=0.0, help="chance a deposit raises")
+    parser.add_argument('--check', action='store_true',
+                        help="verify balances, posts, reviews and stats afterwards; exit 1 on a mismatch")
+    parser.add_argument('--db-dir', help="where to put the database (default: a temporary directory)")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    sizes = [int(rows) for rows in args.rows.split(',')]
+
+    reports = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_dir = args.db_dir or tmp
+        for rows in sizes:
+            args.rows = rows
+            args.db_dir = os.path.join(db_dir, str(rows)) if len(sizes) > 1 else db_dir
+            os.makedirs(args.db_dir, exist_ok=True)
+            reports.append(asyncio.run(run(args)))
+
+    if args.json:
+        print(json.dumps(reports[0] if len(reports) == 1 else reports, indent=2))
+    else:
+        for report in reports:
+            print_report(report)
+        if len(reports) > 1:
+            print()
+            print_scaling(reports)
+    if any(report.get('check', {}).get('problems') for report in reports):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""Bulk import/export for PostBank data.
+
+    python migrate_bank.py export ~/.postbank/postbank-<guild>.db posts.jsonl --table postbank
+    python migrate_bank.py import ~/.postbank/postbank-<guild>.db posts.jsonl --table postbank
+    python migrate_bank.py v2bank data/economy/bank.json balances.csv
+    python migrate_bank.py vacuum ~/.postbank/postbank-<guild>.db
+
+Rows are streamed in fixed-size chunks, so memory use doesn't grow with the table. Imports write each chunk with
+executemany inside a single transaction. Both directions print a resume point with their progress: pass it back
+with --after (export) or --skip (import) to pick up where an interrupted run stopped. An import ends by recounting
+the user_stats table behind the leaderboards.
+
+v2bank flattens a Red v2 bank.json into a balance file. Red v3 keeps balances in its own Config, so they're loaded
+from inside the bot: copy the file to the bot's machine and run $importBalances <path> in the server it belongs to.
+$exportBalances writes the same format, to move balances back out.
+
+vacuum switches a database made before PostBank used incremental auto_vacuum over to it, so the hourly maintenance
+can compact it. It rewrites the whole file, so run it with the bot stopped.
+"""
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+import time
+
+from postbank.balances import BANK_COLUMNS
+from postbank.links import canonical_link
+from postbank.storage import InitDb, rebuild_stats
+
+# Exported columns per table. Each is paged by its INTEGER PRIMARY KEY (the rowid alias).
+TABLES = {
+    'postbank': ('feedbackid', 'userid', 'link', 'numreviews', 'link_canonical', 'created_at'),
+    'postbank_archive': ('feedbackid', 'userid', 'link', 'numreviews', 'link_canonical', 'created_at', 'archived_at'),
+    'reviews': ('review_id', 'feedbackid', 'reviewer_id', 'created_at', 'text'),
+}
+NULLABLE = {'link_canonical', 'created_at', 'archived_at', 'text'}
+
+
+class Progress(object):
+    """Prints a throttled progress line to stderr."""
+
+    def __init__(self, label, interval=1.0):
+        self.label = label
+        self.interval = interval
+        self.count = 0
+        self.started = time.monotonic()
+        self._last = 0.0
+
+    def update(self, n, resume=None):
+        self.count += n
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.report(resume)
+
+    def report(self, resume=None):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        line = f"{self.label}: {self.count} rows ({self.count / elapsed:.0f} rows/s)"
+        if resume is not None:
+            line += f", resume with {resume}"
+        print(line, file=sys.stderr)
+
+    def finish(self):
+        print(f"{self.label}: done, {self.count} rows in {time.monotonic() - self.started:.1f}s", file=sys.stderr)
+
+
+def open_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    InitDb(conn)
+    return conn
+
+
+def writer_for(fmt, out, columns, header=True):
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        if header:
+            writer.writerow(columns)
+        return writer.writerows
+
+    def write_jsonl(rows):
+        out.writelines(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+    return write_jsonl
+
+
+def read_records(fmt, f, columns):
+    """Yields one tuple per input record, in `columns` order."""
+    if fmt == 'csv':
+        for record in csv.DictReader(f):
+            # CSV has no NULL, so empty optional fields come back as ''.
+            yield tuple(None if c in NULLABLE and record.get(c) == '' else record.get(c) for c in columns)
+    else:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield tuple(record.get(c) for c in columns)
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export_table(args):
+    columns = TABLES[args.table]
+    conn = open_db(args.db)
+    query = (f"SELECT rowid, {', '.join(columns)} FROM {args.table} "
+             f"WHERE rowid > ? ORDER BY rowid LIMIT ?;")
+    progress = Progress(f"export {args.table}")
+    after = args.after
+
+    # A resumed export appends to the file the interrupted run left behind.
+    with open(args.path, 'a' if after else 'w', newline='', encoding='utf-8') as out:
+        write = writer_for(args.format, out, columns, header=not after)
+        while True:
+            # Keyset paging: each chunk is an index range scan starting where the last one stopped.
+            rows = conn.execute(query, (after, args.chunk)).fetchall()
+            if not rows:
+                break
+            after = rows[-1][0]
+            write(row[1:] for row in rows)
+            progress.update(len(rows), f"--after {after}")
+
+    progress.finish()
+    conn.close()
+
+
+def import_table(args):
+    columns = TABLES[args.table]
+    conn = open_db(args.db)
+    # OR IGNORE keeps a resumed or repeated import from failing on rows that are already present.
+    query = (f"INSERT OR IGNORE INTO {args.table} ({', '.join(columns)}) "
+             f"VALUES ({', '.join('?' for _ in columns)});")
+    canonical_index = columns.index('link_canonical') if 'link_canonical' in columns else None
+    progress = Progress(f"import {args.table}")
+    done = args.skip
+    skipped = 0
+
+    with open(args.path, newline='', encoding='utf-8') as f:
+        records = read_records(args.format, f, columns)
+        for _ in range(args.skip):
+            next(records, None)
+
+        for chunk in chunked(records, args.chunk):
+            if canonical_index is not None:
+                # Exports from before link_canonical existed still need a duplicate-detection key.
+                chunk = [row if row[canonical_index] else
+                         row[:canonical_index] + (canonical_link(row[2]),) + row[canonical_index + 1:]
+                         for row in chunk]
+            with conn:
+                # rowcount leaves out trigger writes, e.g. to the reviews full-text index, which total_changes counts.
+                inserted = conn.executemany(query, chunk).rowcount
+            skipped += len(chunk) - inserted
+            done += len(chunk)
+            progress.update(len(chunk), f"--skip {done}")
+
+    progress.finish()
+    if skipped:
+        print(f"{skipped} rows were already present or duplicated an existing link and were skipped.",
+              file=sys.stderr)
+    if done - args.skip > skipped:
+        # Imported rows bypass the per-command stats updates, so recount them for the leaderboards.
+        print("rebuilding user_stats...", file=sys.stderr)
+        rebuild_stats(conn)
+    conn.close()
+
+
+def convert_v2_bank(args):
+    """Flattens a Red v2 economy bank.json ({server: {user: account}}) into one balance row per account."""
+    with open(args.bank, encoding='utf-8') as f:
+        servers = json.load(f)
+
+    progress = Progress("v2bank")
+    with open(args.path, 'w', newline='', encoding='utf-8') as out:
+        write = writer_for(args.format, out, BANK_COLUMNS)
+        for guild_id, accounts in servers.items():
+            rows = [(guild_id, user_id, account.get('name'), account.get('balance', 0), account.get('created_at'))
+                    for user_id, account in accounts.items()]
+            write(rows)
+            progress.update(len(rows))
+    progress.finish()
+
+
+def vacuum(args):
+    conn = sqlite3.connect(args.db)
+    started = time.monotonic()
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+    conn.execute("VACUUM;")
+    mode = conn.execute("PRAGMA auto_vacuum;").fetchone()[0]
+    conn.close()
+    print(f"vacuum: done in {time.monotonic() - started:.1f}s, auto_vacuum={mode}", file=sys.stderr)
+
+
+def guess_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import/export for PostBank data.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    for name in ('export', 'import'):
+        p = sub.add_parser(name, help=f"{name} one table of a PostBank database")
+        p.add_argument('db', help="path to the PostBank SQLite database")
+        p.add_argument('path', help="JSONL or CSV file")
+        p.add_argument('--table', choices=sorted(TABLES), default='postbank')
+        p.add_argument('--format', choices=('jsonl', 'csv'), help="defaults to the file extension")
+        p.add_argument('--chunk', type=int, default=50000, help="rows per read/transaction")
+    sub.choices['export'].add_argument('--after', type=int, default=0, help="resume after this rowid")
+    sub.choices['import'].add_argument('--skip', type=int, default=0, help="resume after this many input rows")
+
+    p = sub.add_parser('v2bank', help="convert a Red v2 bank.json into a balance file for $importBalances")
+    p.add_argument('bank', help="path to the v2 data/economy/bank.json")
+    p.add_argument('path', help="JSONL or CSV file to write")
+    p.add_argument('--format', choices=('jsonl', 'csv'), help="defaults to the file extension")
+
+    p = sub.add_parser('vacuum', help="switch a database to incremental auto_vacuum (bot stopped)")
+    p.add_argument('db', help="path to the PostBank SQLite database")
+
+    args = parser.parse_args(argv)
+    if getattr(args, 'format', '') is None:
+        args.format = guess_format(args.path)
+
+    {'export': export_table, 'import': import_table, 'v2bank': convert_v2_bank,
+     'vacuum': vacuum}[args.command](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+from .metrics import Registry, Histogram, format_summary
+
+# One registry per process, so every cog reports into the same place.
+registry = Registry()
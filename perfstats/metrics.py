@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import bisect
+import functools
+import os
+import random
+import threading
+import time
+
+# Histogram bucket upper bounds in seconds, from 100us to 10s.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    """Fixed-bucket latency histogram. Observing is a bisect and a few integer adds."""
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # The last bucket is +Inf.
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Estimates a quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return self.max
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+    __slots__ = ('registry', 'name', 'started')
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class Registry(object):
+    """Named histograms and counters, shared by every cog in the process.
+
+    `sample_rate` is the fraction of timers that are actually recorded; at 0 a timer is a single comparison."""
+
+    def __init__(self, sample_rate=1.0):
+        self.sample_rate = sample_rate
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()  # SQL timings are observed from the database worker threads.
+        self._lag_task = None
+        self._dump_task = None
+
+    def sampled(self):
+        rate = self.sample_rate
+        return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+    def timer(self, name):
+        """Context manager that records how long its block took under `name`, subject to sampling."""
+        if not self.sampled():
+            return NULL_TIMER
+        return _Timer(self, name)
+
+    def timed(self, name):
+        """Decorator form of timer() for coroutine functions."""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    # Event loop lag
+
+    async def _watch_loop_lag(self, interval):
+        loop = asyncio.get_event_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            if self.sample_rate > 0.0:
+                self.observe('loop.lag', max(loop.time() - expected, 0.0))
+
+    def start_lag_monitor(self, interval=0.5):
+        """Samples event loop lag every `interval` seconds. Only one monitor runs per process."""
+        if self._lag_task is None or self._lag_task.done():
+            self._lag_task = asyncio.ensure_future(self._watch_loop_lag(interval))
+
+    def stop_lag_monitor(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+
+    # Reporting
+
+    def summary(self):
+        """Returns (name, count, p50, p99, max) for every histogram, sorted by name."""
+        with self._lock:
+            return [(name, h.count, h.quantile(0.5), h.quantile(0.99), h.max)
+                    for name, h in sorted(self.histograms.items())]
+
+    def prometheus_text(self, prefix='redbot'):
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, h in sorted(self.histograms.items()):
+                metric = f"{prefix}_{_metric_name(name)}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, n in zip(BUCKETS, h.counts):
+                    cumulative += n
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {h.count}')
+                lines.append(f"{metric}_sum {h.total}")
+                lines.append(f"{metric}_count {h.count}")
+            for name, value in sorted(self.counters.items()):
+                metric = f"{prefix}_{_metric_name(name)}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """Writes prometheus_text() to `path` atomically, e.g. for node_exporter's textfile collector."""
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+    async def _dump_forever(self, path, interval):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(interval)
+            await loop.run_in_executor(None, self.dump, path)
+
+    def start_dumping(self, path, interval=15.0):
+        """Rewrites the Prometheus file every `interval` seconds until stop_dumping()."""
+        self.stop_dumping()
+        self._dump_task = asyncio.ensure_future(self._dump_forever(path, interval))
+
+    def stop_dumping(self):
+        if self._dump_task is not None:
+            self._dump_task.cancel()
+            self._dump_task = None
+
+
+def _metric_name(name):
+    return ''.join(c if c.isalnum() else '_' for c in name)
+
+
+def format_summary(rows):
+    """Formats Registry.summary() as a fixed-width table for a code block."""
+    lines = [f"{'metric':<32}{'count':>8}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}"]
+    for name, count, p50, p99, peak in rows:
+        lines.append(f"{name[:32]:<32}{count:>8}{p50 * 1000:>9.2f}{p99 * 1000:>9.2f}{peak * 1000:>9.2f}")
+    return "\n".join(lines)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""The Red side of perfstats, shared by every cog that reports into the registry: the saved sample rate and
+Prometheus path, the lag monitor and file dump they control, the owner-only $perfstats command, and command timing.
+
+The rest of perfstats only needs the standard library; this module needs Red, so only the cogs import it."""
+import os
+import time
+from redbot.core import Config, checks, commands
+from redbot.core.utils.chat_formatting import box, pagify
+from . import registry as perf
+from .metrics import format_summary
+
+_cogs = set()  # Loaded cogs using perfstats. Monitoring and $perfstats stay up while there's at least one.
+_config = None
+
+
+def get_config():
+    global _config
+    if _config is None:
+        _config = Config.get_conf(None, identifier=6174203782, force_registration=True, cog_name="PerfStats")
+        _config.register_global(sample_rate=1.0, prometheus_path=None)
+    return _config
+
+
+async def attach_cog(bot, name):
+    """Called as a cog loads. The first one applies the saved settings and adds $perfstats to the bot."""
+    first = not _cogs
+    _cogs.add(name)
+    if not first:
+        return
+    if bot.get_command("perfstats") is None:
+        bot.add_command(perfstats)
+    config = get_config()
+    perf.sample_rate = await config.sample_rate()
+    if perf.sample_rate > 0:
+        perf.start_lag_monitor()
+    prometheus_path = await config.prometheus_path()
+    if prometheus_path:
+        perf.start_dumping(prometheus_path)
+
+
+def detach_cog(bot, name):
+    """Called as a cog unloads. The last one stops the monitoring and removes $perfstats."""
+    _cogs.discard(name)
+    if not _cogs:
+        perf.stop_lag_monitor()
+        perf.stop_dumping()
+        bot.remove_command("perfstats")
+
+
+def before_invoke(ctx):
+    """Call from a cog's cog_before_invoke. Starts timing the command, and times every reply it sends through
+    ctx.send."""
+    ctx.send = perf.timed("discord.send_message")(ctx.send)
+    if perf.sampled():
+        ctx.perf_started = time.perf_counter()
+
+
+def after_invoke(ctx):
+    """Call from a cog's cog_after_invoke. Records the command's time, and counts it if it failed."""
+    started = getattr(ctx, "perf_started", None)
+    if started is not None:
+        perf.observe(f"command.{ctx.command.qualified_name}", time.perf_counter() - started)
+    if ctx.command_failed:
+        perf.incr(f"command.{ctx.command.qualified_name}.errors")
+
+
+@commands.command()
+@checks.is_owner()
+async def perfstats(ctx, action=None, value=None):
+    """Shows command, SQL and Discord API timings for every cog.
+    $perfstats [reset | sample <0-1> | prom <path|off>]"""
+    config = get_config()
+    if action == "reset":
+        perf.reset()
+        await ctx.send("OK! Cleared the performance stats.")
+    elif action == "sample":
+        try:
+            rate = min(max(float(value), 0.0), 1.0)
+        except (TypeError, ValueError) as err:
+            await ctx.send("The sample rate must be a number from 0 to 1.")
+            return
+        perf.sample_rate = rate
+        await config.sample_rate.set(rate)
+        if rate > 0:
+            perf.start_lag_monitor()
+        else:
+            perf.stop_lag_monitor()
+        await ctx.send(f"OK! Sampling {rate:.0%} of timings.")
+    elif action == "prom":
+        if not value or value == "off":
+            perf.stop_dumping()
+            await config.prometheus_path.set(None)
+            await ctx.send("OK! Stopped writing the Prometheus file.")
+        else:
+            path = os.path.expanduser(value)
+            perf.start_dumping(path)
+            await config.prometheus_path.set(path)
+            await ctx.send(f"OK! Writing Prometheus metrics to `{path}`.")
+    else:
+        rows = perf.summary()
+        if not rows:
+            await ctx.send("No timings recorded yet.")
+            return
+        counters = "\n".join(f"{name}: {n}" for name, n in sorted(perf.counters.items()))
+        for page in pagify(format_summary(rows) + ("\n\n" + counters if counters else ""), page_length=1900):
+            await ctx.send(box(page))
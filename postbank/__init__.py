@@ -1,5 +1,4 @@
-from .postbank import PostBank
-
-
-def setup(bot):
-    bot.add_cog(PostBank(bot))
\ No newline at end of file
+async def setup(bot):
+    # Imported here so links and storage load without Red, e.g. for migrate_bank.py.
+    from .postbank import PostBank
+    await bot.add_cog(PostBank(bot))
\ No newline at end of file
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import csv
+import itertools
+import json
+
+# One row per bank account, as `migrate_bank.py v2bank` writes them and $exportBalances / $importBalances move them
+# out of and into Red's bank.
+BANK_COLUMNS = ('guild_id', 'user_id', 'name', 'balance', 'created_at')
+
+
+def balance_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def read_balances(f, fmt):
+    """Yields one dict per account in a balance file, keyed by BANK_COLUMNS."""
+    if fmt == 'csv':
+        for record in csv.DictReader(f):
+            yield {column: record.get(column) for column in BANK_COLUMNS}
+    else:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield {column: record.get(column) for column in BANK_COLUMNS}
+
+
+def balance_writer(f, fmt, header=True):
+    """Returns a function that writes a list of BANK_COLUMNS-ordered tuples to a balance file."""
+    if fmt == 'csv':
+        writer = csv.writer(f)
+        if header:
+            writer.writerow(BANK_COLUMNS)
+        return writer.writerows
+
+    def write_jsonl(rows):
+        f.writelines(json.dumps(dict(zip(BANK_COLUMNS, row))) + '\n' for row in rows)
+    return write_jsonl
+
+
+def take(records, n):
+    """The next n records, as a list. The commands call this on a worker thread so file reads stay off the loop."""
+    return list(itertools.islice(records, n))
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+# Query parameters that only track where a link was shared from. They never change what the link points at.
+TRACKING_PARAMS = frozenset(['si', 'feature', 'fbclid', 'gclid', 'igshid', 'ref', 'ref_src', 'in', 'app'])
+
+# Mobile and vanity host prefixes that serve the same content as the bare domain.
+HOST_PREFIXES = ('www.', 'm.', 'mobile.', 'music.')
+
+# Hosts whose query string never identifies the content, so all of it is dropped.
+QUERYLESS_HOSTS = frozenset(['soundcloud.com', 'bandcamp.com'])
+
+# YouTube parameters that only say where in a video or playlist to start. Everything else (list, search_query, ...)
+# identifies what a link without a video ID points at.
+YOUTUBE_POSITION_PARAMS = frozenset(['t', 'start', 'index', 'pp', 'ab_channel'])
+
+
+def canonical_link(url):
+    """Normalizes a URL so trivially different links to the same track compare equal.
+
+    The scheme, mobile subdomains, default ports, fragments, trailing slashes and tracking parameters are dropped,
+    and youtu.be short links are expanded. The result is only used as a duplicate-detection key, never shown."""
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        # Unparseable, e.g. a stray '[' in the host, so the link as written is its own key.
+        return url.strip()
+    host = (parts.hostname or '').lower()
+    try:
+        port = parts.port
+    except ValueError:
+        # Not a valid port, so keep the host exactly as written rather than guess what it meant.
+        host, port = parts.netloc.rpartition('@')[2].lower(), None
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    if port is not None and port not in (80, 443):
+        host = f"{host}:{port}"
+
+    path = parts.path.rstrip('/')
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k.lower() not in TRACKING_PARAMS and not k.lower().startswith('utm_')]
+
+    if host == 'youtu.be':
+        host, query, path = 'youtube.com', [('v', path.lstrip('/'))], '/watch'
+    elif host == 'youtube.com':
+        if any(k == 'v' for k, v in query):
+            # Only the video ID matters; timestamps and playlist context are still the same track.
+            query = [(k, v) for k, v in query if k == 'v']
+        else:
+            query = [(k, v) for k, v in query if k not in YOUTUBE_POSITION_PARAMS]
+    elif host in QUERYLESS_HOSTS or host.endswith('.bandcamp.com'):
+        query = []
+
+    canonical = host + path
+    if query:
+        canonical += '?' + urlencode(sorted(query))
+    return canonical
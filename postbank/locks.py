@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import weakref
+
+
+class KeyedLocks(object):
+    """Hands out one asyncio.Lock per key, e.g. per user ID.
+
+    Locks are held weakly, so a key only costs memory while something is holding or waiting on its lock."""
+
+    def __init__(self):
+        self._locks = weakref.WeakValueDictionary()
+
+    def __call__(self, key):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    def __len__(self):
+        return len(self._locks)
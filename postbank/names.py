@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import collections
+import time
+
+LEFT_SERVER = u'\U00002620' + "LEFT THE SERVER"
+
+
+class MemberNameCache(object):
+    """LRU cache of member display names keyed by (guild ID, user ID), with entries expiring after `ttl` seconds.
+
+    Listing commands resolve a whole page of user IDs at once, so a repeated $recent costs one dict lookup per row."""
+
+    def __init__(self, maxsize=2048, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._names = collections.OrderedDict()  # (guild_id, user_id) -> (display name, expiry time)
+
+    def resolve_many(self, guild, user_ids):
+        """Returns {user_id: display name} for every ID, looking up only the ones not already cached."""
+        now = time.monotonic()
+        resolved = {}
+        for user_id in user_ids:
+            if user_id in resolved:
+                continue
+            key = (guild.id, str(user_id))
+            cached = self._names.get(key)
+            if cached is not None and cached[1] > now:
+                self._names.move_to_end(key)
+                resolved[user_id] = cached[0]
+                continue
+
+            member = guild.get_member(int(user_id))
+            name = member.display_name if member is not None else LEFT_SERVER
+            self._names[key] = (name, now + self.ttl)
+            self._names.move_to_end(key)
+            resolved[user_id] = name
+
+        while len(self._names) > self.maxsize:
+            self._names.popitem(last=False)
+        return resolved
+
+    def invalidate(self, guild_id, user_id):
+        self._names.pop((guild_id, str(user_id)), None)
+
+    def clear(self):
+        self._names.clear()
@@ -1,53 +1,19 @@
 # -*- coding: utf-8 -*-
+import logging
 import re
 import os
-from redbot.core import commands, bank, checks
-import sqlite3
+import time
+import asyncio
+from redbot.core import commands, bank, checks, Config
+from redbot.core.utils.chat_formatting import escape
+from perfstats import registry as perf
+from perfstats.red import after_invoke, attach_cog, before_invoke, detach_cog
+from .balances import balance_format, balance_writer, read_balances, take
+from .storage import PostBankDB, LEADERBOARDS
+from .locks import KeyedLocks
+from .names import MemberNameCache
 
-
-class InitDb(object):
-
-    def __init__(self, db_file):
-
-        try:
-            postban_dir = os.path.expanduser('~/.postbank')
-            os.mkdir(postban_dir)
-        except FileExistsError:
-            # Do nothing if the directory exists.
-            pass
-
-        sql_setup = """CREATE TABLE
-IF NOT EXISTS postbank (
-  feedbackid INTEGER PRIMARY KEY AUTOINCREMENT,
-  userid TEXT NOT NULL,
-  link TEXT NOT NULL,
-  numreviews INTEGER,
-  reviewers TEXT NOT NULL
-);"""
-        conn = self.conn_db(db_file)
-        if conn is not None:
-            self.create_table(conn, sql_setup)
-            conn.commit()
-            conn.close()
-        else:
-            print(f"Could not connect to database at {db_file}")
-
-    def conn_db(self, db_file):
-        # Connect to a database
-        try:
-            conn = sqlite3.connect(db_file)
-            return conn
-        except Exception as e:
-            print(e)
-
-    def create_table(self, conn, create_table_sql):
-        # Create the tables IF NOT EXIST.
-        try:
-            c = conn.cursor()
-            c.executescript(create_table_sql)
-
-        except Exception as e:
-            print(e)
+log = logging.getLogger("red.postbank")
 
 
 class PostBank(commands.Cog):
@@ -56,10 +22,109 @@ class PostBank(commands.Cog):
 
         self.bot = bot
         self.feedback_ids = [{'id': 0, 'user': None}]
-        self.db_path = os.path.expanduser('~/.postbank/postbank.db')  # location of the postbank database file.
-        self.db = InitDb(self.db_path)  # create the DB if it doesn't exist.
-        self.min_length = 140  # Minimum number of characters to be awarded for feedback.
-        self.guild = self.bot.guilds[0]
+        self.db_dir = os.path.expanduser('~/.postbank')  # location of the per-server postbank database files.
+        self.legacy_db_path = os.path.join(self.db_dir, 'postbank.db')  # the single database used before sharding.
+        self.dbs = {}  # guild id -> PostBankDB, so a busy server's write lock never blocks another server.
+        self.page_size = 10  # Number of posts shown per page by $recent and $need.
+        self.review_page_size = 5  # Number of reviews shown per page by $reviews and $searchfeedback.
+        self.config = Config.get_conf(self, identifier=6174203781, force_registration=True)
+        self.config.register_guild(
+            min_length=140,  # Minimum number of characters to be awarded for feedback.
+            archive_after_days=90,  # Posts older than this leave the hot table. 0 disables archiving by age.
+            archive_after_reviews=0,  # Posts with this many reviews are archived early. 0 disables it.
+        )
+        self.maintenance_interval = 3600  # Seconds between archive/compaction runs.
+        self.maintenance_task = None
+        self.settings = {}  # guild id -> cached guild settings, so commands don't hit Config every time.
+        self.user_locks = KeyedLocks()  # Serializes each user's balance-changing commands.
+        self.member_names = MemberNameCache()  # Display names for $recent and $need.
+
+    async def cog_load(self):
+        # Awaited by add_cog, so a failure here stops the load instead of vanishing in a stray task.
+        await attach_cog(self.bot, "PostBank")
+        self.maintenance_task = asyncio.ensure_future(self.maintenance_loop())
+
+    async def maintenance_loop(self):
+        """Periodically archives old posts and compacts every server's database, all on the database threads."""
+        while True:
+            await asyncio.sleep(self.maintenance_interval)
+            for guild_id in self.guilds_with_db():
+                guild = self.bot.get_guild(guild_id)
+                if guild is None:
+                    continue  # The bot has left this server; its database is kept as it is.
+                try:
+                    await self.maintain(guild)
+                except Exception:
+                    log.exception("Error maintaining PostBank for %s", guild.id)
+                    perf.incr("postbank.maintenance_errors")
+
+    def guilds_with_db(self):
+        """IDs of the servers that have a PostBank database, open or not. Servers that never used PostBank have none,
+        and maintenance doesn't create one."""
+        guild_ids = set(self.dbs)
+        if os.path.isdir(self.db_dir):
+            for name in os.listdir(self.db_dir):
+                match = re.fullmatch(r"postbank-(\d+)\.db", name)
+                if match:
+                    guild_ids.add(int(match.group(1)))
+        return sorted(guild_ids)
+
+    async def maintain(self, guild):
+        settings = await self.get_settings(guild)
+        days = settings["archive_after_days"]
+        reviews = settings["archive_after_reviews"]
+        db = self.get_db(guild)
+        with perf.timer("postbank.maintenance"):
+            if days > 0 or reviews > 0:
+                cutoff = time.time() - days * 86400 if days > 0 else 0
+                await db.archive(int(cutoff), reviews)
+            await db.compact()
+
+    def cog_unload(self):
+        for db in self.dbs.values():
+            db.close()
+        detach_cog(self.bot, "PostBank")
+        if self.maintenance_task is not None:
+            self.maintenance_task.cancel()
+
+    async def cog_before_invoke(self, ctx):
+        before_invoke(ctx)
+
+    async def cog_after_invoke(self, ctx):
+        after_invoke(ctx)
+
+    async def cog_check(self, ctx):
+        # Every PostBank command works on a server's own posts and bank.
+        return ctx.guild is not None
+
+    def get_db(self, guild):
+        """Returns the guild's database, opening it on first use."""
+        db = self.dbs.get(guild.id)
+        if db is None:
+            db = PostBankDB(os.path.join(self.db_dir, f"postbank-{guild.id}.db"))
+            self.dbs[guild.id] = db
+        return db
+
+    async def get_settings(self, guild):
+        settings = self.settings.get(guild.id)
+        if settings is None:
+            settings = await self.config.guild(guild).all()
+            self.settings[guild.id] = settings
+        return settings
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if before.display_name != after.display_name:
+            self.member_names.invalidate(after.guild.id, after.id)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        self.member_names.invalidate(member.guild.id, member.id)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        # A returning member may be cached as having left.
+        self.member_names.invalidate(member.guild.id, member.id)
 
     @commands.command(pass_context=True, no_pm=True)
     @checks.is_owner()
@@ -69,7 +134,7 @@ class PostBank(commands.Cog):
         val = msg.split(' ')
         try:
             int_val = int(val[1])
-            await bank.set_default_balance(int_val, self.guild)
+            await bank.set_default_balance(int_val, ctx.guild)
             await ctx.send(f"OK! Set the default bank balance to {str(int_val)}")
         except (ValueError, IndexError) as err:
             await ctx.send("Invalid default balance. It must be an integer.")
@@ -81,7 +146,7 @@ class PostBank(commands.Cog):
         msg_full = ctx.message.content
         msg = msg_full.split(' ')
         try:
-            await bank.set_currency_name(msg[1], self.guild)
+            await bank.set_currency_name(msg[1], ctx.guild)
             await ctx.send(f"OK! Set the currency name to {str(msg[1])}.")
         except IndexError as err:
             await ctx.send("Invalid bank name. Please supply a bank name.")
@@ -93,11 +158,123 @@ class PostBank(commands.Cog):
         msg_full = ctx.message.content
         msg = msg_full.split(' ')
         try:
-            await bank.set_bank_name(msg[1], self.guild)
+            await bank.set_bank_name(msg[1], ctx.guild)
             await ctx.send(f"OK! Set the bank name to {str(msg[1])}.")
         except IndexError as err:
             await ctx.send("Invalid bank name. Please supply a bank name.")
 
+    @commands.command(pass_context=True, no_pm=True)
+    @checks.is_owner()
+    async def feedbackLength(self, ctx):
+        """Sets the minimum feedback length for the server."""
+        msg = ctx.message.content
+        val = msg.split(' ')
+        try:
+            int_val = int(val[1])
+        except (ValueError, IndexError) as err:
+            await ctx.send("Invalid feedback length. It must be an integer.")
+            return
+        await self.config.guild(ctx.guild).min_length.set(int_val)
+        self.settings.pop(ctx.guild.id, None)
+        await ctx.send(f"OK! Feedback must now be at least {str(int_val)} characters.")
+
+    @commands.command(pass_context=True, no_pm=True)
+    @checks.is_owner()
+    async def archiveAfter(self, ctx):
+        """Sets when posts are archived. $archiveAfter <days> [reviews] (0 disables either rule)"""
+        val = ctx.message.content.split(' ')
+        try:
+            days = int(val[1])
+            reviews = int(val[2]) if len(val) > 2 else 0
+        except (ValueError, IndexError) as err:
+            await ctx.send("Usage: `{}archiveAfter <days> [reviews]`".format(ctx.prefix))
+            return
+        await self.config.guild(ctx.guild).archive_after_days.set(days)
+        await self.config.guild(ctx.guild).archive_after_reviews.set(reviews)
+        self.settings.pop(ctx.guild.id, None)
+        await ctx.send(f"OK! Posts will be archived after {days} days or {reviews} reviews (0 = never).")
+
+    @commands.command(pass_context=True, no_pm=True)
+    @checks.is_owner()
+    async def claimLegacyBank(self, ctx):
+        """Moves the single pre-multi-server postbank.db over to this server."""
+        if not os.path.exists(self.legacy_db_path):
+            await ctx.send("There is no legacy PostBank database to claim.")
+            return
+        db_path = os.path.join(self.db_dir, f"postbank-{ctx.guild.id}.db")
+        if ctx.guild.id in self.dbs or os.path.exists(db_path):
+            await ctx.send("This server already has its own PostBank database.")
+            return
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.legacy_db_path + suffix):
+                os.rename(self.legacy_db_path + suffix, db_path + suffix)
+        await ctx.send("OK! The legacy PostBank posts now belong to this server.")
+
+    @commands.command(pass_context=True, no_pm=True)
+    @checks.is_owner()
+    async def importBalances(self, ctx):
+        """Sets this server's balances from a balance file. $importBalances <path to .csv or .jsonl>
+        Reads what `migrate_bank.py v2bank` or $exportBalances wrote; rows for other servers are skipped."""
+        val = ctx.message.content.split(' ', 1)
+        path = os.path.expanduser(val[1].strip()) if len(val) > 1 else ''
+        if not os.path.isfile(path):
+            await ctx.send("Usage: `{}importBalances <path to a .csv or .jsonl balance file>`".format(ctx.prefix))
+            return
+        loop = asyncio.get_event_loop()
+        guild_id = str(ctx.guild.id)
+        loaded = skipped = invalid = 0
+        with open(path, newline='', encoding='utf-8') as f:
+            records = read_balances(f, balance_format(path))
+            while True:
+                # The file is read a chunk at a time on a worker thread, so a big one never blocks the loop.
+                chunk = await loop.run_in_executor(None, take, records, 1000)
+                if not chunk:
+                    break
+                for record in chunk:
+                    try:
+                        member = ctx.guild.get_member(int(record['user_id']))
+                        balance = int(record['balance'])
+                    except (TypeError, ValueError) as err:
+                        invalid += 1
+                        continue
+                    if str(record['guild_id']) != guild_id or member is None:
+                        skipped += 1
+                        continue
+                    try:
+                        async with self.user_locks(member.id):
+                            await bank.set_balance(member, balance)
+                    except (ValueError, OverflowError) as err:
+                        invalid += 1  # Negative, or over the bank's maximum balance.
+                        continue
+                    loaded += 1
+        await ctx.send(f"OK! Set {loaded} balances. Skipped {skipped} rows for other servers or members who have "
+                       f"left, and {invalid} invalid rows.")
+
+    @commands.command(pass_context=True, no_pm=True)
+    @checks.is_owner()
+    async def exportBalances(self, ctx):
+        """Writes every member's balance to a balance file. $exportBalances <path to .csv or .jsonl>
+        $importBalances loads it back."""
+        val = ctx.message.content.split(' ', 1)
+        path = os.path.expanduser(val[1].strip()) if len(val) > 1 else ''
+        if not path:
+            await ctx.send("Usage: `{}exportBalances <path to a .csv or .jsonl balance file>`".format(ctx.prefix))
+            return
+        loop = asyncio.get_event_loop()
+        guild_id = str(ctx.guild.id)
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            write = balance_writer(f, balance_format(path))
+            rows = []
+            for member in ctx.guild.members:
+                account = await bank.get_account(member)
+                rows.append((guild_id, str(member.id), account.name, account.balance,
+                             int(account.created_at.timestamp())))
+                if len(rows) >= 1000:
+                    await loop.run_in_executor(None, write, rows)
+                    rows = []
+            await loop.run_in_executor(None, write, rows)
+        await ctx.send(f"OK! Wrote {len(ctx.guild.members)} balances to `{path}`.")
+
     @commands.command(pass_context=True, no_pm=True)
     async def balance(self, ctx):
         """Gets the credit balance of the user who authors the $balance command, and returns it to the chat."""
@@ -111,64 +288,169 @@ class PostBank(commands.Cog):
         """Allows you to edit your posted link. $edit <id> <link>"""
         user = ctx.message.author
         content = ctx.message.content.split(" ")
-        conn = sqlite3.connect(self.db_path)
-        curr = conn.cursor()
-
         feedbackid = content[1] # get only the feedback ID.
         msg = content[1:]  # Get only the message content and ignore the command parameter
         joined_str = (' '.join(str(x) for x in msg))  # mash this into 1 string
         link = re.search("(?P<url>https?://[^\s]+)", joined_str).group("url")  # Grab only the URL.
+        db = self.get_db(ctx.guild)
+        owner = None
         try:
-            rows = curr.execute('SELECT userid FROM postbank WHERE feedbackid = ?;', (feedbackid,))
-            row = rows.fetchone()
+            owner = await db.get_owner(feedbackid)
 
-        except Exception as e:
-            print("Error in SQL: {}".format(e))
+        except Exception:
+            log.exception("Error looking up the owner of post %s", feedbackid)
+            perf.incr("postbank.sql_errors")
 
-        if user.id == row[0]:
+        if str(user.id) == owner:
             try:
-                curr.execute('UPDATE postbank SET link=? WHERE feedbackid=?;', (link, feedbackid))
-                conn.commit()
-            except Exception as e:
-                print("Error: {}".format(e))
-            await ctx.send("<@{}>: Your link for Posting ID [{}] has been updated".format(user.id, feedbackid))
+                updated = await db.update_link(feedbackid, link)
+            except Exception:
+                log.exception("Error updating the link of post %s", feedbackid)
+                perf.incr("postbank.sql_errors")
+                return
+            if updated:
+                await ctx.send("<@{}>: Your link for Posting ID [{}] has been updated".format(user.id, feedbackid))
+            else:
+                await ctx.send("<@{}> That link was already submitted.".format(user.id))
 
         else:
             await ctx.send("<@{}>: You cannot edit an ID that isn't yours.".format(user.id))
 
-        conn.close()
+    @staticmethod
+    def parse_cursor(content):
+        """Returns the feedback ID from a `before:<id>` page cursor in the command text, or None."""
+        match = re.search(r"before:(\d+)", content)
+        if match is None:
+            return None
+        return int(match.group(1))
 
-    @commands.command(pass_context=True, no_pm=True)
-    async def recent(self, ctx):
-        """Displays the last 10 posts and whether or not they have any feedback."""
+    async def send_listing(self, ctx, rows, command):
+        """Renders one page of (feedbackid, userid, link, numreviews) rows, newest first."""
         recents = []
         checkmarkEmoji = u'\U00002705'
         circleEmoji = u'\U00002B55'
-        rip = u'\U00002620'
-        conn = sqlite3.connect(self.db_path)
-        curr = conn.cursor()
-
-        rows = curr.execute('SELECT * FROM postbank LIMIT 10 OFFSET (SELECT COUNT(*) FROM postbank)-10;')
-        for row in rows:
-
-            feedbackid = row[0]
-            userid = row[1]
-            try:
-                username = ctx.message.server.get_member(userid).name
-            except AttributeError as e:
-                # If the user left the server, get_member will throw an attribute error on getting .name
-                username = rip+"LEFT THE SERVER"
-            link = row[2]
+        # Resolve every poster on the page in one pass through the name cache.
+        usernames = self.member_names.resolve_many(ctx.guild, [row[1] for row in rows])
+        for feedbackid, userid, link, numreviews in rows:
 
-            if row[3] > 0:
+            if numreviews > 0:
                 emoji = checkmarkEmoji
             else:
                 emoji = circleEmoji
-            feedback = "{} -- `{}` -- {} -- <{}>".format(emoji, feedbackid, username, link)
+            feedback = "{} -- `{}` -- {} -- <{}>".format(emoji, feedbackid, usernames[userid], link)
             recents.append(feedback)
 
+        if not recents:
+            await ctx.send("Nothing to show here.")
+            return
+
+        if len(rows) == self.page_size:
+            # Point at the next page. The cursor is the oldest ID shown, so paging never needs a count or offset.
+            recents.append("Older posts: `{}{} before:{}`".format(ctx.prefix, command, rows[-1][0]))
+
         await ctx.send("\n".join(recents))
 
+    @commands.command(pass_context=True, no_pm=True)
+    async def recent(self, ctx):
+        """Displays the last 10 posts and whether or not they have any feedback. $recent [before:<id>]"""
+        before = self.parse_cursor(ctx.message.content)
+        rows = await self.get_db(ctx.guild).recent(self.page_size, before)
+        await self.send_listing(ctx, rows, "recent")
+
+    @staticmethod
+    def parse_page(content):
+        """Returns the zero-based page from a `page:<n>` argument in the command text."""
+        match = re.search(r"page:(\d+)", content)
+        if match is None:
+            return 0
+        return max(int(match.group(1)) - 1, 0)
+
+    @commands.command(pass_context=True, no_pm=True)
+    async def reviews(self, ctx):
+        """Shows the feedback left on a post. $reviews <id> [page:<n>]"""
+        content = ctx.message.content.split(" ")
+        try:
+            feedback_id = int(content[1])
+        except (ValueError, IndexError) as err:
+            await ctx.send("Usage: `{}reviews <id> [page:<n>]`".format(ctx.prefix))
+            return
+
+        page = self.parse_page(ctx.message.content)
+        rows = await self.get_db(ctx.guild).get_reviews(feedback_id, self.review_page_size,
+                                                        page * self.review_page_size)
+        if not rows:
+            await ctx.send("No feedback to show for `{}`.".format(feedback_id))
+            return
+
+        usernames = self.member_names.resolve_many(ctx.guild, [row[0] for row in rows])
+        reviews = ["**Feedback for `{}`** (page {})".format(feedback_id, page + 1)]
+        for reviewer_id, created_at, text in rows:
+            text = text or "*(feedback text was not kept for this review)*"
+            reviews.append("**{}**: {}".format(usernames[reviewer_id], escape(text[:300], mass_mentions=True)))
+
+        await ctx.send("\n".join(reviews))
+
+    @commands.command(pass_context=True, no_pm=True)
+    async def searchfeedback(self, ctx, *terms):
+        """Searches past feedback. $searchfeedback <terms> [page:<n>]"""
+        terms = [term for term in terms if not term.startswith("page:")]
+        if not terms:
+            await ctx.send("Usage: `{}searchfeedback <terms> [page:<n>]`".format(ctx.prefix))
+            return
+
+        page = self.parse_page(ctx.message.content)
+        rows = await self.get_db(ctx.guild).search_reviews(terms, self.review_page_size,
+                                                           page * self.review_page_size)
+        if not rows:
+            await ctx.send("No feedback matched your search.")
+            return
+
+        usernames = self.member_names.resolve_many(ctx.guild, [row[1] for row in rows])
+        results = []
+        for feedback_id, reviewer_id, snippet in rows:
+            results.append("`{}` -- **{}**: {}".format(feedback_id, usernames[reviewer_id],
+                                                       escape(snippet, mass_mentions=True)))
+
+        await ctx.send("\n".join(results))
+
+    @commands.command(pass_context=True, no_pm=True)
+    async def leaderboard(self, ctx, kind="given"):
+        """Shows the top feedback givers. $leaderboard [given|received|posts|starved]"""
+        kind = kind.lower()
+        if kind not in LEADERBOARDS:
+            await ctx.send("Usage: `{}leaderboard [{}]`".format(ctx.prefix, "|".join(LEADERBOARDS)))
+            return
+
+        rows = await self.get_db(ctx.guild).leaderboard(kind, self.page_size)
+        if not rows:
+            await ctx.send("Nothing to show here.")
+            return
+
+        usernames = self.member_names.resolve_many(ctx.guild, [row[0] for row in rows])
+        board = ["**Leaderboard: {}**".format(kind)]
+        for rank, (userid, value) in enumerate(rows, start=1):
+            board.append("{}. {} -- {}".format(rank, usernames[userid], value))
+
+        await ctx.send("\n".join(board))
+
+    @commands.command(pass_context=True, no_pm=True)
+    async def stats(self, ctx):
+        """Shows your PostBank stats, or another member's. $stats [@user]"""
+        mentions = ctx.message.mentions
+        member = mentions[0] if mentions else ctx.message.author
+        row = await self.get_db(ctx.guild).get_stats(member.id)
+        posts, given, received, credits = row if row is not None else (0, 0, 0, 0)
+
+        await ctx.send("**{}**: {} posts, {} feedback given, {} feedback received, {} credits earned.".format(
+            member.display_name, posts, given, received, credits))
+
+    @commands.command(pass_context=True, no_pm=True)
+    @checks.is_owner()
+    async def rebuildstats(self, ctx):
+        """Recomputes the leaderboard and stats from the posts and reviews."""
+        await self.get_db(ctx.guild).rebuild_stats()
+        await ctx.send("OK! Rebuilt the PostBank stats.")
+
     @commands.command(pass_context=True, no_pm=True)
     @checks.is_owner()
     async def godbal(self, ctx):
@@ -185,34 +467,10 @@ class PostBank(commands.Cog):
 
     @commands.command(pass_context=True, no_pm=True)
     async def need(self, ctx):
-        """Displays the last 10 posts that still need feedback"""
-        recents = []
-        checkmarkEmoji = u'\U00002705'
-        circleEmoji = u'\U00002B55'
-        rip = u'\U00002620'
-        conn = sqlite3.connect(self.db_path)
-        curr = conn.cursor()
-
-        rows = curr.execute('SELECT * FROM postbank WHERE numreviews = 0 LIMIT 10 OFFSET (SELECT COUNT(*) FROM postbank WHERE numreviews = 0)-10;')
-        for row in rows:
-
-            feedbackid = row[0]
-            userid = row[1]
-            try:
-                username = ctx.message.server.get_member(userid).name
-            except AttributeError as e:
-                # If the user left the server, get_member will throw an attribute error on getting .name
-                username = rip+"LEFT THE SERVER"
-            link = row[2]
-
-            if row[3] > 0:
-                emoji = checkmarkEmoji
-            else:
-                emoji = circleEmoji
-            feedback = "{} -- `{}` -- {} -- <{}>".format(emoji, feedbackid, username, link)
-            recents.append(feedback)
-
-        await ctx.send("\n".join(recents))
+        """Displays the last 10 posts that still need feedback. $need [before:<id>]"""
+        before = self.parse_cursor(ctx.message.content)
+        rows = await self.get_db(ctx.guild).need(self.page_size, before)
+        await self.send_listing(ctx, rows, "need")
 
     @commands.command(pass_context=True, no_pm=True)
     async def post(self, ctx):
@@ -225,35 +483,34 @@ class PostBank(commands.Cog):
         joined_str = (' '.join(str(x) for x in msg))  # mash this into 1 string
         link = re.search("(?P<url>https?://[^\s]+)", joined_str).group("url")  # Grab only the URL.)
 
-        canSpend = await bank.can_spend(member=user, amount=1)
-        bal = await bank.get_balance(user)
-
-        if canSpend is True:
-
-            conn = sqlite3.connect(self.db_path)
-            cur = conn.cursor()
+        # The balance check, the new row and the withdrawal happen together under the user's lock, so two
+        # concurrent posts can't both pass can_spend. If the withdrawal fails anyway, the row is rolled back.
+        db = self.get_db(ctx.guild)
+        async with self.user_locks(user.id):
+            canSpend = await bank.can_spend(member=user, amount=1)
+            bal = await bank.get_balance(user)
 
-            cur.execute('SELECT * FROM postbank WHERE link=?;', (link,))
+            if canSpend is True:
 
-            if cur.fetchone() is not None:
-                await ctx.send("<@{}> That link was already submitted.".format(user.id))
-                conn.close()
-                return
+                feedback_id = await db.add_post(user.id, link)
 
-            cur.execute('INSERT INTO postbank (userid, link, numreviews, reviewers) VALUES (?,?,0,?);', (user.id,
-                                                                                                         str(link),
-                                                                                                         '0,1'))
-            conn.commit()
+                if feedback_id is None:
+                    await ctx.send("<@{}> That link was already submitted.".format(user.id))
+                    return
 
-            cur.execute('SELECT feedbackid FROM postbank WHERE link=?', (link,))
-            rows = cur.fetchall()
-            feedback_id = rows[0][0]
+                try:
+                    await bank.withdraw_credits(member=user, amount=1)
+                except ValueError as err:
+                    # Balance changed outside this cog between the check and the withdrawal.
+                    await db.delete_post(feedback_id)
+                    canSpend = False
+                except Exception:
+                    await db.delete_post(feedback_id)
+                    raise
 
-            conn.close()
+        if canSpend is True:
             await ctx.send("{} submitted a track! Use `$feedback {} <feedback post here>` to give them some feedback!".format(user, feedback_id))
 
-            await bank.withdraw_credits(user=user, amount=1)
-
         else:
             await ctx.message.delete()
             await ctx.send("{}: Your post was removed because you don't have any credit. Give users `$feedback` to get credit.".format(user.name, bal))
@@ -275,74 +532,49 @@ class PostBank(commands.Cog):
             
         feedback_len = len(" ".join(feedback_text))
 
-        # First check if they are the one that submitted the link. If so, deny them the ability to review themselves.
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
-
-        cur.execute('SELECT userid FROM postbank WHERE feedbackid=?;', (feedback_id,))
-
-        rows = cur.fetchall()
-
         try:
-            if rows[0][0] == user.id:
-                await ctx.message.delete()
-                await ctx.send(ctx.message.channel, "<@{}>: You cannot review your own submissions.".format(user.id))
-                conn.close()
-                return
-        except IndexError as err:
-            await ctx.message.delete()
-            await ctx.send(f"<@{user.id}> Feedback needs an ID number and a message.")
+            feedback_id = int(feedback_id)
+        except ValueError as err:
+            await ctx.send("<@{}>: {} is not a valid feedback ID.".format(user.id, feedback_id))
             return
 
-        # Build a list to check against.
-        cur.execute('SELECT feedbackid FROM postbank')
-        rows = cur.fetchall()
-        feedback_id_list = []
-
-        for x in rows:
-            feedback_id_list.append(x[0])
-
-        # Then, check if the length meets the minimum requirements and that the ID is valid
-        if int(feedback_id) in feedback_id_list:
-
-            if feedback_len < self.min_length:
-
-                await ctx.send("<@{}>: Your feedback needs to be 140 characters or greater.".format(user.id))
-                conn.close()
-
-            else:
+        db = self.get_db(ctx.guild)
+        # One primary-key lookup validates the ID and fetches everything needed to record the review.
+        post = await db.get_post(feedback_id)
 
-                cur.execute('SELECT reviewers, numreviews, userid FROM postbank WHERE feedbackid=?;', (feedback_id,))
-                rows = cur.fetchall()
-
-                reviewers_db = rows[0][0]
-                numreviews = rows[0][1]
-                op = rows[0][2]
-
-                reviewers = reviewers_db.split(',')
-
-                if user.id not in reviewers:
-                    reviewers.append(user.id)
-                    reviewers = ','.join(map(str, reviewers))
-
-                    total_reviews = numreviews + 1
-                    cur.execute('UPDATE postbank SET numreviews=?,reviewers=? WHERE feedbackid=?;', (total_reviews,
-                                                                                                     reviewers,
-                                                                                                     feedback_id,))
-
-                    await ctx.send("<@{}>: You've got feedback!".format(op))
+        if post is None:
+            await ctx.send("<@{}>: {} is not a valid feedback ID.".format(user.id, feedback_id))
+            return
 
-                    bank.deposit_credits(user=user, amount=1)
+        op, numreviews = post
 
-                    conn.commit()
-                    conn.close()
+        # First check if they are the one that submitted the link. If so, deny them the ability to review themselves.
+        if op == str(user.id):
+            await ctx.message.delete()
+            await ctx.send("<@{}>: You cannot review your own submissions.".format(user.id))
+            return
 
-                else:
-                    await ctx.send("<@{}>: You already submitted a review for this ID.".format(user.id))
+        # Then, check if the length meets the minimum requirements.
+        min_length = (await self.get_settings(ctx.guild))["min_length"]
+        if feedback_len < min_length:
+            await ctx.send("<@{}>: Your feedback needs to be {} characters or greater.".format(user.id, min_length))
+            return
 
-        else:
+        # The review and the reviewer's credit are recorded together; if the deposit fails the review is undone.
+        async with self.user_locks(user.id):
+            added = await db.add_review(feedback_id, user.id, " ".join(feedback_text))
+            if added is None:
+                # Archived, or its post rolled back, since the lookup above.
+                await ctx.send("<@{}>: {} is not a valid feedback ID.".format(user.id, feedback_id))
+                return
+            if not added:
+                await ctx.send("<@{}>: You already submitted a review for this ID.".format(user.id))
+                return
 
-            await ctx.send("<@{}>: {} is not a valid feedback ID.".format(user.id, feedback_id))
-            conn.close()
+            try:
+                await bank.deposit_credits(member=user, amount=1)
+            except Exception:
+                await db.remove_review(feedback_id, user.id)
+                raise
 
-        conn.close()
+        await ctx.send("<@{}>: You've got feedback!".format(op))
@@ -3,6 +3,56 @@ IF NOT EXISTS postbank (
   feedbackid INTEGER PRIMARY KEY AUTOINCREMENT,
   userid TEXT NOT NULL,
   link TEXT NOT NULL,
-  numreviews INTEGER,
-  reviewers TEXT NOT NULL
-);
\ No newline at end of file
+  numreviews INTEGER NOT NULL DEFAULT 0,
+  link_canonical TEXT,
+  created_at INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS postbank_link_canonical ON postbank (link_canonical);
+CREATE INDEX IF NOT EXISTS postbank_created_at ON postbank (created_at);
+CREATE INDEX IF NOT EXISTS postbank_need ON postbank (feedbackid, userid, link, numreviews) WHERE numreviews = 0;
+
+CREATE TABLE
+IF NOT EXISTS postbank_archive (
+  feedbackid INTEGER PRIMARY KEY,
+  userid TEXT NOT NULL,
+  link TEXT NOT NULL,
+  numreviews INTEGER NOT NULL DEFAULT 0,
+  link_canonical TEXT,
+  created_at INTEGER,
+  archived_at INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS postbank_archive_link_canonical ON postbank_archive (link_canonical);
+
+CREATE TABLE
+IF NOT EXISTS reviews (
+  review_id INTEGER PRIMARY KEY,
+  feedbackid INTEGER NOT NULL REFERENCES postbank(feedbackid),
+  reviewer_id TEXT NOT NULL,
+  created_at INTEGER DEFAULT (strftime('%s', 'now')),
+  text TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS reviews_feedbackid_reviewer ON reviews (feedbackid, reviewer_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS reviews_fts USING fts5(text, content='reviews', content_rowid='review_id');
+CREATE TRIGGER IF NOT EXISTS reviews_fts_insert AFTER INSERT ON reviews WHEN new.text IS NOT NULL BEGIN
+  INSERT INTO reviews_fts (rowid, text) VALUES (new.review_id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS reviews_fts_delete AFTER DELETE ON reviews WHEN old.text IS NOT NULL BEGIN
+  INSERT INTO reviews_fts (reviews_fts, rowid, text) VALUES ('delete', old.review_id, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS reviews_fts_update AFTER UPDATE OF text ON reviews BEGIN
+  INSERT INTO reviews_fts (reviews_fts, rowid, text) SELECT 'delete', old.review_id, old.text WHERE old.text IS NOT NULL;
+  INSERT INTO reviews_fts (rowid, text) SELECT new.review_id, new.text WHERE new.text IS NOT NULL;
+END;
+
+CREATE TABLE
+IF NOT EXISTS user_stats (
+  userid TEXT PRIMARY KEY,
+  posts INTEGER NOT NULL DEFAULT 0,
+  reviews_given INTEGER NOT NULL DEFAULT 0,
+  reviews_received INTEGER NOT NULL DEFAULT 0,
+  credits_earned INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS user_stats_given ON user_stats (reviews_given);
+CREATE INDEX IF NOT EXISTS user_stats_received ON user_stats (reviews_received);
+CREATE INDEX IF NOT EXISTS user_stats_posts ON user_stats (posts);
@@ -0,0 +1,530 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from perfstats import registry as perf
+from .links import canonical_link
+
+log = logging.getLogger("red.postbank")
+BUSY_TIMEOUT_MS = 5000  # How long a statement waits on a locked database before giving up.
+NEWEST = 2 ** 63 - 1  # Page cursor that sorts after every feedback ID.
+
+# The original table. Newer databases are built from this by running every migration in order.
+SCHEMA = """CREATE TABLE
+IF NOT EXISTS postbank (
+  feedbackid INTEGER PRIMARY KEY AUTOINCREMENT,
+  userid TEXT NOT NULL,
+  link TEXT NOT NULL,
+  numreviews INTEGER,
+  reviewers TEXT NOT NULL
+);"""
+
+
+def _migrate_reviews_table(conn):
+    # Move the comma-joined `reviewers` column into a reviews table with one row per (post, reviewer).
+    conn.execute("""CREATE TABLE IF NOT EXISTS reviews (
+  feedbackid INTEGER NOT NULL REFERENCES postbank(feedbackid),
+  reviewer_id TEXT NOT NULL,
+  created_at INTEGER DEFAULT (strftime('%s', 'now'))
+);""")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS reviews_feedbackid_reviewer ON reviews (feedbackid, reviewer_id);")
+
+    for feedbackid, reviewers in conn.execute("SELECT feedbackid, reviewers FROM postbank;").fetchall():
+        # New posts were seeded with the placeholder '0,1', which are not real reviewers.
+        reviewer_ids = {r.strip() for r in reviewers.split(',')} - {'', '0', '1'}
+        conn.executemany("INSERT OR IGNORE INTO reviews (feedbackid, reviewer_id, created_at) VALUES (?,?,NULL);",
+                         [(feedbackid, r) for r in reviewer_ids])
+
+    # SQLite can't reliably drop a column in place, so rebuild the table without `reviewers`.
+    conn.execute("""CREATE TABLE postbank_new (
+  feedbackid INTEGER PRIMARY KEY AUTOINCREMENT,
+  userid TEXT NOT NULL,
+  link TEXT NOT NULL,
+  numreviews INTEGER NOT NULL DEFAULT 0
+);""")
+    conn.execute("""INSERT INTO postbank_new (feedbackid, userid, link, numreviews)
+SELECT feedbackid, userid, link, (SELECT COUNT(*) FROM reviews WHERE reviews.feedbackid = postbank.feedbackid)
+FROM postbank;""")
+    conn.execute("DROP TABLE postbank;")
+    conn.execute("ALTER TABLE postbank_new RENAME TO postbank;")
+
+
+def _migrate_need_index(conn):
+    # Partial covering index for $need: only unreviewed posts, holding every column the listing reads.
+    conn.execute("CREATE INDEX IF NOT EXISTS postbank_need ON postbank (feedbackid, userid, link, numreviews) "
+                 "WHERE numreviews = 0;")
+
+
+def _migrate_link_canonical(conn):
+    # Duplicate detection keys off a normalized copy of the link, enforced by a unique index.
+    conn.execute("ALTER TABLE postbank ADD COLUMN link_canonical TEXT;")
+    seen = set()
+    for feedbackid, link in conn.execute("SELECT feedbackid, link FROM postbank ORDER BY feedbackid;").fetchall():
+        canonical = canonical_link(link)
+        if canonical in seen:
+            # Reposts from before the index existed keep a NULL key, so only the original claims the link.
+            continue
+        seen.add(canonical)
+        conn.execute("UPDATE postbank SET link_canonical=? WHERE feedbackid=?;", (canonical, feedbackid))
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS postbank_link_canonical ON postbank (link_canonical);")
+
+
+def _migrate_review_text(conn):
+    # Keep each review's text, full-text indexed. The table is rebuilt so reviews get an explicit INTEGER PRIMARY
+    # KEY: the FTS index refers to reviews by rowid, and VACUUM may renumber rowids that aren't declared.
+    conn.execute("""CREATE TABLE reviews_new (
+  review_id INTEGER PRIMARY KEY,
+  feedbackid INTEGER NOT NULL REFERENCES postbank(feedbackid),
+  reviewer_id TEXT NOT NULL,
+  created_at INTEGER DEFAULT (strftime('%s', 'now')),
+  text TEXT
+);""")
+    conn.execute("INSERT INTO reviews_new (review_id, feedbackid, reviewer_id, created_at) "
+                 "SELECT rowid, feedbackid, reviewer_id, created_at FROM reviews;")
+    conn.execute("DROP TABLE reviews;")
+    conn.execute("ALTER TABLE reviews_new RENAME TO reviews;")
+    conn.execute("CREATE UNIQUE INDEX reviews_feedbackid_reviewer ON reviews (feedbackid, reviewer_id);")
+
+    conn.execute("CREATE VIRTUAL TABLE reviews_fts USING fts5(text, content='reviews', content_rowid='review_id');")
+    conn.execute("""CREATE TRIGGER reviews_fts_insert AFTER INSERT ON reviews WHEN new.text IS NOT NULL BEGIN
+  INSERT INTO reviews_fts (rowid, text) VALUES (new.review_id, new.text);
+END;""")
+    conn.execute("""CREATE TRIGGER reviews_fts_delete AFTER DELETE ON reviews WHEN old.text IS NOT NULL BEGIN
+  INSERT INTO reviews_fts (reviews_fts, rowid, text) VALUES ('delete', old.review_id, old.text);
+END;""")
+    conn.execute("""CREATE TRIGGER reviews_fts_update AFTER UPDATE OF text ON reviews BEGIN
+  INSERT INTO reviews_fts (reviews_fts, rowid, text) SELECT 'delete', old.review_id, old.text WHERE old.text IS NOT NULL;
+  INSERT INTO reviews_fts (rowid, text) SELECT new.review_id, new.text WHERE new.text IS NOT NULL;
+END;""")
+
+
+# Recomputes user_stats from scratch. Each review earns its reviewer one credit.
+REBUILD_STATS = """DELETE FROM user_stats;
+INSERT INTO user_stats (userid, posts, reviews_received)
+SELECT userid, COUNT(*), SUM(numreviews) FROM (
+  SELECT userid, numreviews FROM postbank UNION ALL SELECT userid, numreviews FROM postbank_archive
+) GROUP BY userid;
+INSERT INTO user_stats (userid, reviews_given, credits_earned)
+SELECT reviewer_id, COUNT(*), COUNT(*) FROM reviews WHERE true GROUP BY reviewer_id
+ON CONFLICT (userid) DO UPDATE SET reviews_given = excluded.reviews_given, credits_earned = excluded.credits_earned;"""
+
+# Leaderboard orderings. Each one is served by an index on user_stats, so a top-k query reads k rows.
+LEADERBOARDS = {
+    'given': "SELECT userid, reviews_given FROM user_stats ORDER BY reviews_given DESC LIMIT ?;",
+    'received': "SELECT userid, reviews_received FROM user_stats ORDER BY reviews_received DESC LIMIT ?;",
+    'posts': "SELECT userid, posts FROM user_stats ORDER BY posts DESC LIMIT ?;",
+    # Posters whose tracks get the least feedback. The WHERE matches the partial user_stats_starved index.
+    'starved': "SELECT userid, reviews_received FROM user_stats WHERE posts > 0 ORDER BY reviews_received LIMIT ?;",
+}
+
+
+def _migrate_user_stats(conn):
+    # Per-user totals, kept up to date by the same transactions that write posts and reviews.
+    conn.execute("""CREATE TABLE user_stats (
+  userid TEXT PRIMARY KEY,
+  posts INTEGER NOT NULL DEFAULT 0,
+  reviews_given INTEGER NOT NULL DEFAULT 0,
+  reviews_received INTEGER NOT NULL DEFAULT 0,
+  credits_earned INTEGER NOT NULL DEFAULT 0
+);""")
+    conn.execute("CREATE INDEX user_stats_given ON user_stats (reviews_given);")
+    conn.execute("CREATE INDEX user_stats_received ON user_stats (reviews_received);")
+    conn.execute("CREATE INDEX user_stats_posts ON user_stats (posts);")
+    # Backfill. This predates the archive table, so it can't use REBUILD_STATS.
+    conn.execute("INSERT INTO user_stats (userid, posts, reviews_received) "
+                 "SELECT userid, COUNT(*), SUM(numreviews) FROM postbank GROUP BY userid;")
+    conn.execute("INSERT INTO user_stats (userid, reviews_given, credits_earned) "
+                 "SELECT reviewer_id, COUNT(*), COUNT(*) FROM reviews WHERE true GROUP BY reviewer_id "
+                 "ON CONFLICT (userid) DO UPDATE SET reviews_given = excluded.reviews_given, "
+                 "credits_earned = excluded.credits_earned;")
+
+
+def _migrate_archive(conn):
+    # Old posts move out of the hot table into postbank_archive. Posts now record when they were made; older rows
+    # count from this migration, since their real age is unknown.
+    conn.execute("ALTER TABLE postbank ADD COLUMN created_at INTEGER;")
+    conn.execute("UPDATE postbank SET created_at = strftime('%s', 'now');")
+    conn.execute("CREATE INDEX postbank_created_at ON postbank (created_at);")
+    conn.execute("""CREATE TABLE postbank_archive (
+  feedbackid INTEGER PRIMARY KEY,
+  userid TEXT NOT NULL,
+  link TEXT NOT NULL,
+  numreviews INTEGER NOT NULL DEFAULT 0,
+  link_canonical TEXT,
+  created_at INTEGER,
+  archived_at INTEGER
+);""")
+    # Archived links still count as submitted, so duplicate detection probes this index too.
+    conn.execute("CREATE UNIQUE INDEX postbank_archive_link_canonical ON postbank_archive (link_canonical);")
+
+
+def _migrate_youtube_keys(conn):
+    # YouTube links without a video ID used to lose their whole query, so every playlist shared one key. Rekey them;
+    # a row whose new key is already taken keeps its old one.
+    for table in ('postbank', 'postbank_archive'):
+        rows = conn.execute(f"SELECT feedbackid, link, link_canonical FROM {table} "
+                            f"WHERE link_canonical LIKE 'youtube.com/%';").fetchall()
+        for feedbackid, link, old in rows:
+            canonical = canonical_link(link)
+            if canonical != old:
+                conn.execute(f"UPDATE OR IGNORE {table} SET link_canonical=? WHERE feedbackid=?;",
+                             (canonical, feedbackid))
+
+
+def _migrate_starved_index(conn):
+    # The starved leaderboard only ranks users who have posted, so index just those; otherwise the scan first walks
+    # every reviewer who never posted.
+    conn.execute("CREATE INDEX IF NOT EXISTS user_stats_starved ON user_stats (reviews_received) WHERE posts > 0;")
+
+
+def rebuild_stats(conn):
+    """Recomputes user_stats from the posts and reviews tables in one transaction."""
+    with conn:
+        for statement in REBUILD_STATS.split(";\n"):
+            conn.execute(statement)
+
+
+def _bump_stats(conn, userid, posts=0, given=0, received=0, credits=0):
+    conn.execute("""INSERT INTO user_stats (userid, posts, reviews_given, reviews_received, credits_earned)
+VALUES (?,?,?,?,?)
+ON CONFLICT (userid) DO UPDATE SET posts = posts + excluded.posts,
+  reviews_given = reviews_given + excluded.reviews_given,
+  reviews_received = reviews_received + excluded.reviews_received,
+  credits_earned = credits_earned + excluded.credits_earned;""", (str(userid), posts, given, received, credits))
+
+
+# Schema migrations, applied in order. PRAGMA user_version records how many have run on a database.
+MIGRATIONS = [
+    _migrate_reviews_table,
+    _migrate_need_index,
+    _migrate_link_canonical,
+    _migrate_review_text,
+    _migrate_user_stats,
+    _migrate_archive,
+    _migrate_youtube_keys,
+    _migrate_starved_index,
+]
+
+
+class InitDb(object):
+    """Creates the PostBank tables on an open connection and migrates them to the current schema."""
+
+    def __init__(self, conn):
+        self.create_table(conn, SCHEMA)
+        conn.commit()
+        self.migrate(conn)
+
+    def create_table(self, conn, create_table_sql):
+        # Create the tables IF NOT EXIST.
+        try:
+            c = conn.cursor()
+            c.executescript(create_table_sql)
+
+        except Exception:
+            log.exception("Error creating the PostBank tables")
+
+    def migrate(self, conn):
+        version = conn.execute("PRAGMA user_version;").fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            # Each migration and its version bump commit together, or not at all.
+            with conn:
+                conn.execute("BEGIN;")
+                migration(conn)
+                conn.execute(f"PRAGMA user_version={number};")
+
+
+class PostBankDB(object):
+    """Async data-access layer for the postbank database.
+
+    A single long-lived connection is owned by a dedicated worker thread, so every query runs off the event loop
+    and is serialized without the connect/close churn of opening the file per command."""
+
+    def __init__(self, db_file):
+
+        self.db_file = db_file
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="postbank-db")
+
+    def _connect(self):
+        db_dir = os.path.dirname(self.db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_file, timeout=BUSY_TIMEOUT_MS / 1000)
+        # Only takes effect on a new, empty file: it has to come before anything else writes the first page.
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS};")
+        conn.execute("PRAGMA synchronous=NORMAL;")  # Safe with WAL, and avoids an fsync per commit.
+        InitDb(conn)
+        return conn
+
+    def _call(self, func, args):
+        # Always runs on the worker thread, so the connection never crosses threads.
+        if self._conn is None:
+            self._conn = self._connect()
+        with perf.timer("sql." + func.__name__.lstrip("_")):
+            return func(self._conn, *args)
+
+    async def run(self, func, *args):
+        """Runs func(conn, *args) on the database thread and returns its result."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, self._call, func, args)
+
+    def close(self):
+        """Closes the connection and stops the worker thread once pending queries have finished."""
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+        self._executor.submit(_close)
+        self._executor.shutdown(wait=False)
+
+    # Queries. Each underscored static method runs on the worker thread with the shared connection.
+
+    @staticmethod
+    def _get_owner(conn, feedbackid):
+        row = conn.execute("SELECT userid FROM postbank WHERE feedbackid = ?;", (feedbackid,)).fetchone()
+        return row[0] if row is not None else None
+
+    async def get_owner(self, feedbackid):
+        """Returns the userid that submitted feedbackid, or None if the ID doesn't exist."""
+        return await self.run(self._get_owner, feedbackid)
+
+    @staticmethod
+    def _update_link(conn, feedbackid, link):
+        canonical = canonical_link(link)
+        if conn.execute("SELECT 1 FROM postbank_archive WHERE link_canonical=?;", (canonical,)).fetchone():
+            return False
+        try:
+            with conn:
+                conn.execute("UPDATE postbank SET link=?, link_canonical=? WHERE feedbackid=?;",
+                             (link, canonical, feedbackid))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    async def update_link(self, feedbackid, link):
+        """Changes the link of a post. Returns False if another post already has that link."""
+        return await self.run(self._update_link, feedbackid, link)
+
+    @staticmethod
+    def _recent(conn, limit, before):
+        if before is None:
+            before = NEWEST  # Start from the newest post.
+        return conn.execute("SELECT feedbackid, userid, link, numreviews FROM postbank "
+                            "WHERE feedbackid < ? ORDER BY feedbackid DESC LIMIT ?;", (before, limit)).fetchall()
+
+    async def recent(self, limit=10, before=None):
+        """Returns up to `limit` posts, newest first, with feedbackid below `before` if given."""
+        return await self.run(self._recent, limit, before)
+
+    @staticmethod
+    def _need(conn, limit, before):
+        if before is None:
+            before = NEWEST
+        return conn.execute("SELECT feedbackid, userid, link, numreviews FROM postbank "
+                            "WHERE numreviews = 0 AND feedbackid < ? ORDER BY feedbackid DESC LIMIT ?;",
+                            (before, limit)).fetchall()
+
+    async def need(self, limit=10, before=None):
+        """Returns up to `limit` posts without any feedback, newest first, with feedbackid below `before` if given."""
+        return await self.run(self._need, limit, before)
+
+    @staticmethod
+    def _add_post(conn, userid, link):
+        # The unique index on link_canonical is the duplicate check for the hot table; archived links are one more
+        # index probe. The worker thread serializes both, so there's no window for a duplicate between them.
+        canonical = canonical_link(link)
+        if conn.execute("SELECT 1 FROM postbank_archive WHERE link_canonical=?;", (canonical,)).fetchone():
+            return None
+        try:
+            with conn:
+                cur = conn.execute("INSERT INTO postbank (userid, link, link_canonical, numreviews, created_at) "
+                                   "VALUES (?,?,?,0,strftime('%s', 'now'));", (str(userid), str(link), canonical))
+                _bump_stats(conn, userid, posts=1)
+        except sqlite3.IntegrityError:
+            return None
+        return cur.lastrowid
+
+    async def add_post(self, userid, link):
+        """Inserts a new post and returns its feedback ID, or None if the link was already submitted."""
+        return await self.run(self._add_post, userid, link)
+
+    @staticmethod
+    def _get_post(conn, feedbackid):
+        return conn.execute("SELECT userid, numreviews FROM postbank WHERE feedbackid=?;", (feedbackid,)).fetchone()
+
+    async def get_post(self, feedbackid):
+        """Returns (userid, numreviews) for feedbackid in a single primary-key lookup, or None."""
+        return await self.run(self._get_post, feedbackid)
+
+    @staticmethod
+    def _add_review(conn, feedbackid, reviewer_id, text):
+        try:
+            with conn:
+                cur = conn.execute("INSERT OR IGNORE INTO reviews (feedbackid, reviewer_id, text) VALUES (?,?,?);",
+                                   (feedbackid, str(reviewer_id), text))
+                if cur.rowcount == 0:
+                    return False
+                if conn.execute("UPDATE postbank SET numreviews = numreviews + 1 WHERE feedbackid=?;",
+                                (feedbackid,)).rowcount == 0:
+                    # Archived or rolled back since the caller looked it up; raising undoes the review.
+                    raise LookupError(feedbackid)
+                _bump_stats(conn, reviewer_id, given=1, credits=1)
+                _bump_stats(conn, conn.execute("SELECT userid FROM postbank WHERE feedbackid=?;",
+                                               (feedbackid,)).fetchone()[0], received=1)
+        except LookupError:
+            return None
+        return True
+
+    async def add_review(self, feedbackid, reviewer_id, text=None):
+        """Records a review and bumps numreviews in one transaction.
+
+        Returns False if reviewer_id already reviewed this post, and None if the post is no longer in the hot
+        table."""
+        return await self.run(self._add_review, feedbackid, reviewer_id, text)
+
+    @staticmethod
+    def _get_reviews(conn, feedbackid, limit, offset):
+        return conn.execute("SELECT reviewer_id, created_at, text FROM reviews WHERE feedbackid=? "
+                            "ORDER BY review_id LIMIT ? OFFSET ?;", (feedbackid, limit, offset)).fetchall()
+
+    async def get_reviews(self, feedbackid, limit=5, offset=0):
+        """Returns (reviewer_id, created_at, text) for one page of a post's reviews, oldest first."""
+        return await self.run(self._get_reviews, feedbackid, limit, offset)
+
+    @staticmethod
+    def _search_reviews(conn, terms, limit, offset):
+        # Quote every term so user input can't inject FTS5 query syntax; the terms are ANDed together.
+        query = " ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+        return conn.execute("SELECT reviews.feedbackid, reviews.reviewer_id, "
+                            "snippet(reviews_fts, 0, '**', '**', '...', 16) "
+                            "FROM reviews_fts JOIN reviews ON reviews.review_id = reviews_fts.rowid "
+                            "WHERE reviews_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?;",
+                            (query, limit, offset)).fetchall()
+
+    async def search_reviews(self, terms, limit=5, offset=0):
+        """Returns (feedbackid, reviewer_id, snippet) for reviews matching every term, best match first."""
+        return await self.run(self._search_reviews, terms, limit, offset)
+
+    @staticmethod
+    def _delete_post(conn, feedbackid):
+        with conn:
+            row = conn.execute("SELECT userid, numreviews FROM postbank WHERE feedbackid=?;", (feedbackid,)).fetchone()
+            if row is None:
+                return
+            for (reviewer_id,) in conn.execute("SELECT reviewer_id FROM reviews WHERE feedbackid=?;",
+                                               (feedbackid,)).fetchall():
+                _bump_stats(conn, reviewer_id, given=-1, credits=-1)
+            _bump_stats(conn, row[0], posts=-1, received=-row[1])
+            conn.execute("DELETE FROM reviews WHERE feedbackid=?;", (feedbackid,))
+            conn.execute("DELETE FROM postbank WHERE feedbackid=?;", (feedbackid,))
+
+    async def delete_post(self, feedbackid):
+        """Removes a post and its reviews. Used to roll back a post whose credit withdrawal failed."""
+        await self.run(self._delete_post, feedbackid)
+
+    @staticmethod
+    def _remove_review(conn, feedbackid, reviewer_id):
+        with conn:
+            cur = conn.execute("DELETE FROM reviews WHERE feedbackid=? AND reviewer_id=?;",
+                               (feedbackid, str(reviewer_id)))
+            if cur.rowcount:
+                _bump_stats(conn, reviewer_id, given=-1, credits=-1)
+                # The post may have been archived since the review was added; its reviews stay in place then.
+                for table in ('postbank', 'postbank_archive'):
+                    if conn.execute(f"UPDATE {table} SET numreviews = numreviews - 1 WHERE feedbackid=?;",
+                                    (feedbackid,)).rowcount:
+                        _bump_stats(conn, conn.execute(f"SELECT userid FROM {table} WHERE feedbackid=?;",
+                                                       (feedbackid,)).fetchone()[0], received=-1)
+                        break
+
+    async def remove_review(self, feedbackid, reviewer_id):
+        """Undoes add_review. Used to roll back a review whose credit deposit failed."""
+        await self.run(self._remove_review, feedbackid, reviewer_id)
+
+    @staticmethod
+    def _get_stats(conn, userid):
+        return conn.execute("SELECT posts, reviews_given, reviews_received, credits_earned FROM user_stats "
+                            "WHERE userid=?;", (str(userid),)).fetchone()
+
+    async def get_stats(self, userid):
+        """Returns (posts, reviews_given, reviews_received, credits_earned) for a user, or None."""
+        return await self.run(self._get_stats, userid)
+
+    @staticmethod
+    def _leaderboard(conn, kind, limit):
+        return conn.execute(LEADERBOARDS[kind], (limit,)).fetchall()
+
+    async def leaderboard(self, kind='given', limit=10):
+        """Returns the top `limit` (userid, value) rows for one of the LEADERBOARDS orderings."""
+        return await self.run(self._leaderboard, kind, limit)
+
+    @staticmethod
+    def _rebuild_stats(conn):
+        rebuild_stats(conn)
+
+    async def rebuild_stats(self):
+        """Recomputes user_stats from the posts and reviews tables."""
+        await self.run(self._rebuild_stats)
+
+    @staticmethod
+    def _archive_batch(conn, cutoff, min_reviews, limit):
+        # A post is archived once it's older than `cutoff`, or once it has `min_reviews` reviews (if set).
+        if min_reviews > 0:
+            rows = conn.execute("SELECT feedbackid FROM postbank WHERE created_at < ? "
+                                "UNION SELECT feedbackid FROM postbank WHERE numreviews >= ? LIMIT ?;",
+                                (cutoff, min_reviews, limit))
+        else:
+            rows = conn.execute("SELECT feedbackid FROM postbank WHERE created_at < ? LIMIT ?;", (cutoff, limit))
+        ids = [(row[0],) for row in rows]
+        if not ids:
+            return 0, 0
+        with conn:
+            # A link the archive already claims (e.g. after an import) is copied with a NULL key, like the reposts
+            # _migrate_link_canonical found, so the post is kept rather than ignored.
+            conn.executemany("INSERT OR IGNORE INTO postbank_archive "
+                             "(feedbackid, userid, link, numreviews, link_canonical, created_at, archived_at) "
+                             "SELECT feedbackid, userid, link, numreviews, CASE WHEN EXISTS (SELECT 1 FROM "
+                             "postbank_archive a WHERE a.link_canonical = p.link_canonical) THEN NULL "
+                             "ELSE link_canonical END, created_at, strftime('%s', 'now') "
+                             "FROM postbank p WHERE feedbackid=?;", ids)
+            # Only posts the archive now holds leave the hot table. One whose ID the archive already uses for a
+            # different post stays where it is.
+            moved = conn.executemany("DELETE FROM postbank WHERE feedbackid=? AND EXISTS (SELECT 1 FROM "
+                                     "postbank_archive a WHERE a.feedbackid = postbank.feedbackid "
+                                     "AND a.userid = postbank.userid AND a.link = postbank.link);", ids).rowcount
+        return len(ids), moved
+
+    async def archive(self, cutoff, min_reviews=0, batch_size=1000):
+        """Moves posts made before the `cutoff` timestamp (or with min_reviews+ reviews) into postbank_archive.
+
+        Each batch is its own short transaction, so commands queued on the database run in between.
+        Returns how many posts were moved."""
+        moved = 0
+        while True:
+            selected, n = await self.run(self._archive_batch, cutoff, min_reviews, batch_size)
+            moved += n
+            if selected > n:
+                perf.incr("postbank.archive_conflicts", selected - n)
+            if selected < batch_size or n == 0:
+                return moved
+
+    @staticmethod
+    def _compact(conn, pages):
+        # Databases created before incremental auto_vacuum was set need a full VACUUM to switch, which would hold the
+        # database thread for as long as it takes, so that's left to `migrate_bank.py vacuum` with the bot stopped.
+        # Until then SQLite still reuses their free pages.
+        if conn.execute("PRAGMA auto_vacuum;").fetchone()[0] == 2:
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)});")
+        conn.execute("PRAGMA analysis_limit=1000;")  # Keeps ANALYZE to a sample instead of a full scan.
+        conn.execute("PRAGMA optimize;")
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE);")
+
+    async def compact(self, pages=2000):
+        """Frees up to `pages` unused pages and refreshes query planner stats."""
+        await self.run(self._compact, pages)